@@ -0,0 +1,170 @@
+"""Latency analytics over arbitrary windows, computed in SQLite from raw samples and rollups.
+
+Nothing here loads individual samples into Python: every segment of a window
+is reduced by SQL aggregates plus a SUM ... GROUP BY over quantile-sketch keys.
+Recent windows still held in a provider's in-memory ring buffer are computed
+from its array views instead, with exact percentiles.
+"""
+import math
+
+import ringbuffer
+import rollups
+import sketch
+
+_FIELDS = ("count", "ping_count", "min", "max", "sum", "sumsq", "doh_ok", "st", "stt", "stp")
+
+
+def plan(since, now, watermarks, retention):
+    """Split [since, now) into (source, start, end) segments covering each sample once.
+
+    Samples not yet rolled up come from the raw table. Older ranges come from
+    the finest resolution whose retention still reaches ``since``; each
+    coarser level only covers what the level below it has already folded in.
+    ``retention`` maps "raw" and each resolution name to seconds.
+    """
+    segments = []
+    upper = now
+    source = "raw"
+    for name, _, _ in rollups.RESOLUTIONS:
+        mark = watermarks.get(name)
+        if since >= now - retention[source] or mark is None or mark <= since:
+            segments.append((source, since, upper))
+            return segments
+        segments.append((source, mark, upper))
+        upper = mark
+        source = name
+    segments.append((source, since, upper))
+    return segments
+
+
+def _raw_segment(conn, provider, start, end, origin):
+    row = conn.execute(
+        "SELECT COUNT(*), COUNT(ping), MIN(ping), MAX(ping), TOTAL(ping), TOTAL(ping * ping), TOTAL(doh_ok),"
+        " TOTAL(CASE WHEN ping IS NOT NULL THEN ts - ? END),"
+        " TOTAL(CASE WHEN ping IS NOT NULL THEN (ts - ?) * (ts - ?) END),"
+        " TOTAL((ts - ?) * ping)"
+        " FROM ping_history WHERE provider = ? AND ts >= ? AND ts < ?",
+        (origin, origin, origin, origin, provider, start, end),
+    ).fetchone()
+    keys = conn.execute(
+        "SELECT ping_key, COUNT(*) FROM ping_history"
+        " WHERE provider = ? AND ts >= ? AND ts < ? AND ping_key IS NOT NULL GROUP BY ping_key",
+        (provider, start, end),
+    ).fetchall()
+    return row, keys
+
+
+def _rollup_segment(conn, provider, resolution, start, end, origin):
+    width = dict((name, w) for name, w, _ in rollups.RESOLUTIONS)[resolution]
+    first = start // width * width
+    mid = f"(bucket + {width / 2} - ?)"
+    row = conn.execute(
+        "SELECT SUM(count), SUM(ping_count), MIN(ping_min), MAX(ping_max), TOTAL(ping_sum), TOTAL(ping_sumsq),"
+        f" TOTAL(doh_ok), TOTAL(ping_count * {mid}), TOTAL(ping_count * {mid} * {mid}), TOTAL(ping_sum * {mid})"
+        f" FROM {rollups.table_name(resolution)} WHERE provider = ? AND bucket >= ? AND bucket < ?",
+        (origin, origin, origin, origin, provider, first, end),
+    ).fetchone()
+    keys = conn.execute(
+        f"SELECT key, SUM(count) FROM {rollups.sketch_table_name(resolution)}"
+        " WHERE provider = ? AND bucket >= ? AND bucket < ? GROUP BY key",
+        (provider, first, end),
+    ).fetchall()
+    return row, keys
+
+
+def window_stats(conn, provider, since, now, retention):
+    """Latency statistics for provider over [since, now).
+
+    Returns count (samples with a latency), samples (all probes),
+    min/max/avg, p50/p90/p99 (sketch estimates within
+    sketch.RELATIVE_ACCURACY), jitter (standard deviation of latency),
+    availability (share of DoH checks that succeeded), trend (least-squares
+    latency slope in ms per hour) and the segments that were read.
+    """
+    totals = dict.fromkeys(_FIELDS, 0.0)
+    totals["min"] = totals["max"] = None
+    key_counts = {}
+    segments = plan(since, now, rollups.watermarks(conn), retention)
+    for source, start, end in segments:
+        if end <= start:
+            continue
+        if source == "raw":
+            row, keys = _raw_segment(conn, provider, start, end, since)
+        else:
+            row, keys = _rollup_segment(conn, provider, source, start, end, since)
+        row = dict(zip(_FIELDS, row))
+        for field in ("count", "ping_count", "sum", "sumsq", "doh_ok", "st", "stt", "stp"):
+            totals[field] += row[field] or 0
+        if row["min"] is not None:
+            totals["min"] = row["min"] if totals["min"] is None else min(totals["min"], row["min"])
+            totals["max"] = row["max"] if totals["max"] is None else max(totals["max"], row["max"])
+        for bucket_key, count in keys:
+            key_counts[bucket_key] = key_counts.get(bucket_key, 0) + count
+
+    n = totals["ping_count"]
+    stats = {
+        "count": int(n),
+        "samples": int(totals["count"]),
+        "min": totals["min"],
+        "max": totals["max"],
+        "avg": None, "p50": None, "p90": None, "p99": None,
+        "jitter": None, "availability": None, "trend": None,
+        "segments": [{"source": s, "start": a, "end": b} for s, a, b in segments],
+    }
+    if totals["count"]:
+        stats["availability"] = round(totals["doh_ok"] / totals["count"], 4)
+    if n:
+        avg = totals["sum"] / n
+        stats["avg"] = round(avg, 2)
+        stats["jitter"] = round(math.sqrt(max(totals["sumsq"] / n - avg * avg, 0.0)), 2)
+        p50, p90, p99 = sketch.quantiles(key_counts.items(), [0.5, 0.9, 0.99])
+        clamp = lambda v: None if v is None else min(max(v, totals["min"]), totals["max"])
+        stats["p50"], stats["p90"], stats["p99"] = clamp(p50), clamp(p90), clamp(p99)
+        denominator = n * totals["stt"] - totals["st"] ** 2
+        if n >= 2 and denominator > 0:
+            slope = (n * totals["stp"] - totals["st"] * totals["sum"]) / denominator
+            stats["trend"] = round(slope * 3600, 3)
+    return stats
+
+
+def buffer_stats(buffer, since, now):
+    """window_stats for [since, now) computed from a ringbuffer.RingBuffer that covers the window."""
+    pings, samples, doh_ok = [], 0, 0
+    n = st = stt = stp = total = sumsq = 0.0
+    with buffer.lock:
+        for ts, latency, status in buffer.segments(since=since):
+            for t, ping, flags in zip(ts, latency, status):
+                if t >= now:
+                    break
+                samples += 1
+                doh_ok += flags & ringbuffer.DOH_OK
+                if flags & ringbuffer.PING_OK:
+                    x = t - since
+                    pings.append(ping)
+                    n += 1
+                    st += x
+                    stt += x * x
+                    stp += x * ping
+                    total += ping
+                    sumsq += ping * ping
+    stats = {
+        "count": len(pings),
+        "samples": samples,
+        "min": min(pings) if pings else None,
+        "max": max(pings) if pings else None,
+        "avg": None, "p50": None, "p90": None, "p99": None,
+        "jitter": None, "availability": None, "trend": None,
+        "segments": [{"source": "memory", "start": since, "end": now}],
+    }
+    if samples:
+        stats["availability"] = round(doh_ok / samples, 4)
+    if pings:
+        avg = total / n
+        stats["avg"] = round(avg, 2)
+        stats["jitter"] = round(math.sqrt(max(sumsq / n - avg * avg, 0.0)), 2)
+        pings.sort()
+        stats["p50"], stats["p90"], stats["p99"] = (pings[sketch.rank(q, len(pings))] for q in (0.5, 0.9, 0.99))
+        denominator = n * stt - st ** 2
+        if n >= 2 and denominator > 0:
+            stats["trend"] = round((n * stp - st * total) / denominator * 3600, 3)
+    return stats
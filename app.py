@@ -1,6 +1,6 @@
 import os
 import config
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, g
 from flasgger import Swagger
 import json
 import logging
@@ -10,9 +10,34 @@ from functools import wraps
 from urllib.parse import urlparse
 import datetime
 import time
-from flask_socketio import SocketIO
-import requests
-import sqlite3
+import threading
+from flask_socketio import SocketIO, join_room, leave_room
+import atexit
+import uuid
+import queue
+import doh
+import latency
+import rollups
+import sketch
+import analytics
+import autoselect
+import hedge
+import lookup
+import benchmark
+import metrics
+import profiling
+import stream
+import ringbuffer
+import scheduler
+import breaker
+import concurrency
+from storage import Storage
+from filecache import CachedFile, FileWatcher, atomic_write
+from introspect import Introspector
+from providers import ProviderRegistry, normalize_url
+from switcher import SwitchManager, SwitchInProgress, resolver_answers
+from forwarder import Forwarder
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 
 app = Flask(__name__)
 # load configuration
@@ -25,7 +50,10 @@ socketio = SocketIO(app)
 # Constants
 PROVIDERS_FILE = "doh_providers.json"
 BACKUP_FILE = "doh_providers_backup.json"
-SERVICE_FILES = ["/etc/systemd/system/cloudflared.service"]
+# cloudflared unit file, from config so it can point at a fixture
+SERVICE_FILE = app.config['SERVICE_FILE']
+# upstream selected for the built-in forwarder, kept across restarts
+FORWARDER_STATE_FILE = "forwarder_upstream.json"
 DEFAULT_PROVIDERS = [
     {"name": "Cloudflare", "url": "https://cloudflare-dns.com/dns-query"},
     {"name": "Google", "url": "https://dns.google/dns-query"},
@@ -35,6 +63,8 @@ DEFAULT_PROVIDERS = [
     {"name": "AdGuard", "url": "https://dns.adguard.com/dns-query"},
     {"name": "SecureDNS", "url": "https://doh.securedns.eu/dns-query"},
 ]
+# parsed providers file, re-read only when the file changes
+provider_registry = ProviderRegistry(PROVIDERS_FILE)
 
 # Configure logging
 # log file path from config
@@ -52,26 +82,149 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s",
 )
 
+# Prometheus metrics served at /metrics
+metrics_registry = metrics.Registry()
+ping_seconds = metrics_registry.histogram("doh_switcher_ping_seconds", "Provider round-trip time.", ["provider"])
+doh_query_seconds = metrics_registry.histogram("doh_switcher_doh_query_seconds", "DoH probe query time.", ["provider"])
+doh_probes_total = metrics_registry.counter("doh_switcher_doh_probes_total", "DoH probes by outcome.", ["provider", "ok"])
+http_request_seconds = metrics_registry.histogram(
+    "doh_switcher_http_request_seconds", "HTTP request latency by route.", ["method", "route", "status"])
+subprocess_seconds = metrics_registry.histogram(
+    "doh_switcher_subprocess_seconds", "Duration of spawned commands; the count is the number of spawns.", ["command"])
+sqlite_commit_seconds = metrics_registry.histogram("doh_switcher_sqlite_commit_seconds", "SQLite group commit latency.")
+sqlite_writes_total = metrics_registry.counter("doh_switcher_sqlite_writes_total", "Statements committed by the SQLite writer.")
+metrics_registry.gauge("doh_switcher_sqlite_queue_depth", "Writes waiting for the SQLite writer.",
+                       function=lambda: storage.pending())
+tick_seconds = metrics_registry.histogram("doh_switcher_background_tick_seconds", "Duration of one status tick.")
+socketio_clients = metrics_registry.gauge("doh_switcher_socketio_clients", "Connected Socket.IO clients.")
+socketio_clients.set(0)
+
+
+def observe_commit(statements, seconds):
+    sqlite_writes_total.inc(statements)
+    sqlite_commit_seconds.observe(seconds)
+
+
+def run_command(cmd, **kwargs):
+    """subprocess.run off the event loop, counting and timing every spawned command."""
+    name = cmd[1] if cmd[0] == "sudo" and len(cmd) > 1 else cmd[0]
+    start = time.perf_counter()
+    try:
+        return concurrency.offload(subprocess.run, cmd, **kwargs)
+    finally:
+        subprocess_seconds.observe(time.perf_counter() - start, command=name)
+
+
 # Cache for test results
 test_results = {}
-ping_history = {}  # in-memory history for WebSocket; persisted in DB
+profile_lock = threading.Lock()
+# EWMA provider scores for automatic upstream selection
+auto_selector = autoselect.AutoSelector(
+    alpha=app.config['AUTOSELECT_ALPHA'],
+    margin=app.config['AUTOSELECT_MARGIN'],
+    sustain=app.config['AUTOSELECT_SUSTAIN'],
+    dwell=app.config['AUTOSELECT_DWELL'],
+    failure_penalty=app.config['AUTOSELECT_FAILURE_PENALTY'],
+)
+auto_selector.enabled = bool(app.config['AUTOSELECT_ENABLED'])
+# recent samples per provider in typed-array ring buffers; persisted in DB
+ping_buffers = ringbuffer.RingBuffers(app.config['HISTORY_BUFFER_SIZE'])
+# circuit breakers and latency-derived probe timeouts, keyed by normalized provider URL
+provider_health = breaker.ProviderHealth(
+    threshold=app.config['BREAKER_THRESHOLD'],
+    reset=app.config['BREAKER_RESET'],
+    max_reset=app.config['BREAKER_MAX_RESET'],
+    multiplier=app.config['ADAPTIVE_TIMEOUT_MULTIPLIER'],
+    floor=app.config['ADAPTIVE_TIMEOUT_MIN'],
+)
+# per-provider Socket.IO rooms: a snapshot on subscribe, then deltas
+status_stream = stream.StatusStream(
+    history_size=app.config['STREAM_HISTORY_SIZE'],
+    max_lag=app.config['STREAM_MAX_LAG'],
+    compress_threshold=app.config['STREAM_COMPRESS_THRESHOLD'],
+)
+
+# shared keep-alive connection pools for all DoH traffic
+doh_pool = doh.DohPool(
+    idle_timeout=app.config['DOH_POOL_IDLE_TIMEOUT'],
+    max_connections=app.config['DOH_POOL_MAX_CONNECTIONS'],
+)
+atexit.register(doh_pool.close)
 
 # database path from config
 DB_PATH = app.config['DB_PATH']
+# tables pruned by the retention job
+HISTORY_TABLES = ("ping_history", "dns_lookup_history")
+# per-query details of in-process lookups, added to databases created before them
+LOOKUP_COLUMNS = {"qtype": "TEXT", "rcode": "TEXT", "ms": "REAL", "target": "TEXT", "error": "TEXT"}
+# per-phase DoH probe timings stored alongside ping/doh_ok
+DOH_TIMING_COLUMNS = ["dns_ms", "connect_ms", "tls_ms", "ttfb_ms", "doh_ms"]
+
+# single WAL-mode writer plus pooled read-only connections
+storage = Storage(
+    DB_PATH,
+    batch_size=app.config['DB_BATCH_SIZE'],
+    queue_size=app.config['DB_QUEUE_SIZE'],
+    read_pool_size=app.config['DB_READ_POOL_SIZE'],
+    on_commit=observe_commit,
+    on_read=lambda seconds: profiling.record("sqlite", seconds),
+    offload=concurrency.offload,
+)
+atexit.register(storage.close)
+
+def _create_schema(c):
+    c.execute("CREATE TABLE IF NOT EXISTS ping_history (id INTEGER PRIMARY KEY, provider TEXT, ts INTEGER, ping REAL, doh_ok INTEGER)")
+    c.execute("CREATE TABLE IF NOT EXISTS dns_lookup_history (id INTEGER PRIMARY KEY, domain TEXT, ts INTEGER, result TEXT)")
+    # migrate databases that stored local-time TEXT timestamps to UTC epoch seconds
+    for table in HISTORY_TABLES:
+        columns = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+        if "ts" not in columns:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN ts INTEGER")
+            c.execute(f"UPDATE {table} SET ts = CAST(strftime('%s', time, 'utc') AS INTEGER)")
+    c.execute("DROP INDEX IF EXISTS idx_ping_provider_time")
+    c.execute("DROP INDEX IF EXISTS idx_dns_time")
+    # create indexes for retention and query efficiency
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ping_provider_ts ON ping_history(provider, ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ping_ts ON ping_history(ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_dns_ts ON dns_lookup_history(ts)")
+    # DoH timing breakdown columns, added to databases created before they existed
+    columns = {row[1] for row in c.execute("PRAGMA table_info(ping_history)")}
+    for column in DOH_TIMING_COLUMNS:
+        if column not in columns:
+            c.execute(f"ALTER TABLE ping_history ADD COLUMN {column} REAL")
+    lookup_columns = {row[1] for row in c.execute("PRAGMA table_info(dns_lookup_history)")}
+    for column, kind in LOOKUP_COLUMNS.items():
+        if column not in lookup_columns:
+            c.execute(f"ALTER TABLE dns_lookup_history ADD COLUMN {column} {kind}")
+    # quantile sketch key of each ping, so window quantiles are a GROUP BY in SQL
+    if "ping_key" not in columns:
+        c.execute("ALTER TABLE ping_history ADD COLUMN ping_key INTEGER")
+        c.create_function("sketch_key", 1, sketch.key, deterministic=True)
+        c.execute("UPDATE ping_history SET ping_key = sketch_key(ping) WHERE ping IS NOT NULL")
+    rollups.create_schema(c)
+    benchmark.create_schema(c)
+    # outcome and time-to-ready of every provider switch
+    c.execute("CREATE TABLE IF NOT EXISTS switch_history (id INTEGER PRIMARY KEY, job_id TEXT, ts INTEGER,"
+              " provider TEXT, state TEXT, ready_ms REAL, error TEXT)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_switch_ts ON switch_history(ts)")
+    # every auto-select evaluation, including the ones that kept the current provider
+    c.execute("CREATE TABLE IF NOT EXISTS autoselect_decisions (id INTEGER PRIMARY KEY, ts INTEGER, current TEXT,"
+              " best TEXT, current_score REAL, best_score REAL, improvement REAL, action TEXT, reason TEXT)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_autoselect_ts ON autoselect_decisions(ts)")
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("CREATE TABLE IF NOT EXISTS ping_history (id INTEGER PRIMARY KEY, provider TEXT, time TEXT, ping REAL, doh_ok INTEGER)")
-    c.execute("CREATE TABLE IF NOT EXISTS dns_lookup_history (id INTEGER PRIMARY KEY, domain TEXT, time TEXT, result TEXT)")
-    # create indexes for retention and query efficiency
-    c.execute("CREATE INDEX IF NOT EXISTS idx_ping_provider_time ON ping_history(provider, time)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_dns_time ON dns_lookup_history(time)")
-    conn.commit()
-    conn.close()
+    storage.call(_create_schema)
 
 # initialize SQLite DB
 init_db()
+# warm the in-memory history from the raw samples retention keeps
+with storage.reader() as _conn:
+    ping_buffers.warm_up(_conn, int(time.time()) - app.config['RETENTION_HOURS'] * 3600)
+
+def format_ts(ts):
+    """Render an epoch timestamp in local time for display."""
+    return datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
 
 def log_event(message, level="info"):
     """Log events with specified level."""
@@ -83,36 +236,39 @@ def initialize_providers_file():
     """Create doh_providers.json with default providers if it doesn't exist."""
     if not os.path.exists(PROVIDERS_FILE):
         try:
-            with open(PROVIDERS_FILE, "w") as file:
-                json.dump(DEFAULT_PROVIDERS, file, indent=4)
+            atomic_write(PROVIDERS_FILE, json.dumps(DEFAULT_PROVIDERS, indent=4))
             log_event(f"Created {PROVIDERS_FILE} with default providers.")
         except IOError as e:
             log_event(f"Error creating {PROVIDERS_FILE}: {e}", "error")
             flash(f"Error creating providers file: {e}", "danger")
 
 
+@profiling.timed("load_providers")
 def load_providers():
     """Load providers from file or initialize with defaults."""
     initialize_providers_file()
     try:
-        with open(PROVIDERS_FILE, "r") as file:
-            providers = json.load(file)
-            # Ensure all providers have required fields
-            for provider in providers:
-                if not all(key in provider for key in ["name", "url"]):
-                    raise ValueError("Invalid provider format")
-            return providers
+        return provider_registry.all()
     except (json.JSONDecodeError, IOError, ValueError) as e:
         log_event(f"Error loading providers file: {e}", "error")
         flash(f"Error loading providers file: {e}", "danger")
         return DEFAULT_PROVIDERS
 
 
+def find_provider(url):
+    """Look up a provider by normalized URL, or None if unknown or unreadable."""
+    initialize_providers_file()
+    try:
+        return provider_registry.find(url)
+    except (json.JSONDecodeError, IOError, ValueError) as e:
+        log_event(f"Error loading providers file: {e}", "error")
+        return None
+
+
 def save_providers(providers):
     """Save providers to file."""
     try:
-        with open(PROVIDERS_FILE, "w") as file:
-            json.dump(providers, file, indent=4)
+        provider_registry.save(providers)
         log_event("Providers saved successfully.")
     except IOError as e:
         log_event(f"Error saving providers file: {e}", "error")
@@ -120,33 +276,78 @@ def save_providers(providers):
         raise
 
 
-def update_doh_service(doh_url):
-    """Update the cloudflared service with the new DoH URL."""
-    service_file = SERVICE_FILES[0]
+def update_doh_service(doh_url, name=None):
+    """Switch the resolver to the new DoH URL.
+
+    With the built-in forwarder enabled this is an in-memory upstream swap.
+    Otherwise a background job switches cloudflared. Returns the job; progress
+    is reported through switch_progress events and /api/switch/<job_id>.
+    Raises SwitchInProgress while another cloudflared switch runs.
+    """
+    if forwarder is not None:
+        job = switch_manager.swap(doh_url, name, set_forwarder_upstream)
+    else:
+        job = switch_manager.submit(doh_url, name)
+    log_event(f"Switch job {job.id} started for DoH URL: {doh_url}")
+    return job
+
+
+def switch_updated(job):
+    """Log, broadcast and (once finished) record a switch job's progress."""
+    if job.state == "ready":
+        log_event(f"Updated DoH URL to: {job.url} (ready after {job.ready_ms} ms)")
+        # manual switches also start a new auto-select dwell period; rolled-back ones never took effect
+        auto_selector.switched()
+    elif job.state in ("rolled_back", "failed"):
+        log_event(f"Switch to {job.url} {job.state}: {job.error}", "error")
+        # without a cooldown the next step would retry the same provider while it still scores best
+        auto_selector.failed(job.url)
+    socketio.emit("switch_progress", job.as_dict())
+    if job.done:
+        storage.execute(
+            "INSERT INTO switch_history (job_id, ts, provider, state, ready_ms, error) VALUES (?, ?, ?, ?, ?, ?)",
+            (job.id, int(job.finished or time.time()), job.url, job.state, job.ready_ms, job.error),
+        )
+
+
+# restarts and polls cloudflared; with the forwarder enabled, switches are in-memory swaps instead
+switch_manager = SwitchManager(
+    SERVICE_FILE,
+    resolver=(app.config['LOCAL_RESOLVER'], app.config['LOCAL_RESOLVER_PORT']),
+    probe_name=app.config['DOH_PROBE_DOMAIN'],
+    ready_timeout=app.config['SWITCH_READY_TIMEOUT'],
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep,
+    on_update=switch_updated,
+    run=run_command,
+    check=concurrency.offloaded(resolver_answers),
+)
+
+
+def load_forwarder_upstream():
+    """Upstream for the forwarder: the saved choice, else cloudflared's, else the first provider."""
     try:
-        with open(service_file, "r") as file:
-            lines = file.readlines()
-
-        with open(service_file, "w") as file:
-            for line in lines:
-                if line.strip().startswith("ExecStart="):
-                    file.write(
-                        f"ExecStart=/usr/bin/cloudflared proxy-dns --port 53 --upstream {doh_url}\n"
-                    )
-                else:
-                    file.write(line)
-
-        subprocess.run(["sudo", "systemctl", "daemon-reload"], check=True)
-        subprocess.run(["sudo", "systemctl", "restart", "cloudflared"], check=True)
-        log_event(f"Updated DoH URL to: {doh_url}")
-    except (IOError, subprocess.CalledProcessError) as e:
-        log_event(f"Error updating service file: {e}", "error")
-        flash(f"Error updating service: {e}", "danger")
-        raise
+        with open(FORWARDER_STATE_FILE, "r") as file:
+            return json.load(file)["url"]
+    except (IOError, ValueError, KeyError):
+        pass
+    try:
+        upstream = service_file_cache.get()
+        if upstream:
+            return upstream
+    except IOError:
+        pass
+    return load_providers()[0]["url"]
+
+
+def set_forwarder_upstream(url):
+    """Atomically swap the forwarder's upstream and remember it."""
+    forwarder.set_upstream(url)
+    atomic_write(FORWARDER_STATE_FILE, json.dumps({"url": url}))
 
 
 def validate_doh_url(url):
-    """Validate a DoH URL by pinging its hostname."""
+    """Validate a DoH URL by measuring the latency to its hostname."""
     try:
         ping_result = ping_provider(url)
         if ping_result == "Failed" or ping_result == "N/A":
@@ -161,29 +362,32 @@ def validate_doh_url(url):
         return False
 
 
-def normalize_url(url):
-    """Normalize URL by removing trailing slashes and ensuring scheme."""
-    parsed = urlparse(url)
-    if not parsed.scheme:
-        url = f"https://{url}"
-        parsed = urlparse(url)
-    return f"{parsed.scheme}://{parsed.netloc}{parsed.path.rstrip('/')}"
+def parse_upstream(content):
+    """Extract the --upstream URL from the service file's contents."""
+    if content is None:
+        raise FileNotFoundError(f"{SERVICE_FILE} does not exist")
+    match = re.search(r"--upstream\s+(https?://[^\s/]+(?:/[^\s]*)?)", content)
+    return match.group(1) if match else None
+
+
+# cloudflared upstream URL, re-read only when the service file changes
+service_file_cache = CachedFile(SERVICE_FILE, parse_upstream)
+
+# service state and network info read without forking; resolv.conf re-read on inotify events
+file_watcher = FileWatcher()
+introspector = Introspector(root=app.config['SYSTEM_ROOT'], run=run_command, watcher=file_watcher)
 
 
 def get_current_doh_provider():
-    """Get the current DoH provider from the service file."""
+    """Get the current DoH provider from the forwarder or the service file."""
     try:
-        with open(SERVICE_FILES[0], "r") as file:
-            content = file.read()
-            match = re.search(r"--upstream\s+(https?://[^\s/]+(?:/[^\s]*)?)", content)
-            if match:
-                full_url = match.group(1)
-                base_url = normalize_url(full_url)
-                providers = load_providers()
-                for provider in providers:
-                    if normalize_url(provider["url"]) == base_url:
-                        return provider["name"], full_url, base_url
-                return f"Unknown ({full_url})", full_url, base_url
+        full_url = forwarder.upstream if forwarder is not None else service_file_cache.get()
+        if full_url:
+            base_url = normalize_url(full_url)
+            provider = find_provider(base_url)
+            if provider:
+                return provider["name"], full_url, base_url
+            return f"Unknown ({full_url})", full_url, base_url
         return "Unknown", "Unknown", "Unknown"
     except IOError as e:
         log_event(f"Error reading service file: {e}", "error")
@@ -191,37 +395,224 @@ def get_current_doh_provider():
         return "Unknown", "Unknown", "Unknown"
 
 
+def hedge_candidates(primary):
+    """Providers to hedge a query to, best auto-select score first."""
+    urls = [p["url"] for p in load_providers() if p["url"] != primary]
+    return auto_selector.ranked(urls)
+
+
+# hedged DoH resolution for /api/lookup and the forwarder
+hedger = hedge.Hedger(
+    doh_pool,
+    hedge_candidates,
+    method=app.config['DOH_PROBE_METHOD'],
+    timeout=app.config['DOH_PROBE_TIMEOUT'],
+    budget=app.config['HEDGE_BUDGET'],
+    default_delay_ms=app.config['HEDGE_DEFAULT_DELAY_MS'],
+)
+atexit.register(hedger.close)
+
+# optional built-in DNS-to-DoH forwarder replacing cloudflared
+forwarder = None
+if app.config['FORWARDER_ENABLED']:
+    forwarder = Forwarder(
+        doh_pool,
+        load_forwarder_upstream(),
+        host=app.config['FORWARDER_HOST'],
+        port=app.config['FORWARDER_PORT'],
+        method=app.config['DOH_PROBE_METHOD'],
+        timeout=app.config['DOH_PROBE_TIMEOUT'],
+        cache_size=app.config['FORWARDER_CACHE_SIZE'],
+        max_ttl=app.config['FORWARDER_MAX_TTL'],
+        negative_ttl=app.config['FORWARDER_NEGATIVE_TTL'],
+        hedger=hedger if app.config['HEDGE_ENABLED'] else None,
+    )
+
+
+def local_resolver():
+    """(host, port) of the resolver serving this machine: the built-in forwarder when enabled, else LOCAL_RESOLVER."""
+    if forwarder is not None:
+        return forwarder.host, forwarder.port
+    return app.config['LOCAL_RESOLVER'], app.config['LOCAL_RESOLVER_PORT']
+
+
+def forwarder_replaces_cloudflared():
+    """True when the built-in forwarder serves port 53 in place of cloudflared."""
+    return forwarder is not None and forwarder.port == 53
+
+
+@profiling.timed("get_service_status")
 def get_service_status():
-    """Check if the cloudflared service is running."""
+    """Check if the resolver service (cloudflared, or the built-in forwarder replacing it) is running."""
+    if forwarder_replaces_cloudflared():
+        return "running" if forwarder.running else "not running"
     try:
-        result = subprocess.run(
-            ["systemctl", "is-active", "--quiet", "cloudflared"], check=False
-        )
-        return "running" if result.returncode == 0 else "not running"
-    except subprocess.CalledProcessError as e:
+        return "running" if introspector.service_active() else "not running"
+    except Exception as e:
         log_event(f"Error checking service status: {e}", "error")
         return "not running"
 
 
+@profiling.timed("ping_provider")
 def ping_provider(url):
-    """Ping the provider's hostname and return the average RTT."""
+    """Measure the provider's round-trip time in-process and return the average RTT."""
     try:
         parsed = urlparse(url)
-        hostname = parsed.hostname
-        result = subprocess.run(
-            ["ping", "-c", "3", "-W", "2", hostname], capture_output=True, text=True
+        key = normalize_url(url)
+        stats = concurrency.offload(
+            latency.measure,
+            parsed.hostname,
+            port=parsed.port or 443,
+            samples=app.config['PING_SAMPLES'],
+            timeout=provider_health.timeout(key, "ping", app.config['PING_TIMEOUT']),
+            method=app.config['PING_METHOD'],
         )
-        if result.returncode == 0:
-            match = re.search(r"rtt min/avg/max/mdev = [\d.]+/([\d.]+)/", result.stdout)
-            if match:
-                return round(float(match.group(1)), 2)
-            return "N/A"
+        if stats["avg"] is not None:
+            ping_seconds.observe(stats["avg"] / 1000, provider=url)
+            provider_health.observe(key, "ping", stats["avg"])
+            return stats["avg"]
         return "Failed"
     except Exception as e:
         log_event(f"Ping error for {url}: {e}", "error")
         return "Failed"
 
 
+def record_ping(provider, ping_result, doh_result):
+    """Persist one probe result and its DoH timing breakdown to ping_history.
+
+    Probes skipped by an open circuit breaker are not samples and are ignored.
+    """
+    if doh_result.get("skipped"):
+        return
+    ts = int(time.time())
+    ping_val = ping_result if isinstance(ping_result, (int, float)) else None
+    ping_key = sketch.key(ping_val) if ping_val is not None else None
+    storage.execute(
+        "INSERT INTO ping_history(provider, ts, ping, ping_key, doh_ok, dns_ms, connect_ms, tls_ms, ttfb_ms, doh_ms)"
+        " VALUES (?,?,?,?,?,?,?,?,?,?)",
+        (provider, ts, ping_val, ping_key, int(doh_result["ok"]), doh_result["dns_ms"], doh_result["connect_ms"],
+         doh_result["tls_ms"], doh_result["ttfb_ms"], doh_result["total_ms"])
+    )
+    ping_buffers.append(provider, ts, ping_val, doh_result["ok"])
+    auto_selector.observe(provider, doh_result["total_ms"], doh_result["ok"])
+
+
+def recent_history(provider, count):
+    """The provider's newest in-memory samples as {"time", "ping", "doh_ok"} dicts."""
+    buffer = ping_buffers.find(provider)
+    if buffer is None:
+        return []
+    return [{"time": format_ts(s["ts"]), "ping": s["ping"], "doh_ok": s["doh_ok"]} for s in buffer.samples(count=count)]
+
+
+def probe_provider(url, force=False):
+    """Run the ping and DoH checks for a single provider URL.
+
+    Unless ``force`` is set, a provider whose circuit breaker is open is not
+    contacted and a skipped failure is returned at once.
+    """
+    if not force and not provider_health.allow(normalize_url(url)):
+        return "Failed", doh_failure("circuit open", skipped=True)
+    ping_result = ping_provider(url)
+    doh_result = doh_probe(url)
+    return ping_result, doh_result
+
+
+@concurrency.offloaded
+def probe_all_providers(providers):
+    """Probe all providers in parallel, recording each result as it completes.
+
+    At most PROBE_CONCURRENCY probes run at once and the whole run is bounded
+    by PROBE_DEADLINE seconds. Providers that have not answered by then are
+    recorded as failed. The caller waits off the event loop.
+    """
+    if not providers:
+        return
+    workers = min(app.config['PROBE_CONCURRENCY'], len(providers))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {executor.submit(probe_provider, p["url"]): p for p in providers}
+    try:
+        for future in as_completed(futures, timeout=app.config['PROBE_DEADLINE']):
+            provider = futures[future]
+            try:
+                ping_result, doh_result = future.result()
+            except Exception as e:
+                log_event(f"Probe error for {provider['url']}: {e}", "error")
+                ping_result, doh_result = "Failed", doh_failure(str(e))
+            test_results[provider["url"]] = {"ping": ping_result, "doh": doh_latency(doh_result)}
+            record_ping(provider["url"], ping_result, doh_result)
+            log_event(f"Tested {provider['name']}: Ping={ping_result} DoH={doh_latency(doh_result)}")
+    except FuturesTimeout:
+        for future, provider in futures.items():
+            if not future.done():
+                test_results[provider["url"]] = {"ping": "Failed", "doh": "Failed"}
+                record_ping(provider["url"], "Failed", doh_failure("deadline exceeded"))
+                log_event(f"Probe for {provider['name']} exceeded the {app.config['PROBE_DEADLINE']}s deadline", "warning")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    start = g.get("request_start")
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        http_request_seconds.observe(elapsed, method=request.method, route=route, status=response.status_code)
+        response.headers["Server-Timing"] = profiling.server_timing(elapsed)
+    return response
+
+
+@socketio.on("connect")
+def socket_connect():
+    socketio_clients.inc()
+
+
+@socketio.on("disconnect")
+def socket_disconnect():
+    socketio_clients.dec()
+    status_stream.drop(request.sid)
+
+
+@socketio.on("status_subscribe")
+def socket_status_subscribe(data=None):
+    """Join the system channel and one provider's channel (the current one by default) and send snapshots."""
+    data = data if isinstance(data, dict) else {}
+    provider = data.get("provider")
+    if not status_stream.known(stream.SYSTEM) or not provider:
+        current = current_status_snapshot()["data"]
+        provider = provider or current["provider"]
+        status_stream.seed(stream.SYSTEM, [], system_fields(current))
+    if not status_stream.known(provider):
+        last = test_results.get(provider, {})
+        status_stream.seed(provider, recent_history(provider, app.config['STREAM_HISTORY_SIZE']),
+                           {"current_ping": last.get("ping"), "doh_ok": None, "doh_ms": None})
+    channels = [stream.SYSTEM, provider]
+    for name in channels:
+        join_room(stream.room(name))
+    left, _, snapshots = status_stream.subscribe(request.sid, channels, compress=bool(data.get("compress")))
+    for name in left:
+        leave_room(stream.room(name))
+    for snapshot in snapshots:
+        send_stream_message(request.sid, "status_snapshot", snapshot)
+
+
+@socketio.on("status_ack")
+def socket_status_ack(data):
+    """A client applied a delta; catch it up in one message if it had fallen behind."""
+    if not isinstance(data, dict):
+        return
+    catch_up = status_stream.ack(request.sid, data.get("channel"), int(data.get("seq", 0)))
+    if catch_up:
+        event, payload = catch_up
+        send_stream_message(request.sid, f"status_{event}", payload)
+
+
 def require_sudo(f):
     """Decorator to ensure the app runs with sudo privileges."""
 
@@ -235,29 +626,13 @@ def require_sudo(f):
     return decorated_function
 
 
+@profiling.timed("get_network_info")
 def get_network_info():
-    info = {"local_ip": None, "gateway": None, "dns_servers": []}
-    try:
-        result = subprocess.run(["ip", "route", "get", "8.8.8.8"], capture_output=True, text=True, check=False)
-        if result.returncode == 0:
-            m = re.search(r"src\s+(\S+)", result.stdout)
-            if m:
-                info["local_ip"] = m.group(1)
-            m2 = re.search(r"via\s+(\S+)", result.stdout)
-            if m2:
-                info["gateway"] = m2.group(1)
-    except Exception as e:
-        log_event(f"Error getting network route info: {e}", "error")
     try:
-        with open("/etc/resolv.conf") as f:
-            for line in f:
-                if line.startswith("nameserver"):
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        info["dns_servers"].append(parts[1])
+        return introspector.network_info()
     except Exception as e:
-        log_event(f"Error reading resolv.conf: {e}", "error")
-    return info
+        log_event(f"Error getting network info: {e}", "error")
+        return {"local_ip": None, "gateway": None, "dns_servers": []}
 
 
 @app.route("/")
@@ -289,9 +664,11 @@ def select_provider():
         flash("Provider name and URL are required.", "danger")
         return redirect(url_for("index"))
     try:
-        update_doh_service(url)
-        flash(f"Updated DoH to: {name}", "success")
-        log_event(f"Updated DoH to: {name} ({url})")
+        job = update_doh_service(url, name)
+        flash(f"Switching DoH to: {name} (job {job.id})", "info")
+        log_event(f"Switching DoH to: {name} ({url})")
+    except SwitchInProgress as e:
+        flash(f"Cannot switch now: {e}", "warning")
     except Exception as e:
         flash(f"Error updating provider: {e}", "danger")
         log_event(f"Error updating provider: {e}", "error")
@@ -318,7 +695,7 @@ def add_provider():
 
     providers = load_providers()
     # Check if provider already exists
-    if any(p["url"] == normalized_url for p in providers):
+    if find_provider(normalized_url) is not None:
         flash(f"Provider with URL {url} already exists.", "warning")
         return redirect(url_for("index"))
 
@@ -326,9 +703,11 @@ def add_provider():
     providers.append(new_provider)
     try:
         save_providers(providers)
-        update_doh_service(normalized_url)
-        flash(f"Added and updated to provider: {name}", "success")
+        job = update_doh_service(normalized_url, name)
+        flash(f"Added provider {name}; switching to it (job {job.id})", "success")
         log_event(f"Added provider: {name} ({normalized_url})")
+    except SwitchInProgress as e:
+        flash(f"Added provider {name}, but cannot switch now: {e}", "warning")
     except Exception as e:
         flash(f"Error adding provider: {e}", "danger")
         log_event(f"Error adding provider {name}: {e}", "error")
@@ -380,8 +759,8 @@ def restore():
         flash("No backup file found.", "warning")
         return redirect(url_for("index"))
     try:
-        with open(BACKUP_FILE, "r") as src, open(PROVIDERS_FILE, "w") as dst:
-            dst.write(src.read())
+        with open(BACKUP_FILE, "r") as src:
+            atomic_write(PROVIDERS_FILE, src.read())
         flash("Configuration restored successfully.", "success")
         log_event("Configuration restored.")
     except IOError as e:
@@ -393,26 +772,10 @@ def restore():
 @app.route("/test_providers", methods=["POST"])
 def test_providers():
     try:
-        cleanup_old_records()
         global test_results
         providers = load_providers()
         test_results = {}
-        for provider in providers:
-            url = provider["url"]
-            ping_result = ping_provider(url)
-            test_results[url] = {"ping": ping_result}
-            log_event(f"Tested {provider['name']}: Ping={ping_result}")
-            ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            doh_ok = doh_query_test(url)
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            ping_val = ping_result if isinstance(ping_result, (int, float)) else None
-            c.execute(
-                "INSERT INTO ping_history(provider, time, ping, doh_ok) VALUES (?,?,?,?)",
-                (url, ts, ping_val, int(doh_ok))
-            )
-            conn.commit()
-            conn.close()
+        probe_all_providers(providers)
         flash("All provider tests completed.", "success")
     except Exception as e:
         log_event(f"Error testing providers: {e}", "error")
@@ -423,25 +786,14 @@ def test_providers():
 @app.route("/test_provider", methods=["POST"])
 def test_provider():
     try:
-        cleanup_old_records()
         global test_results
         url = request.form.get("url")
         name = request.form.get("name")
         if not url or not name:
             raise ValueError("Provider name and URL are required")
-        ping_result = ping_provider(url)
-        test_results[url] = {"ping": ping_result}
-        ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        doh_ok = doh_query_test(url)
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        ping_val = ping_result if isinstance(ping_result, (int, float)) else None
-        c.execute(
-            "INSERT INTO ping_history(provider, time, ping, doh_ok) VALUES (?,?,?,?)",
-            (url, ts, ping_val, int(doh_ok))
-        )
-        conn.commit()
-        conn.close()
+        ping_result, doh_result = probe_provider(url, force=True)
+        test_results[url] = {"ping": ping_result, "doh": doh_latency(doh_result)}
+        record_ping(url, ping_result, doh_result)
         flash(f"Test completed for {name}.", "success")
         log_event(f"Tested {name}: Ping={ping_result}")
     except Exception as e:
@@ -483,17 +835,19 @@ def update_provider(index):
     if not validate_doh_url(normalized_url):
         flash(f"Invalid DoH URL: {url}. The server is not reachable. Please verify the URL and try again.", "danger")
         return redirect(url_for("edit_provider", index=index))
-    for idx, p in enumerate(providers):
-        if idx != index and normalize_url(p["url"]) == normalized_url:
-            flash(f"Provider with URL {url} already exists.", "warning")
-            return redirect(url_for("edit_provider", index=index))
+    existing = provider_registry.index_of(normalized_url)
+    if existing is not None and existing != index:
+        flash(f"Provider with URL {url} already exists.", "warning")
+        return redirect(url_for("edit_provider", index=index))
     providers[index]["name"] = name
     providers[index]["url"] = normalized_url
     try:
         save_providers(providers)
-        update_doh_service(normalized_url)
-        flash(f"Provider updated: {name}", "success")
+        job = update_doh_service(normalized_url, name)
+        flash(f"Provider updated: {name}; switching to it (job {job.id})", "success")
         log_event(f"Updated provider: {name} ({normalized_url})")
+    except SwitchInProgress as e:
+        flash(f"Provider updated: {name}, but cannot switch now: {e}", "warning")
     except Exception as e:
         flash(f"Error updating provider: {e}", "danger")
         log_event(f"Error updating provider: {e}", "error")
@@ -504,8 +858,11 @@ def update_provider(index):
 @app.route("/start_service", methods=["POST"])
 @require_sudo
 def start_service():
+    if forwarder_replaces_cloudflared():
+        flash("cloudflared is disabled while the built-in forwarder serves port 53.", "warning")
+        return redirect(url_for("index"))
     try:
-        subprocess.run(["sudo", "systemctl", "start", "cloudflared"], check=True)
+        run_command(["sudo", "systemctl", "start", "cloudflared"], check=True)
         flash("Service started.", "success")
         log_event("Service started.")
     except subprocess.CalledProcessError as e:
@@ -517,7 +874,7 @@ def start_service():
 @require_sudo
 def stop_service():
     try:
-        subprocess.run(["sudo", "systemctl", "stop", "cloudflared"], check=True)
+        run_command(["sudo", "systemctl", "stop", "cloudflared"], check=True)
         flash("Service stopped.", "success")
         log_event("Service stopped.")
     except subprocess.CalledProcessError as e:
@@ -528,8 +885,11 @@ def stop_service():
 @app.route("/restart_service", methods=["POST"])
 @require_sudo
 def restart_service():
+    if forwarder_replaces_cloudflared():
+        flash("cloudflared is disabled while the built-in forwarder serves port 53.", "warning")
+        return redirect(url_for("index"))
     try:
-        subprocess.run(["sudo", "systemctl", "restart", "cloudflared"], check=True)
+        run_command(["sudo", "systemctl", "restart", "cloudflared"], check=True)
         flash("Service restarted.", "success")
         log_event("Service restarted.")
     except subprocess.CalledProcessError as e:
@@ -542,88 +902,134 @@ def restart_service():
 @app.route("/api/status")
 @require_sudo
 def api_status():
-    _, full_url, base = get_current_doh_provider()
-    service_status = get_service_status()
-    network_info = get_network_info()
-    current_ping = None
-    try:
-        current_ping = ping_provider(full_url)
-    except Exception:
-        current_ping = None
-    history = ping_history.get(base, [])
-    ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    history.append({"time": ts, "ping": current_ping})
-    if len(history) > 20:
-        history.pop(0)
-    ping_history[base] = history
-    return jsonify({
-        "service_status": service_status,
-        "network_info": network_info,
-        "current_ping": current_ping,
-        "ping_history": history,
-    })
+    """Serve the shared status snapshot; clients revalidate with If-None-Match."""
+    snapshot = current_status_snapshot()
+    response = app.response_class(snapshot["body"], mimetype="application/json")
+    response.set_etag(snapshot["etag"])
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
 
 @app.route("/api/lookup", methods=["POST"])
 @require_sudo
 def api_lookup():
-    # clean old DNS lookup records before inserting
-    cleanup_old_records()
     data = request.get_json() or request.form
     domain = data.get("domain")
     if not domain:
         return jsonify({"error": "No domain provided"}), 400
     domain = domain.strip()
-    ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    try:
-        res = subprocess.run(["dig", "+short", domain], capture_output=True, text=True, check=True)
-        result = res.stdout.splitlines()
-    except subprocess.CalledProcessError:
-        result = []
-    # record lookup in SQLite
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO dns_lookup_history(domain, time, result) VALUES (?,?,?)",
-        (domain, ts, json.dumps(result))
-    )
-    conn.commit()
+    ts = int(time.time())
+    hedged = data.get("hedged", app.config['HEDGE_ENABLED'])
+    details = {}
+    if hedged and str(hedged).lower() not in ("0", "false", "off"):
+        # resolve in-process via the current provider, hedging to the next best one
+        _, _, primary = get_current_doh_provider()
+
+        def resolve(name, qtype):
+            answer = hedger.query(primary, doh.build_query(name, qtype))
+            details.update(via=answer["url"], hedged=answer["hedged"], latency_ms=answer["latency_ms"])
+            return hedge.check_response(answer["response"])
+
+        entry = concurrency.offload(lookup.lookup, resolve, domain, "A")
+        if entry["error"]:
+            log_event(f"Hedged lookup of {domain} failed: {entry['error']}", "error")
+        target = primary
+    else:
+        resolve, target = lookup_resolver("local")
+        entry = concurrency.offload(lookup.lookup, resolve, domain, "A")
+        details = {"latency_ms": entry["ms"]}
+    result = entry["answers"]
+    record_lookups(ts, target, [entry])
+    storage.flush()
     # fetch recent lookup history
-    c.execute(
-        "SELECT time, domain, result FROM dns_lookup_history ORDER BY time DESC LIMIT 20"
+    rows = storage.query(
+        "SELECT ts, domain, result FROM dns_lookup_history ORDER BY ts DESC LIMIT 20"
     )
-    rows = c.fetchall()
-    conn.close()
-    history = [{"time": r[0], "domain": r[1], "result": json.loads(r[2])} for r in rows]
-    return jsonify({"time": ts, "domain": domain, "result": result, "history": history})
+    history = [{"time": format_ts(r[0]), "domain": r[1], "result": json.loads(r[2])} for r in rows]
+    return jsonify(dict(details, time=format_ts(ts), domain=domain, result=result, history=history))
+
+@app.route("/api/lookup/batch", methods=["POST"])
+@require_sudo
+def api_lookup_batch():
+    """Resolve many domains and record types concurrently in-process.
+
+    Body: {"domains": [...], "types": ["A", "AAAA", ...], "target": "local" |
+    "current" | <provider URL>}. "local" queries LOCAL_RESOLVER over plain
+    DNS, anything else goes to that provider over DoH. Every result carries
+    its own timing; all of them are written to history in one batch.
+    """
+    data = request.get_json(silent=True) or {}
+    domains, types = data.get("domains", []), data.get("types", ["A"])
+    for field, values in (("domains", domains), ("types", types)):
+        if not isinstance(values, list) or not all(isinstance(v, str) and v.strip() for v in values):
+            return jsonify({"error": f"{field} must be a list of non-empty strings"}), 400
+    domains = [d.strip() for d in domains]
+    types = [t.strip().upper() for t in types]
+    if not domains:
+        return jsonify({"error": "No domains provided"}), 400
+    unknown = [t for t in types if t not in lookup.RECORD_TYPES]
+    if unknown or not types:
+        return jsonify({"error": f"Unsupported record types: {unknown}", "supported": list(lookup.RECORD_TYPES)}), 400
+    queries = [(domain, qtype) for domain in domains for qtype in types]
+    if len(queries) > app.config['LOOKUP_MAX_QUERIES']:
+        return jsonify({"error": f"At most {app.config['LOOKUP_MAX_QUERIES']} queries per batch"}), 400
+    try:
+        resolve, target = lookup_resolver(data.get("target", "local"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    ts = int(time.time())
+    start = time.perf_counter()
+    results = concurrency.offload(lookup.batch, resolve, queries, concurrency=app.config['LOOKUP_CONCURRENCY'],
+                                  deadline=app.config['PROBE_DEADLINE'])
+    elapsed = round((time.perf_counter() - start) * 1000, 2)
+    record_lookups(ts, target, results)
+    return jsonify({"time": format_ts(ts), "target": target, "count": len(results), "ms": elapsed, "results": results})
 
 @app.route("/api/ping_history", methods=["GET"])
 @require_sudo
 def api_ping_history():
+    """Return ping history for a provider.
+
+    Without ``range`` the 20 most recent samples are returned from memory. With
+    ``range`` (seconds) the whole window is returned, read from raw samples or
+    from the 1m/1h/1d rollups, whichever covers it in at most
+    HISTORY_MAX_POINTS points. Rollup points include the newest buckets not
+    rolled up yet.
+    """
     provider = request.args.get("provider")
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "SELECT time, ping FROM ping_history WHERE provider = ? ORDER BY time DESC LIMIT 20",
-        (provider,)
+    range_seconds = request.args.get("range", type=int)
+    if not range_seconds:
+        history = [{"time": s["time"], "ping": s["ping"]} for s in reversed(recent_history(provider, 20))]
+        return jsonify({provider: history})
+    since = int(time.time()) - range_seconds
+    resolution = rollups.pick_resolution(
+        range_seconds,
+        app.config['TEST_INTERVAL'],
+        app.config['RETENTION_HOURS'] * 3600,
+        rollup_retention(),
+        app.config['HISTORY_MAX_POINTS'],
     )
-    rows = c.fetchall()
-    conn.close()
-    history = [{"time": r[0], "ping": r[1]} for r in rows]
-    return jsonify({provider: history})
+    if resolution == "raw":
+        rows = storage.query(
+            "SELECT ts, ping, doh_ok FROM ping_history WHERE provider = ? AND ts >= ? ORDER BY ts",
+            (provider, since)
+        )
+        history = [{"time": format_ts(r[0]), "ping": r[1], "doh_ok": r[2]} for r in rows]
+    else:
+        points = storage.read(lambda conn: rollups.fetch(conn, provider, resolution, since))
+        history = [dict(p, time=format_ts(p.pop("bucket"))) for p in points]
+    return jsonify({provider: history, "resolution": resolution})
 
 @app.route("/api/clear_ping_history", methods=["POST"])
 @require_sudo
 def clear_ping_history():
     data = request.get_json() or request.form
     provider = data.get("provider")
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    if provider:
-        c.execute("DELETE FROM ping_history WHERE provider = ?", (provider,))
-    else:
-        c.execute("DELETE FROM ping_history")
-    conn.commit()
-    conn.close()
+    for table in ["ping_history"] + rollups.all_tables():
+        if provider:
+            storage.execute(f"DELETE FROM {table} WHERE provider = ?", (provider,))
+        else:
+            storage.execute(f"DELETE FROM {table}")
+    ping_buffers.clear(provider)
     return jsonify({"status": "ok"})
 
 
@@ -631,91 +1037,571 @@ def clear_ping_history():
 @app.route("/api/analytics", methods=["GET"])
 @require_sudo
 def api_analytics():
-    """Compute ping stats from in-memory JSON history."""
+    """Compute latency percentiles, jitter, availability and trend from stored history.
+
+    ``range`` is the window in seconds and defaults to RETENTION_HOURS.
+    Windows still held in the provider's ring buffer are computed in memory.
+    """
     provider = request.args.get("provider")
-    recs = ping_history.get(provider, [])
-    # filter only numeric pings
-    vals = [r.get("ping") for r in recs if isinstance(r.get("ping"), (int, float))]
-    if vals:
-        mn = min(vals)
-        mx = max(vals)
-        avg = round(sum(vals) / len(vals), 2)
-        count = len(vals)
-    else:
-        mn = mx = avg = None
-        count = 0
-    return jsonify({
-        "provider": provider,
-        "min": mn,
-        "max": mx,
-        "avg": avg,
-        "count": count
-    })
+    range_seconds = request.args.get("range", type=int) or app.config['RETENTION_HOURS'] * 3600
+    now = int(time.time())
+    if ping_buffers.covers(provider, now - range_seconds):
+        return jsonify(dict(analytics.buffer_stats(ping_buffers.find(provider), now - range_seconds, now),
+                            provider=provider, range=range_seconds))
+    retention = dict(rollup_retention(), raw=app.config['RETENTION_HOURS'] * 3600)
+    stats = storage.read(lambda conn: analytics.window_stats(conn, provider, now - range_seconds, now, retention))
+    return jsonify(dict(stats, provider=provider, range=range_seconds))
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint."""
+    return metrics_registry.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+@app.route("/api/profile", methods=["POST"])
+@require_sudo
+def api_profile():
+    """Sample every thread's stack for a bounded window and return collapsed stacks.
+
+    Query parameters: ``seconds`` (capped at PROFILE_MAX_SECONDS, default 10)
+    and ``interval`` in ms (default 5). The response is text in the
+    ``frame;frame;frame count`` format read by flamegraph.pl and speedscope.
+    """
+    seconds = min(request.args.get("seconds", 10, type=float), app.config['PROFILE_MAX_SECONDS'])
+    interval = max(request.args.get("interval", 5, type=float), 1) / 1000
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({"error": "A profile is already running"}), 409
+    try:
+        sampler = profiling.Sampler(interval).start()
+        log_event(f"Profiling for {seconds}s at {interval * 1000:g} ms intervals")
+        # yield to the hub so greenthreads keep running while the sampler thread watches them
+        socketio.sleep(seconds)
+        sampler.stop()
+    finally:
+        profile_lock.release()
+    headers = {"Content-Type": "text/plain; charset=utf-8", "X-Profile-Samples": str(sampler.samples)}
+    return sampler.collapsed(), 200, headers
+
+@app.route("/api/health", methods=["GET"])
+@require_sudo
+def api_health():
+    """Circuit breaker state, failures and current adaptive timeouts per provider."""
+    defaults = {"ping": app.config['PING_TIMEOUT'], "doh": app.config['DOH_PROBE_TIMEOUT']}
+    return jsonify(provider_health.state(defaults))
 
-# DNS-over-HTTPS validation
-def doh_query_test(url):
-    """Perform a DNS-over-HTTPS query to validate service."""
+@app.route("/api/scheduler", methods=["GET"])
+@require_sudo
+def api_scheduler():
+    """Background probe schedule: per-provider interval, next probe, failures and backoff."""
+    return jsonify(dict(probe_scheduler.state(), enabled=bool(app.config['PROBE_SCHEDULER_ENABLED'])))
+
+@app.route("/api/stream", methods=["GET"])
+@require_sudo
+def api_stream():
+    """Status stream subscribers, lagging clients and per-channel sequence numbers."""
+    return jsonify(status_stream.stats())
+
+@app.route("/api/doh_pool", methods=["GET"])
+@require_sudo
+def api_doh_pool():
+    """Report cold-start and warm-connection DoH latency per provider."""
+    return jsonify(doh_pool.stats())
+
+@app.route("/api/forwarder", methods=["GET"])
+@require_sudo
+def api_forwarder():
+    """Built-in forwarder counters, cache hit ratio and upstream latency."""
+    if forwarder is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(forwarder.stats(), enabled=True))
+
+@app.route("/api/benchmark", methods=["POST"])
+@require_sudo
+def api_benchmark():
+    """Start a benchmark job replaying domains against every provider.
+
+    Body (all optional): {"domains": [...], "rate": queries per second,
+    "concurrency": workers, "limit": max domains}. Without domains the most
+    recent ones from the lookup history are used.
+    """
+    data = request.get_json(silent=True) or {}
+    if any(job["state"] == "running" for job in benchmark_jobs.values()):
+        return jsonify({"error": "A benchmark is already running"}), 409
+    try:
+        limit = int(data.get("limit", app.config['BENCHMARK_MAX_DOMAINS']))
+        rate = float(data.get("rate", app.config['BENCHMARK_RATE']))
+        concurrency = int(data.get("concurrency", app.config['BENCHMARK_CONCURRENCY']))
+    except (TypeError, ValueError):
+        return jsonify({"error": "limit, rate and concurrency must be numbers"}), 400
+    # "not rate >= 0" also rejects NaN
+    if limit < 1 or concurrency < 1 or not rate >= 0:
+        return jsonify({"error": "limit and concurrency must be at least 1, rate must not be negative"}), 400
+    if not isinstance(data.get("domains", []), list):
+        return jsonify({"error": "domains must be a list"}), 400
+    domains = [d.strip() for d in data.get("domains", []) if isinstance(d, str) and d.strip()][:limit]
+    source = "request"
+    if not domains:
+        domains = storage.read(lambda conn: benchmark.history_domains(conn, limit))
+        source = "history"
+    if not domains:
+        return jsonify({"error": "No domains provided and the lookup history is empty"}), 400
+    job = {
+        "id": uuid.uuid4().hex[:12], "state": "running", "source": source, "domains": len(domains),
+        "rate": rate, "concurrency": concurrency,
+        "done": 0, "total": 0, "run_id": None, "error": None,
+    }
+    benchmark_jobs[job["id"]] = job
+    socketio.start_background_task(run_benchmark_job, job, domains)
+    return jsonify(job), 202
+
+@app.route("/api/benchmark/<job_id>", methods=["GET"])
+@require_sudo
+def api_benchmark_job(job_id):
+    """Progress of a benchmark job, with its report once finished."""
+    job = benchmark_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job["run_id"] is None:
+        return jsonify(job)
+    report = storage.read(lambda conn: benchmark.load_report(conn, job["run_id"]))
+    return jsonify(dict(job, report=report))
+
+@app.route("/api/benchmark/report", methods=["GET"])
+@require_sudo
+def api_benchmark_report():
+    """Stored ranked benchmark report: ?id=<run id>, the latest by default."""
+    run_id = request.args.get("id", type=int)
+    report = storage.read(lambda conn: benchmark.load_report(conn, run_id))
+    if report is None:
+        return jsonify({"error": "No benchmark report"}), 404
+    return jsonify(report)
+
+@app.route("/api/hedge", methods=["GET"])
+@require_sudo
+def api_hedge():
+    """Hedged-query counters and the p99 reduction they achieved."""
+    return jsonify(dict(hedger.stats(), enabled=bool(app.config['HEDGE_ENABLED'])))
+
+@app.route("/api/autoselect", methods=["GET", "POST"])
+@require_sudo
+def api_autoselect():
+    """Auto-select scores and recent decisions; POST {"enabled": true|false} to toggle it."""
+    if request.method == "POST":
+        data = request.get_json(silent=True) or request.form
+        enabled = data.get("enabled")
+        if enabled is None:
+            return jsonify({"error": "No enabled flag provided"}), 400
+        auto_selector.enabled = enabled if isinstance(enabled, bool) else str(enabled).lower() in ("1", "true", "on")
+        log_event(f"Auto-select {'enabled' if auto_selector.enabled else 'disabled'}")
+    return jsonify(auto_selector.state())
+
+@app.route("/api/autoselect/decisions", methods=["GET"])
+@require_sudo
+def api_autoselect_decisions():
+    """Stored auto-select decisions, newest first; ?action=switch to list only switches."""
+    limit = request.args.get("limit", 100, type=int)
+    action = request.args.get("action")
+    sql = "SELECT ts, current, best, current_score, best_score, improvement, action, reason FROM autoselect_decisions"
+    params = []
+    if action:
+        sql += " WHERE action = ?"
+        params.append(action)
+    rows = storage.query(sql + " ORDER BY ts DESC, id DESC LIMIT ?", params + [limit])
+    columns = ("ts", "current", "best", "current_score", "best_score", "improvement", "action", "reason")
+    return jsonify([dict(zip(columns, row), time=format_ts(row[0])) for row in rows])
+
+@app.route("/api/switch", methods=["GET", "POST"])
+@require_sudo
+def api_switch():
+    """List recent switch jobs, or start one with {"url": ..., "name": ...}."""
+    if request.method == "GET":
+        return jsonify([job.as_dict() for job in switch_manager.jobs()])
+    data = request.get_json(silent=True) or request.form
+    url = data.get("url")
+    if not url:
+        return jsonify({"error": "No url provided"}), 400
     try:
-        r = requests.get(f"{url}?name=example.com&type=A", headers={"Accept":"application/dns-json"}, timeout=3)
-        data = r.json()
-        return "Answer" in data and bool(data.get("Answer"))
+        job = update_doh_service(url, data.get("name"))
+    except SwitchInProgress as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify(job.as_dict()), 202
+
+@app.route("/api/switch/<job_id>", methods=["GET"])
+@require_sudo
+def api_switch_job(job_id):
+    """Progress of one switch job."""
+    job = switch_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.as_dict())
+
+# Benchmark jobs started from the API
+benchmark_jobs = {}
+
+def run_benchmark_job(job, domains):
+    """Run a benchmark in the background and store its report."""
+    def progress(done, total):
+        job["done"], job["total"] = done, total
+
+    try:
+        report = concurrency.offload(
+            benchmark.run, doh_pool, load_providers(), domains, rate=job["rate"], concurrency=job["concurrency"],
+            timeout=app.config['DOH_PROBE_TIMEOUT'], method=app.config['DOH_PROBE_METHOD'], progress=progress,
+        )
+        job["run_id"] = storage.call(lambda conn: benchmark.save_report(conn, report, job["source"]))
+        job["state"] = "done"
+        log_event(f"Benchmark {job['id']} finished: run {job['run_id']}")
     except Exception as e:
-        log_event(f"DoH query error for {url}: {e}", "error")
-        return False
+        job["state"] = "failed"
+        job["error"] = str(e)
+        log_event(f"Benchmark {job['id']} failed: {e}", "error")
+    socketio.emit("benchmark_progress", dict(job))
+
+# In-process lookups
+def lookup_resolver(target):
+    """Return (resolve(name, qtype), target label) for "local", "current" or a configured provider URL."""
+    timeout = app.config['DOH_PROBE_TIMEOUT']
+    if target == "local":
+        host, port = local_resolver()
+        return (lambda name, qtype: lookup.query_dns(host, port, name, qtype, timeout=timeout)), f"{host}:{port}"
+    if target == "current":
+        _, target, _ = get_current_doh_provider()
+    elif find_provider(normalize_url(target)) is None:
+        raise ValueError(f"Unknown provider: {target}")
+    method = app.config['DOH_PROBE_METHOD']
+    return (lambda name, qtype: lookup.query_doh(doh_pool, target, name, qtype, method=method, timeout=timeout)), target
+
+def record_lookups(ts, target, results):
+    """Write lookup results to dns_lookup_history in one batch."""
+    storage.executemany(
+        "INSERT INTO dns_lookup_history(domain, ts, result, qtype, rcode, ms, target, error) VALUES (?,?,?,?,?,?,?,?)",
+        [(r["domain"], ts, json.dumps(r["answers"]), r["type"], r["rcode"], r["ms"], target, r["error"])
+         for r in results],
+    )
 
-# Automatic retention: purge records older than 6 hours
-def cleanup_old_records():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    hrs = app.config['RETENTION_HOURS']
-    c.execute(f"DELETE FROM ping_history WHERE time <= datetime('now','-{hrs} hours')")
-    c.execute(f"DELETE FROM dns_lookup_history WHERE time <= datetime('now','-{hrs} hours')")
-    conn.commit()
-    conn.close()
+# DNS-over-HTTPS validation
+@profiling.timed("doh_probe")
+def doh_probe(url):
+    """Resolve example.com through the provider with an RFC 8484 query and time each phase."""
+    key = normalize_url(url)
+    result = concurrency.offload(
+        doh.probe,
+        doh_pool,
+        url,
+        method=app.config['DOH_PROBE_METHOD'],
+        name=app.config['DOH_PROBE_DOMAIN'],
+        timeout=provider_health.timeout(key, "doh", app.config['DOH_PROBE_TIMEOUT']),
+    )
+    if result["ok"]:
+        provider_health.observe(key, "doh", result["total_ms"])
+    if provider_health.record(key, result["ok"], result["error"]) == breaker.OPEN:
+        log_event(f"Circuit open for {url}: probes paused after repeated failures", "warning")
+    doh_probes_total.inc(provider=url, ok=str(result["ok"]).lower())
+    if result["total_ms"] is not None:
+        doh_query_seconds.observe(result["total_ms"] / 1000, provider=url)
+    if not result["ok"]:
+        log_event(f"DoH query error for {url}: {result['error']}", "error")
+    return result
+
+
+def doh_failure(error, skipped=False):
+    """Build a failed DoH probe result for probes that never ran to completion."""
+    return {"ok": False, "cold": False, "dns_ms": None, "connect_ms": None, "tls_ms": None,
+            "ttfb_ms": None, "total_ms": None, "answers": [], "error": error, "skipped": skipped}
+
+
+def doh_latency(doh_result):
+    """Total DoH resolution time in ms, or "Failed" for display."""
+    return doh_result["total_ms"] if doh_result["ok"] else "Failed"
+
+# Automatic retention: purge records older than RETENTION_HOURS in small batches
+def rollup_retention():
+    """Retention in seconds for each rollup resolution."""
+    return {
+        "1m": app.config['ROLLUP_RETENTION_1M_HOURS'] * 3600,
+        "1h": app.config['ROLLUP_RETENTION_1H_DAYS'] * 86400,
+        "1d": app.config['ROLLUP_RETENTION_1D_DAYS'] * 86400,
+    }
+
+def retention_cutoffs(now):
+    """(table, time column, cutoff) for every table the retention job prunes."""
+    raw_cutoff = now - app.config['RETENTION_HOURS'] * 3600
+    cutoffs = [(table, "ts", raw_cutoff) for table in HISTORY_TABLES]
+    cutoffs.append(("autoselect_decisions", "ts", now - app.config['AUTOSELECT_RETENTION_DAYS'] * 86400))
+    for name, seconds in rollup_retention().items():
+        cutoffs.append((rollups.table_name(name), "bucket", now - seconds))
+        cutoffs.append((rollups.sketch_table_name(name), "bucket", now - seconds))
+    return cutoffs
+
+def purge_expired(table, cutoff, column="ts"):
+    """Delete at most RETENTION_BATCH_SIZE rows older than cutoff; return the number deleted."""
+    limit = app.config['RETENTION_BATCH_SIZE']
+    return storage.call(lambda conn: conn.execute(
+        f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE {column} < ? ORDER BY {column} LIMIT ?)",
+        (cutoff, limit),
+    ).rowcount)
+
+def retention_job():
+    """Prune expired history every RETENTION_INTERVAL seconds.
+
+    Each batch is its own transaction, so queued writes are interleaved with
+    the purge instead of waiting behind one large DELETE.
+    """
+    while True:
+        try:
+            for table, column, cutoff in retention_cutoffs(int(time.time())):
+                deleted = total = purge_expired(table, cutoff, column)
+                while deleted == app.config['RETENTION_BATCH_SIZE']:
+                    socketio.sleep(0)
+                    deleted = purge_expired(table, cutoff, column)
+                    total += deleted
+                if table == "ping_history":
+                    # older windows are answered from the rollups now, not from memory
+                    ping_buffers.raise_floor(cutoff)
+                if total:
+                    log_event(f"Retention removed {total} rows from {table}", "debug")
+        except Exception as e:
+            log_event(f"Retention job error: {e}", "error")
+        socketio.sleep(app.config['RETENTION_INTERVAL'])
 
-# Background thread for real-time status events
-def background_thread():
-    """Send status_update events every 5 seconds, and clean old records."""
+def rollup_job():
+    """Fold completed raw samples into the 1m/1h/1d rollups every ROLLUP_INTERVAL seconds."""
+    while True:
+        try:
+            written = storage.call(lambda conn: rollups.roll_up(conn, int(time.time())))
+            log_event(f"Rollup wrote {written}", "debug")
+        except Exception as e:
+            log_event(f"Rollup job error: {e}", "error")
+        socketio.sleep(app.config['ROLLUP_INTERVAL'])
+
+def record_decision(decision):
+    storage.execute(
+        "INSERT INTO autoselect_decisions (ts, current, best, current_score, best_score, improvement, action, reason)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        tuple(decision[k] for k in ("ts", "current", "best", "current_score", "best_score", "improvement", "action", "reason")),
+    )
+
+def autoselect_step():
+    """Score the providers and switch upstream if the selector says so.
+
+    The scores come from every recorded probe. With the probe scheduler
+    running, those samples are already taken on its schedule; without it,
+    every provider is probed here first. Providers whose circuit breaker is
+    open lose their score until they are healthy again.
+    """
+    providers = load_providers()
+    urls = [p["url"] for p in providers]
+    if not app.config['PROBE_SCHEDULER_ENABLED']:
+        probe_all_providers(providers)
+    auto_selector.forget([url for url in urls if provider_health.closed(normalize_url(url))])
+    _, _, current = get_current_doh_provider()
+    decision = auto_selector.evaluate(current, urls)
+    if decision["action"] == "switch":
+        name = next(p["name"] for p in providers if p["url"] == decision["best"])
+        try:
+            job = update_doh_service(decision["best"], name)
+            log_event(f"Auto-select switching to {name}: {decision['reason']} (job {job.id})")
+        except SwitchInProgress as e:
+            decision = dict(decision, action="wait", reason=f"switch already running: {e}")
+    record_decision(decision)
+    return decision
+
+def autoselect_job():
+    """Run auto-select every AUTOSELECT_INTERVAL seconds while it is enabled."""
+    while True:
+        if auto_selector.enabled:
+            try:
+                autoselect_step()
+            except Exception as e:
+                log_event(f"Auto-select error: {e}", "error")
+        socketio.sleep(app.config['AUTOSELECT_INTERVAL'])
+
+# continuous probing of the providers the status loop does not measure
+probe_scheduler = scheduler.ProbeScheduler(
+    interval=app.config['PROBE_SCHEDULER_INTERVAL'],
+    jitter=app.config['PROBE_SCHEDULER_JITTER'],
+    rate=app.config['PROBE_SCHEDULER_RATE'],
+    concurrency=app.config['PROBE_SCHEDULER_CONCURRENCY'],
+    max_backoff=app.config['PROBE_SCHEDULER_MAX_BACKOFF'],
+)
+# (url, ping, doh result) from scheduler workers, streamed by the scheduler job
+scheduled_results = queue.Queue()
+
+
+def scheduled_providers():
+    """Every configured provider except the current one, which the status loop already probes."""
+    current = get_current_doh_provider()[2]
+    return [p for p in provider_registry.all() if p["url"] != current]
+
+
+def run_scheduled_probe(provider):
+    url = provider["url"]
+    try:
+        ping_result, doh_result = probe_provider(url)
+    except Exception as e:
+        log_event(f"Scheduled probe error for {url}: {e}", "error")
+        ping_result, doh_result = "Failed", doh_failure(str(e))
+    test_results[url] = {"ping": ping_result, "doh": doh_latency(doh_result)}
+    record_ping(url, ping_result, doh_result)
+    probe_scheduler.done(url, doh_result["ok"])
+    if not doh_result.get("skipped"):
+        scheduled_results.put((url, ping_result, doh_result))
+
+
+def probe_scheduler_job():
+    """Launch due provider probes on a worker pool and stream their results."""
+    executor = ThreadPoolExecutor(max_workers=app.config['PROBE_SCHEDULER_CONCURRENCY'],
+                                  thread_name_prefix="scheduled-probe")
     while True:
-        cleanup_old_records()
-        _, full_url, base = get_current_doh_provider()
-        status = get_service_status()
-        net = get_network_info()
-        ping = None
+        try:
+            probe_scheduler.sync(scheduled_providers())
+            for provider in probe_scheduler.take():
+                executor.submit(run_scheduled_probe, provider)
+            while not scheduled_results.empty():
+                url, ping_result, doh_result = scheduled_results.get_nowait()
+                stream_probe(url, format_ts(time.time()), ping_result, doh_result["ok"], doh_result["total_ms"])
+        except Exception as e:
+            log_event(f"Probe scheduler error: {e}", "error")
+        socketio.sleep(probe_scheduler.wait_time())
+
+# Shared status snapshot, computed once per interval for every dashboard client
+status_snapshot = {"version": 0, "etag": None, "body": None, "data": None, "updated": 0.0}
+status_lock = threading.Lock()
+status_refresh_lock = threading.Lock()
+# distinguishes ETags across restarts, since versions start again at 1
+SNAPSHOT_EPOCH = f"{int(time.time()):x}"
+
+def collect_status():
+    """Measure the current provider once and record the sample."""
+    _, full_url, base = get_current_doh_provider()
+    status = get_service_status()
+    net = get_network_info()
+    if provider_health.allow(base):
         try:
             ping = ping_provider(full_url)
-        except:
+        except Exception:
             ping = None
-        doh_ok = doh_query_test(full_url)
-        ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        # update history
-        hist = ping_history.get(base, [])
-        ping_val = ping if isinstance(ping, (int, float)) else None
-        hist.append({"time": ts, "ping": ping_val, "doh_ok": doh_ok})
-        if len(hist) > 100:
-            hist.pop(0)
-        ping_history[base] = hist
-        # insert into SQLite DB
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        ping_val = ping if isinstance(ping, (int, float)) else None
-        c.execute(
-            "INSERT INTO ping_history(provider, time, ping, doh_ok) VALUES (?,?,?,?)",
-            (base, ts, ping_val, int(doh_ok))
+        doh_result = doh_probe(full_url)
+    else:
+        ping, doh_result = "Failed", doh_failure("circuit open", skipped=True)
+    doh_ok = doh_result["ok"]
+    ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # ring buffer and SQLite
+    record_ping(base, ping, doh_result)
+    return {
+        "time": ts,
+        "provider": base,
+        "service_status": status,
+        "network_info": net,
+        "current_ping": ping,
+        "doh_ok": doh_ok,
+        "doh_ms": doh_result["total_ms"],
+        "ping_history": recent_history(base, app.config['STREAM_HISTORY_SIZE']),
+    }
+
+def system_fields(data):
+    return {"provider": data["provider"], "service_status": data["service_status"],
+            "network_info": data["network_info"]}
+
+
+def send_stream_message(sid, event, payload):
+    socketio.emit(event, status_stream.encode(sid, payload), to=sid)
+
+
+def stream_update(channel, sample, fields):
+    """Apply an update to a status channel and send its delta to the room, skipping lagging clients."""
+    delta, skip, catch_ups = status_stream.update(channel, sample, fields)
+    if delta is not None:
+        socketio.emit("status_delta", delta, to=stream.room(channel), skip_sid=skip or None)
+    for sid, event, payload in catch_ups:
+        send_stream_message(sid, f"status_{event}", payload)
+
+
+def stream_probe(provider, time_str, ping, doh_ok, doh_ms):
+    """Send a provider's new sample and changed probe fields to its channel."""
+    sample = {"time": time_str, "ping": ping if isinstance(ping, (int, float)) else None, "doh_ok": doh_ok}
+    stream_update(provider, sample, {"current_ping": ping, "doh_ok": doh_ok, "doh_ms": doh_ms})
+
+
+def stream_status(data):
+    """Send one tick's changes: system fields that changed and the new sample for its provider."""
+    stream_update(stream.SYSTEM, None, system_fields(data))
+    stream_probe(data["provider"], data["time"], data["current_ping"], data["doh_ok"], data["doh_ms"])
+
+
+def publish_status(data):
+    """Install data as the next snapshot version, serialized once for all clients."""
+    with status_lock:
+        version = status_snapshot["version"] + 1
+        data = dict(data, version=version)
+        status_snapshot.update(
+            version=version,
+            data=data,
+            body=json.dumps(data),
+            etag=f"{SNAPSHOT_EPOCH}-{version}",
+            updated=time.monotonic(),
         )
-        conn.commit()
-        conn.close()
-        socketio.emit("status_update", {
-            "time": ts,
-            "service_status": status,
-            "network_info": net,
-            "current_ping": ping,
-            "doh_ok": doh_ok,
-            "ping_history": hist
-        }, broadcast=True)
+    return data
+
+def snapshot_stale():
+    max_age = 2 * app.config['TEST_INTERVAL']
+    return status_snapshot["body"] is None or time.monotonic() - status_snapshot["updated"] > max_age
+
+@concurrency.offloaded
+def refresh_stale_snapshot():
+    # runs off the event loop, so waiting on the lock parks only this request
+    with status_refresh_lock:
+        # another request may have refreshed it while we waited
+        if snapshot_stale():
+            publish_status(collect_status())
+
+def current_status_snapshot():
+    """Return the latest snapshot, refreshing it only if the producer has fallen behind."""
+    if snapshot_stale():
+        refresh_stale_snapshot()
+    with status_lock:
+        return dict(status_snapshot)
+
+# Background thread for real-time status events
+def background_thread():
+    """Produce a status snapshot and stream its changes to subscribers every TEST_INTERVAL seconds."""
+    while True:
+        start = time.perf_counter()
+        doh_pool.evict_idle()
+        try:
+            data = publish_status(concurrency.offload(collect_status))
+            stream_status(data)
+        except Exception as e:
+            log_event(f"Status update error: {e}", "error")
+        tick_seconds.observe(time.perf_counter() - start)
         socketio.sleep(app.config['TEST_INTERVAL'])
 
 if __name__ == "__main__":
+    # blocking calls made by requests and background tasks run on worker threads
+    concurrency.enable(app.config['WORKER_THREADS'])
     # start background task for real-time updates
     socketio.start_background_task(background_thread)
-    socketio.run(app, debug=False, host="0.0.0.0", port=5003)
+    socketio.start_background_task(retention_job)
+    socketio.start_background_task(rollup_job)
+    socketio.start_background_task(autoselect_job)
+    if app.config['PROBE_SCHEDULER_ENABLED']:
+        socketio.start_background_task(probe_scheduler_job)
+    if forwarder is not None:
+        if forwarder_replaces_cloudflared():
+            # cloudflared would keep port 53, answering through its old upstream
+            run_command(["sudo", "systemctl", "disable", "--now", "cloudflared"], check=False)
+            log_event("Stopped and disabled cloudflared; the built-in forwarder serves port 53")
+        else:
+            log_event(f"Built-in forwarder on port {forwarder.port}: the system resolver is still cloudflared", "warning")
+        forwarder.start()
+        atexit.register(forwarder.stop)
+    if socketio.async_mode == "eventlet":
+        import socket
+        import eventlet
+        import eventlet.wsgi
+        # what socketio.run does, plus TCP_NODELAY (inherited by accepted sockets): headers and body are
+        # separate writes, and Nagle would hold the body back until the client's delayed ACK, ~40 ms
+        listener = eventlet.listen(("0.0.0.0", app.config['PORT']))
+        listener.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        eventlet.wsgi.server(listener, app, log_output=False)
+    else:
+        socketio.run(app, debug=False, host="0.0.0.0", port=app.config['PORT'])
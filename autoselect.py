@@ -0,0 +1,168 @@
+"""Latency-aware automatic upstream selection with hysteresis."""
+import threading
+import time
+from collections import deque
+
+
+class ProviderScore:
+    """Exponentially weighted DoH latency and failure rate of one provider."""
+
+    def __init__(self):
+        self.latency = None
+        self.failure = None
+        self.samples = 0
+        self.updated = None
+
+    def observe(self, latency_ms, ok, alpha, now):
+        failed = 0.0 if ok else 1.0
+        self.failure = failed if self.failure is None else alpha * failed + (1 - alpha) * self.failure
+        if ok and latency_ms is not None:
+            self.latency = latency_ms if self.latency is None else alpha * latency_ms + (1 - alpha) * self.latency
+        self.samples += 1
+        self.updated = now
+
+    def score(self, failure_penalty):
+        """Lower is better: latency plus the failure rate weighted as failure_penalty ms."""
+        if self.failure is None:
+            return None
+        latency = self.latency if self.latency is not None else failure_penalty
+        return latency + self.failure * failure_penalty
+
+    def as_dict(self, failure_penalty):
+        score = self.score(failure_penalty)
+        return {
+            "latency": None if self.latency is None else round(self.latency, 2),
+            "failure": None if self.failure is None else round(self.failure, 4),
+            "score": None if score is None else round(score, 2),
+            "samples": self.samples,
+            "updated": self.updated,
+        }
+
+
+class AutoSelector:
+    """Pick the best-scoring provider, switching only on a sustained, clear improvement.
+
+    A provider is only considered once it has ``min_samples`` observations.
+    The best provider must score at least ``margin`` (a fraction) better than
+    the current one for ``sustain`` seconds in a row, and the current provider
+    must have been in place for ``dwell`` seconds, before ``evaluate`` returns
+    a switch decision. A provider whose switch failed is passed over for
+    ``dwell`` seconds. Every evaluation returns a decision dict, and the most
+    recent ones are kept in memory.
+    """
+
+    def __init__(self, alpha=0.3, margin=0.2, sustain=120, dwell=600, failure_penalty=1000,
+                 min_samples=3, history=100, clock=time.monotonic):
+        self.alpha = alpha
+        self.margin = margin
+        self.sustain = sustain
+        self.dwell = dwell
+        self.failure_penalty = failure_penalty
+        self.min_samples = min_samples
+        self.clock = clock
+        self.enabled = False
+        self.last_switch = None
+        self._scores = {}
+        self._candidate = None  # (url, monotonic time it first beat the current provider)
+        self._cooldowns = {}  # url -> monotonic time a failed switch to it stops counting against it
+        self._decisions = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def observe(self, url, latency_ms, ok, now=None):
+        """Fold one probe result (DoH latency in ms, success flag) into url's scores."""
+        with self._lock:
+            self._scores.setdefault(url, ProviderScore()).observe(latency_ms, ok, self.alpha, now or time.time())
+
+    def forget(self, urls):
+        """Drop the scores of every provider not in urls."""
+        with self._lock:
+            for url in [url for url in self._scores if url not in urls]:
+                del self._scores[url]
+
+    def evaluate(self, current, providers, now=None):
+        """Decide whether to leave current for one of providers (a list of URLs).
+
+        Returns a dict with ``action`` ("stay", "wait" or "switch"), the
+        ``current`` and ``best`` URLs and scores, the relative ``improvement``
+        and a human-readable ``reason``.
+        """
+        now = now or time.time()
+        clock = self.clock()
+        with self._lock:
+            cooling = {url for url, until in self._cooldowns.items() if until > clock and url != current}
+            scored = {
+                url: self._scores[url].score(self.failure_penalty)
+                for url in providers
+                if url in self._scores and self._scores[url].samples >= self.min_samples and url not in cooling
+            }
+            current_score = scored.get(current)
+            best = min(scored, key=scored.get) if scored else None
+            decision = {
+                "ts": int(now), "current": current, "best": best,
+                "current_score": None if current_score is None else round(current_score, 2),
+                "best_score": None if best is None else round(scored[best], 2),
+                "improvement": None, "action": "stay", "reason": "",
+            }
+            if best is None:
+                decision["reason"] = "not enough samples"
+            elif best == current and cooling & set(providers):
+                decision["reason"] = "current provider is the best of those not cooling down after a failed switch"
+            elif best == current:
+                decision["reason"] = "current provider is the best"
+            else:
+                # an unscored current provider (too few samples) counts as a full improvement
+                improvement = 1.0 if not current_score else (current_score - scored[best]) / current_score
+                decision["improvement"] = round(improvement, 4)
+                if improvement < self.margin:
+                    decision["reason"] = f"improvement below the {self.margin:.0%} margin"
+                else:
+                    if self._candidate is None or self._candidate[0] != best:
+                        self._candidate = (best, clock)
+                    held = clock - self._candidate[1]
+                    dwelled = None if self.last_switch is None else clock - self.last_switch
+                    if held < self.sustain:
+                        decision["action"] = "wait"
+                        decision["reason"] = f"better for {held:.0f}s of the required {self.sustain}s"
+                    elif dwelled is not None and dwelled < self.dwell:
+                        decision["action"] = "wait"
+                        decision["reason"] = f"current provider in place for {dwelled:.0f}s of the minimum {self.dwell}s"
+                    else:
+                        decision["action"] = "switch"
+                        decision["reason"] = f"{improvement:.0%} better for {held:.0f}s"
+            if decision["action"] == "stay":
+                self._candidate = None
+            self._decisions.append(decision)
+            return decision
+
+    def ranked(self, urls):
+        """urls ordered best score first; unscored providers keep their order at the end."""
+        with self._lock:
+            scores = {url: self._scores[url].score(self.failure_penalty) for url in urls if url in self._scores}
+        scored = sorted((url for url in urls if scores.get(url) is not None), key=scores.get)
+        return scored + [url for url in urls if scores.get(url) is None]
+
+    def switched(self):
+        """Note that the upstream was just changed (by this selector or by hand)."""
+        with self._lock:
+            self.last_switch = self.clock()
+            self._candidate = None
+
+    def failed(self, url):
+        """Note that a switch to url failed or was rolled back; pass it over for ``dwell`` seconds."""
+        with self._lock:
+            self._cooldowns[url] = self.clock() + self.dwell
+            self._candidate = None
+
+    def state(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "candidate": self._candidate[0] if self._candidate else None,
+                "cooling": sorted(url for url, until in self._cooldowns.items() if until > self.clock()),
+                "scores": {url: score.as_dict(self.failure_penalty) for url, score in self._scores.items()},
+                "decisions": list(self._decisions),
+                "settings": {
+                    "alpha": self.alpha, "margin": self.margin, "sustain": self.sustain,
+                    "dwell": self.dwell, "failure_penalty": self.failure_penalty, "min_samples": self.min_samples,
+                },
+            }
@@ -0,0 +1 @@
+"""Performance benchmarks for the app's hot paths, run against local fixtures (python -m bench.run)."""
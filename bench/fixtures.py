@@ -0,0 +1,137 @@
+"""Local stand-ins for everything the app talks to: DoH providers, the unit file and systemctl."""
+import base64
+import json
+import os
+import stat
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dnslib import A, DNSRecord, RR
+
+UNIT_FILE = """[Unit]
+Description=cloudflared DNS over HTTPS proxy
+
+[Service]
+ExecStart=/usr/bin/cloudflared proxy-dns --port 53 --upstream {url}
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+# `sudo cmd ...` runs cmd; `systemctl ...` always succeeds (is-active reports running)
+FAKE_COMMANDS = {
+    "sudo": '#!/bin/sh\nexec "$@"\n',
+    "systemctl": "#!/bin/sh\nexit 0\n",
+}
+
+
+# /proc, cgroup and resolv.conf files read by introspect.Introspector (SYSTEM_ROOT)
+SYSTEM_FILES = {
+    "etc/resolv.conf": "nameserver 127.0.0.53\noptions edns0\n",
+    "proc/net/route": (
+        "Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask\t\tMTU\tWindow\tIRTT\n"
+        "eth0\t00000000\t010200C0\t0003\t0\t0\t100\t00000000\t0\t0\t0\n"
+        "eth0\t000200C0\t00000000\t0001\t0\t0\t100\t00FFFFFF\t0\t0\t0\n"
+    ),
+    "proc/net/fib_trie": (
+        "Main:\n  +-- 0.0.0.0/0 3 0 5\n     |-- 0.0.0.0\n        /0 universe UNICAST\n"
+        "     +-- 192.0.2.0/24 2 0 2\n        |-- 192.0.2.0\n           /24 link UNICAST\n"
+        "        |-- 192.0.2.10\n           /32 host LOCAL\n"
+    ),
+    "sys/fs/cgroup/system.slice/cloudflared.service/cgroup.procs": "4242\n",
+}
+
+
+class FakeDohServer:
+    """RFC 8484 server on 127.0.0.1 answering every A query with 192.0.2.1 after ``delay`` seconds."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.queries = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are separate writes; don't let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                param = self.path.partition("dns=")[2].split("&")[0]
+                self._answer(base64.urlsafe_b64decode(param + "=" * (-len(param) % 4)))
+
+            def do_POST(self):
+                self._answer(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+            def _answer(self, wire):
+                server.queries += 1
+                if server.delay:
+                    time.sleep(server.delay)
+                query = DNSRecord.parse(wire)
+                reply = query.reply()
+                reply.add_answer(RR(str(query.q.qname), rdata=A("192.0.2.1"), ttl=300))
+                body = reply.pack()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/dns-message")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            # TCP-connect pings and pooled connections arrive in bursts
+            request_queue_size = 128
+
+            def handle_error(self, request, client_address):
+                pass  # latency pings connect and hang up without sending a request
+
+        self._httpd = Server(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}/dns-query"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def make_environment(root, providers):
+    """Write the fixture files under root and return the environment variables pointing the app at them.
+
+    ``providers`` is a list of {"name", "url"}; the unit file's upstream is the
+    first one. Fake sudo/systemctl scripts are put first on PATH, and a
+    system/ tree with SYSTEM_FILES stands in for /proc, cgroups and /etc.
+    """
+    bin_dir = os.path.join(root, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, script in FAKE_COMMANDS.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as file:
+            file.write(script)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    service_file = os.path.join(root, "cloudflared.service")
+    with open(service_file, "w") as file:
+        file.write(UNIT_FILE.format(url=providers[0]["url"]))
+    with open(os.path.join(root, "doh_providers.json"), "w") as file:
+        json.dump(providers, file, indent=4)
+    system_root = os.path.join(root, "system")
+    for relative, content in SYSTEM_FILES.items():
+        path = os.path.join(system_root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write(content)
+    return {
+        "SERVICE_FILE": service_file,
+        "DB_PATH": os.path.join(root, "doh_history.db"),
+        "LOG_FILE": os.path.join(root, "log", "doh-switcher.log"),
+        "PATH": bin_dir + os.pathsep + os.environ.get("PATH", ""),
+        "PING_METHOD": "tcp",
+        "SYSTEM_ROOT": system_root,
+    }
@@ -0,0 +1,191 @@
+"""Load-test the running server: dashboard and API latency at idle and while a full provider test runs.
+
+Starts ``app.py`` as a real eventlet server against local fixtures with slow
+fake DoH providers, then keeps a few clients requesting the dashboard and
+read APIs. The first phase measures them at idle, the second while
+``POST /test_providers`` is tested over and over.
+
+Usage (from the repository root):
+
+    python -m bench.loadtest                        # worker threads as configured
+    python -m bench.loadtest --worker-threads 0     # blocking work on the event loop, for comparison
+
+Exits with status 1 when any request answers with something other than 200
+or a route's p99 during the provider tests exceeds its idle p99 by more than
+--budget-ms. The status endpoints need root, as in production, so it exits
+with status 2 unless run with sudo.
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+from bench.fixtures import FakeDohServer, make_environment
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def request(conn, method, path, body=None, headers=None):
+    """Send one request on a keep-alive connection; returns (status, seconds)."""
+    start = time.perf_counter()
+    conn.request(method, path, body=body, headers=headers or {})
+    response = conn.getresponse()
+    response.read()
+    return response.status, time.perf_counter() - start
+
+
+def start_server(env, port, log_path, timeout=30):
+    log = open(log_path, "w")
+    process = subprocess.Popen([sys.executable, APP], env=env, cwd=env["LOADTEST_ROOT"], stdout=log,
+                               stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}, see {log_path}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            if request(conn, "GET", "/metrics")[0] == 200:
+                conn.close()
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"server did not answer on port {port} within {timeout}s, see {log_path}")
+
+
+def hammer(port, paths, seconds, results, errors):
+    """Request paths in turn on one connection for at least one round and seconds, appending latencies (ms) per path."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    deadline = time.monotonic() + seconds
+    while True:
+        for name, path in paths:
+            try:
+                status, elapsed = request(conn, "GET", path)
+            except (OSError, http.client.HTTPException):
+                errors.append(name)
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                continue
+            if status != 200:
+                errors.append(name)
+            results[name].append(elapsed * 1000)
+        if time.monotonic() >= deadline:
+            break
+    conn.close()
+
+
+def run_phase(port, paths, clients, seconds):
+    results = {name: [] for name, _ in paths}
+    errors = []
+    threads = [threading.Thread(target=hammer, args=(port, paths, seconds, results, errors)) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def full_tests(port, stop, durations):
+    """POST /test_providers back to back until stop is set, recording each run's duration (s)."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    while not stop.is_set():
+        durations.append(request(conn, "POST", "/test_providers", body="", headers=headers)[1])
+    conn.close()
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"n": 0, "p50_ms": None, "p99_ms": None, "max_ms": None}
+    pick = lambda q: round(latencies[min(int(q * len(latencies)), len(latencies) - 1)], 1)
+    return {"n": len(latencies), "p50_ms": pick(0.5), "p99_ms": pick(0.99), "max_ms": round(latencies[-1], 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure route latency while full provider tests run.")
+    parser.add_argument("--providers", type=int, default=6, help="number of fake DoH providers")
+    parser.add_argument("--delay", type=float, default=1.0, help="fake DoH server latency in seconds")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent client connections")
+    parser.add_argument("--seconds", type=float, default=8, help="length of each phase")
+    parser.add_argument("--worker-threads", type=int, help="WORKER_THREADS for the server (default: as configured)")
+    # a probe blocking the event loop stalls requests for at least --delay; the budget only absorbs noise
+    # from client threads, fake servers and the app sharing few CPUs
+    parser.add_argument("--budget-ms", type=float, default=100, help="allowed p99 increase over idle")
+    args = parser.parse_args(argv)
+    if os.geteuid() != 0:
+        # the API routes are behind require_sudo and would only time redirects
+        print("bench.loadtest must run as root (sudo), like the app", file=sys.stderr)
+        return 2
+
+    root = tempfile.mkdtemp(prefix="doh-switcher-loadtest-")
+    servers = [FakeDohServer(delay=args.delay).start() for _ in range(args.providers)]
+    providers = [{"name": f"Fake {i}", "url": server.url} for i, server in enumerate(servers)]
+    port = free_port()
+    env = dict(os.environ, **make_environment(root, providers), PORT=str(port), LOADTEST_ROOT=root,
+               PROBE_SCHEDULER_ENABLED="0", DOH_PROBE_TIMEOUT=str(args.delay * 3))
+    if args.worker_threads is not None:
+        env["WORKER_THREADS"] = str(args.worker_threads)
+    process = start_server(env, port, os.path.join(root, "server.log"))
+
+    url = quote(providers[0]["url"], safe="")
+    paths = [
+        ("GET /", "/"),
+        ("GET /api/status", "/api/status"),
+        ("GET /api/ping_history", f"/api/ping_history?provider={url}"),
+        ("GET /metrics", "/metrics"),
+    ]
+    try:
+        # the first /api/status waits for the initial snapshot
+        warm_errors = run_phase(port, paths, 1, 0)[1]
+        idle, idle_errors = run_phase(port, paths, args.clients, args.seconds)
+        stop, durations = threading.Event(), []
+        tester = threading.Thread(target=full_tests, args=(port, stop, durations))
+        tester.start()
+        loaded, loaded_errors = run_phase(port, paths, args.clients, args.seconds)
+        stop.set()
+        tester.join()
+    finally:
+        process.terminate()
+        process.wait()
+        for server in servers:
+            server.stop()
+
+    print(f"{args.providers} providers answering in {args.delay}s, {args.clients} clients, {args.seconds}s per phase")
+    if durations:
+        print(f"full provider test: {len(durations)} runs, {sum(durations) / len(durations):.2f}s average")
+    print(f"{'route':<24} {'phase':<8} {'requests':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    over = []
+    for name, _ in paths:
+        before, during = percentiles(idle[name]), percentiles(loaded[name])
+        for phase, r in (("idle", before), ("testing", during)):
+            print(f"{name:<24} {phase:<8} {r['n']:>8} {r['p50_ms'] or 0:>9.1f} {r['p99_ms'] or 0:>9.1f} {r['max_ms'] or 0:>9.1f}")
+        if during["n"] == 0 or before["n"] == 0 or during["p99_ms"] > before["p99_ms"] + args.budget_ms:
+            over.append(name)
+    failed = False
+    for errors, phase in ((warm_errors, "warming up"), (idle_errors, "idle"), (loaded_errors, "testing")):
+        if errors:
+            print(f"{len(errors)} failed requests while {phase}: {', '.join(sorted(set(errors)))}")
+            failed = True
+    if over:
+        print(f"p99 grew by more than {args.budget_ms} ms during provider tests: {', '.join(over)}")
+    if failed or over:
+        return 1
+    print(f"p99 of every route stayed within {args.budget_ms} ms of idle during provider tests")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""Benchmark probe throughput, route latency, SQLite inserts and the status tick against local fixtures.
+
+Usage (from the repository root):
+
+    python -m bench.run                     # run and print results
+    python -m bench.run --save v1.4         # also save bench/baselines/v1.4.json
+    python -m bench.run --compare v1.4      # flag p50/p99 regressions against a baseline
+
+Exits with status 1 when --compare finds a regression beyond --tolerance. The
+API routes need root, as in production; run it with sudo.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+from bench.fixtures import FakeDohServer, make_environment
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def measure(fn, iterations, concurrency=1, warmup=3):
+    """Call fn() iterations times on concurrency threads; return throughput and latency percentiles (ms)."""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(iterations))
+
+    def worker():
+        local = []
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    break
+            start = time.perf_counter()
+            fn()
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    pick = lambda q: round(latencies[min(int(q * len(latencies)), len(latencies) - 1)], 3)
+    return {"iterations": iterations, "concurrency": concurrency, "seconds": round(elapsed, 3),
+            "throughput": round(iterations / elapsed, 1), "p50_ms": pick(0.5), "p99_ms": pick(0.99)}
+
+
+def expect(status, send):
+    """Wrap a test-client request so a wrong status fails the benchmark instead of being timed."""
+    def call():
+        response = send()
+        if response.status_code != status:
+            raise RuntimeError(f"expected HTTP {status}, got {response.status_code}")
+        return response
+    return call
+
+
+def benchmarks(app, args):
+    """(name, fn, iterations, concurrency) for every benchmark; app is the imported app module."""
+    providers = app.load_providers()
+    url = providers[0]["url"]
+    client = app.app.test_client()
+    n = args.iterations
+
+    # seed enough history for the read routes to do real work
+    for i in range(2000):
+        app.record_ping(url, 10 + i % 50, {"ok": True, "dns_ms": None, "connect_ms": None, "tls_ms": None,
+                                           "ttfb_ms": 1.0, "total_ms": 12.0 + i % 7})
+    app.storage.flush()
+    app.publish_status(app.collect_status())
+    domains = [f"host{i}.bench.test" for i in range(20)]
+
+    def insert_and_commit():
+        for _ in range(100):
+            app.record_ping(url, 12.5, {"ok": True, "dns_ms": None, "connect_ms": None, "tls_ms": None,
+                                        "ttfb_ms": 1.0, "total_ms": 12.0})
+        app.storage.flush()
+
+    return [
+        ("doh_probe", lambda: app.doh_probe(url), n, 1),
+        ("ping_provider", lambda: app.ping_provider(url), n, 1),
+        ("probe_all_providers", lambda: app.probe_all_providers(providers), max(n // 10, 5), 1),
+        ("sqlite_insert_x100", insert_and_commit, max(n // 10, 5), 1),
+        ("status_tick", lambda: app.publish_status(app.collect_status()), max(n // 5, 5), 1),
+        ("GET /api/status", expect(200, lambda: client.get("/api/status")), n, args.concurrency),
+        # the ETag of the snapshot current at call time; status ticks publish new versions
+        ("GET /api/status 304",
+         expect(304, lambda: client.get("/api/status", headers={"If-None-Match": app.status_snapshot["etag"]})),
+         n, args.concurrency),
+        ("GET /api/ping_history", expect(200, lambda: client.get(f"/api/ping_history?provider={url}")),
+         n, args.concurrency),
+        ("GET /api/analytics", expect(200, lambda: client.get(f"/api/analytics?provider={url}&range=3600")),
+         n, args.concurrency),
+        ("POST /api/lookup/batch x20",
+         expect(200, lambda: client.post("/api/lookup/batch", json={"domains": domains, "target": url})),
+         max(n // 5, 5), 1),
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """Return a line per benchmark whose p50 or p99 grew by more than tolerance over the baseline."""
+    regressions = []
+    for name, result in results.items():
+        old = baseline["results"].get(name)
+        if not old:
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            if old[key] and result[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {old[key]} -> {result[key]} (+{result[key] / old[key] - 1:.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app's hot paths against local fixtures.")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4, help="client threads for route benchmarks")
+    parser.add_argument("--providers", type=int, default=4, help="number of fake DoH providers")
+    parser.add_argument("--delay", type=float, default=0.0, help="fake DoH server latency in seconds")
+    parser.add_argument("--only", help="run only benchmarks whose name contains this text")
+    parser.add_argument("--save", metavar="NAME", help="save results as bench/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare with bench/baselines/NAME.json")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before flagging (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+    if os.geteuid() != 0:
+        # the API routes are behind require_sudo and would only time redirects
+        print("bench.run must run as root (sudo), like the app", file=sys.stderr)
+        return 2
+
+    root = tempfile.mkdtemp(prefix="doh-switcher-bench-")
+    servers = [FakeDohServer(delay=args.delay).start() for _ in range(args.providers)]
+    providers = [{"name": f"Fake {i}", "url": server.url} for i, server in enumerate(servers)]
+    os.environ.update(make_environment(root, providers))
+    os.chdir(root)
+    # config is read at import time, so the app is imported only once the fixtures are in place
+    import app
+
+    results = {}
+    for name, fn, iterations, concurrency in benchmarks(app, args):
+        if args.only and args.only not in name:
+            continue
+        results[name] = measure(fn, iterations, concurrency)
+        r = results[name]
+        print(f"{name:<28} {r['throughput']:>9.1f}/s  p50 {r['p50_ms']:>8.3f} ms  p99 {r['p99_ms']:>8.3f} ms")
+
+    for server in servers:
+        server.stop()
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "settings": {"iterations": args.iterations, "concurrency": args.concurrency,
+                     "providers": args.providers, "delay": args.delay},
+        "results": results,
+    }
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save}.json")
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Saved baseline {path}")
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
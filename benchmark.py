@@ -0,0 +1,236 @@
+"""Replay a list of domains against every DoH provider and rank them.
+
+Each (provider, domain) pair is queried twice in a row: the first answer may
+have to be fetched by the provider (cold cache), the second should come from
+its cache (warm). Queries are paced to ``rate`` per second across at most
+``concurrency`` workers.
+
+Usage: python benchmark.py [--domains FILE] [--rate N] [--concurrency N]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dnslib import RCODE
+
+import config
+import doh
+import lookup
+
+# added to a provider's score (ms) at a 100% error rate
+ERROR_PENALTY = 1000
+
+
+def load_domains(path):
+    """Domains from a text file, one per line; blank lines and # comments are skipped."""
+    with open(path, "r") as file:
+        lines = (line.split("#", 1)[0].strip() for line in file)
+        return list(dict.fromkeys(line for line in lines if line))
+
+
+def history_domains(conn, limit=200):
+    """The most recently looked-up distinct domains from dns_lookup_history (none on a fresh database)."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dns_lookup_history'").fetchone():
+        return []
+    rows = conn.execute(
+        "SELECT domain FROM dns_lookup_history GROUP BY domain ORDER BY MAX(ts) DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+class RateLimiter:
+    """Hand out evenly spaced start times so callers run at most ``rate`` operations per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def summarize(latencies):
+    """count, avg, p50, p90 and p99 of a list of latencies in ms."""
+    if not latencies:
+        return {"count": 0, "avg": None, "p50": None, "p90": None, "p99": None}
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+    return {"count": len(ordered), "avg": round(sum(ordered) / len(ordered), 2),
+            "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99)}
+
+
+def _timed_query(pool, url, domain, method, timeout):
+    start = time.perf_counter()
+    try:
+        reply = lookup.query_doh(pool, url, domain, "A", method=method, timeout=timeout)
+        if reply.header.rcode not in (RCODE.NOERROR, RCODE.NXDOMAIN):
+            raise ValueError(f"rcode {RCODE.get(reply.header.rcode)}")
+    except Exception:
+        return None
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def run(pool, providers, domains, rate=20, concurrency=8, timeout=3, method="GET", progress=None):
+    """Benchmark every provider on every domain and return a ranked report.
+
+    ``providers`` is a list of {"name", "url"} dicts. ``progress(done, total)``
+    is called after each pair. Providers are ranked by score: the median of
+    all successful cold and warm latencies plus the error rate times
+    ERROR_PENALTY ms.
+    """
+    limiter = RateLimiter(rate)
+    samples = {p["url"]: {"cold": [], "warm": [], "errors": 0} for p in providers}
+    lock = threading.Lock()
+    total = len(providers) * len(domains)
+    done = [0]
+
+    def measure(url, domain):
+        results = []
+        for _ in ("cold", "warm"):
+            limiter.wait()
+            results.append(_timed_query(pool, url, domain, method, timeout))
+        with lock:
+            for kind, latency in zip(("cold", "warm"), results):
+                if latency is None:
+                    samples[url]["errors"] += 1
+                else:
+                    samples[url][kind].append(latency)
+            done[0] += 1
+            count = done[0]
+        if progress:
+            progress(count, total)
+
+    start = time.monotonic()
+    # interleave providers so rate limiting and transient network conditions affect them equally
+    pairs = [(p["url"], domain) for domain in domains for p in providers]
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        list(executor.map(lambda pair: measure(*pair), pairs))
+    duration = round(time.monotonic() - start, 2)
+
+    ranking = []
+    for provider in providers:
+        data = samples[provider["url"]]
+        queries = 2 * len(domains)
+        error_rate = data["errors"] / queries if queries else 0.0
+        overall = summarize(data["cold"] + data["warm"])
+        score = None if overall["p50"] is None else round(overall["p50"] + error_rate * ERROR_PENALTY, 2)
+        ranking.append({
+            "provider": provider["url"], "name": provider["name"], "score": score,
+            "queries": queries, "errors": data["errors"], "error_rate": round(error_rate, 4),
+            "cold": summarize(data["cold"]), "warm": summarize(data["warm"]),
+        })
+    ranking.sort(key=lambda r: (r["score"] is None, r["score"] or 0))
+    for rank, row in enumerate(ranking, 1):
+        row["rank"] = rank
+    return {"ts": int(time.time()), "domains": len(domains), "rate": rate, "concurrency": concurrency,
+            "duration": duration, "results": ranking}
+
+
+def create_schema(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS benchmark_runs (id INTEGER PRIMARY KEY, ts INTEGER, source TEXT,"
+        " domains INTEGER, rate REAL, concurrency INTEGER, duration REAL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS benchmark_results (id INTEGER PRIMARY KEY, run_id INTEGER, rank INTEGER,"
+        " provider TEXT, name TEXT, score REAL, queries INTEGER, errors INTEGER, error_rate REAL,"
+        " cold_avg REAL, cold_p50 REAL, cold_p90 REAL, cold_p99 REAL,"
+        " warm_avg REAL, warm_p50 REAL, warm_p90 REAL, warm_p99 REAL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_benchmark_results_run ON benchmark_results(run_id)")
+
+
+def save_report(conn, report, source):
+    """Store a report from run(); returns the run id."""
+    run_id = conn.execute(
+        "INSERT INTO benchmark_runs (ts, source, domains, rate, concurrency, duration) VALUES (?, ?, ?, ?, ?, ?)",
+        (report["ts"], source, report["domains"], report["rate"], report["concurrency"], report["duration"]),
+    ).lastrowid
+    conn.executemany(
+        "INSERT INTO benchmark_results (run_id, rank, provider, name, score, queries, errors, error_rate,"
+        " cold_avg, cold_p50, cold_p90, cold_p99, warm_avg, warm_p50, warm_p90, warm_p99)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (run_id, r["rank"], r["provider"], r["name"], r["score"], r["queries"], r["errors"], r["error_rate"],
+             r["cold"]["avg"], r["cold"]["p50"], r["cold"]["p90"], r["cold"]["p99"],
+             r["warm"]["avg"], r["warm"]["p50"], r["warm"]["p90"], r["warm"]["p99"])
+            for r in report["results"]
+        ],
+    )
+    return run_id
+
+
+def load_report(conn, run_id=None):
+    """A stored report (the latest one by default), or None."""
+    if run_id is None:
+        row = conn.execute("SELECT MAX(id) FROM benchmark_runs").fetchone()
+        run_id = row[0] if row else None
+    run = conn.execute(
+        "SELECT id, ts, source, domains, rate, concurrency, duration FROM benchmark_runs WHERE id = ?", (run_id,)
+    ).fetchone()
+    if run is None:
+        return None
+    report = dict(zip(("id", "ts", "source", "domains", "rate", "concurrency", "duration"), run))
+    columns = ("rank", "provider", "name", "score", "queries", "errors", "error_rate",
+               "cold_avg", "cold_p50", "cold_p90", "cold_p99", "warm_avg", "warm_p50", "warm_p90", "warm_p99")
+    rows = conn.execute(
+        f"SELECT {', '.join(columns)} FROM benchmark_results WHERE run_id = ? ORDER BY rank", (run_id,)
+    ).fetchall()
+    report["results"] = [dict(zip(columns, row)) for row in rows]
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare DoH providers on a list of domains.")
+    parser.add_argument("--domains", help="file with one domain per line (default: domains from lookup history)")
+    parser.add_argument("--providers", default="doh_providers.json", help="providers file")
+    parser.add_argument("--db", default=config.DB_PATH, help="SQLite database for the report")
+    parser.add_argument("--rate", type=float, default=config.BENCHMARK_RATE, help="queries per second")
+    parser.add_argument("--concurrency", type=int, default=config.BENCHMARK_CONCURRENCY)
+    parser.add_argument("--limit", type=int, default=config.BENCHMARK_MAX_DOMAINS, help="max domains")
+    args = parser.parse_args(argv)
+
+    with open(args.providers, "r") as file:
+        providers = json.load(file)
+    conn = sqlite3.connect(args.db, timeout=30)
+    if args.domains:
+        domains, source = load_domains(args.domains)[:args.limit], os.path.basename(args.domains)
+    else:
+        domains, source = history_domains(conn, args.limit), "history"
+        if not domains:
+            parser.error("no lookup history, pass --domains")
+    if not domains:
+        parser.error("no domains to benchmark")
+
+    pool = doh.DohPool()
+    progress = lambda done, total: print(f"\r{done}/{total}", end="", flush=True)
+    try:
+        report = run(pool, providers, domains, rate=args.rate, concurrency=args.concurrency,
+                     timeout=config.DOH_PROBE_TIMEOUT, method=config.DOH_PROBE_METHOD, progress=progress)
+    finally:
+        pool.close()
+    print()
+    with conn:
+        create_schema(conn)
+        run_id = save_report(conn, report, source)
+    conn.close()
+    print(f"Run {run_id}: {len(domains)} domains x {len(providers)} providers in {report['duration']}s")
+    print(f"{'#':>2}  {'provider':<20} {'score':>8} {'cold p50':>9} {'warm p50':>9} {'errors':>7}")
+    for r in report["results"]:
+        print(f"{r['rank']:>2}  {r['name'][:20]:<20} {r['score'] if r['score'] is not None else '-':>8}"
+              f" {r['cold']['p50'] if r['cold']['p50'] is not None else '-':>9}"
+              f" {r['warm']['p50'] if r['warm']['p50'] is not None else '-':>9} {r['error_rate']:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Per-provider circuit breakers and latency-derived timeouts.
+
+A provider's breaker opens after ``threshold`` consecutive failed DoH
+checks. While it is open, probes are skipped and fail immediately. After
+``reset`` seconds one trial probe is let through (half-open): success closes
+the breaker, failure reopens it for twice as long, up to ``max_reset``.
+
+Timeouts come from each provider's recent successful latencies:
+``multiplier`` times their p95, clamped between ``floor`` and the configured
+timeout, once ``min_samples`` are known.
+"""
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _Health:
+    def __init__(self, window):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = None
+        self.open_for = 0.0
+        self.trial_started = None
+        self.skipped = 0
+        self.last_error = None
+        self.latencies = {}  # kind -> deque of recent successful latencies (ms)
+        self.window = window
+
+
+class ProviderHealth:
+    """Breaker state and latency windows per provider key."""
+
+    def __init__(self, threshold=3, reset=30, max_reset=600, multiplier=3.0, floor=0.25, min_samples=5,
+                 window=50, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset = reset
+        self.max_reset = max_reset
+        self.multiplier = multiplier
+        self.floor = floor
+        self.min_samples = min_samples
+        self.window = window
+        self.clock = clock
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        health = self._providers.get(key)
+        if health is None:
+            health = self._providers[key] = _Health(self.window)
+        return health
+
+    def allow(self, key):
+        """True if a probe of key may run now; an open breaker past its reset time lets one trial through."""
+        with self._lock:
+            health = self._get(key)
+            now = self.clock()
+            if health.state == CLOSED:
+                return True
+            if health.state == OPEN and now - health.opened >= health.open_for:
+                health.state = HALF_OPEN
+                health.trial_started = now
+                return True
+            # a trial that never reported back does not block the provider forever
+            if health.state == HALF_OPEN and now - health.trial_started >= health.open_for:
+                health.trial_started = now
+                return True
+            health.skipped += 1
+            return False
+
+    def closed(self, key):
+        """True unless key's breaker is open or waiting on a trial probe; changes no state."""
+        with self._lock:
+            health = self._providers.get(key)
+            return health is None or health.state == CLOSED
+
+    def record(self, key, ok, error=None):
+        """Feed one DoH check outcome into the breaker; returns the new state."""
+        with self._lock:
+            health = self._get(key)
+            if ok:
+                health.state, health.failures, health.open_for = CLOSED, 0, 0.0
+                return health.state
+            health.failures += 1
+            health.last_error = error
+            if health.state == HALF_OPEN:
+                health.open_for = min(health.open_for * 2, self.max_reset)
+            elif health.state == CLOSED and health.failures >= self.threshold:
+                health.open_for = self.reset
+            else:
+                return health.state
+            health.state = OPEN
+            health.opened = self.clock()
+            return health.state
+
+    def observe(self, key, kind, latency_ms):
+        """Add a successful latency of kind ("ping", "doh") to key's window."""
+        if latency_ms is None:
+            return
+        with self._lock:
+            health = self._get(key)
+            health.latencies.setdefault(kind, deque(maxlen=self.window)).append(latency_ms)
+
+    def timeout(self, key, kind, default):
+        """Seconds to wait for a kind of probe of key: multiplier x p95 of recent latencies, within [floor, default]."""
+        with self._lock:
+            health = self._providers.get(key)
+            samples = sorted(health.latencies.get(kind, ())) if health else []
+        if len(samples) < self.min_samples:
+            return default
+        p95 = samples[min(int(0.95 * len(samples)), len(samples) - 1)]
+        return round(min(max(self.multiplier * p95 / 1000, self.floor), default), 3)
+
+    def state(self, defaults=None):
+        """Every provider's breaker state, and its current timeouts for the kinds in defaults ({kind: seconds})."""
+        with self._lock:
+            now = self.clock()
+            items = list(self._providers.items())
+        result = {}
+        for key, health in items:
+            entry = {"state": health.state, "failures": health.failures, "skipped": health.skipped,
+                     "last_error": health.last_error, "retry_in": None}
+            if health.state == OPEN:
+                entry["retry_in"] = round(max(health.opened + health.open_for - now, 0), 1)
+            for kind, default in (defaults or {}).items():
+                entry[f"{kind}_timeout"] = self.timeout(key, kind, default)
+            result[key] = entry
+        return result
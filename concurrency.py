@@ -0,0 +1,56 @@
+"""Keep blocking work off the eventlet hub.
+
+The app is served by eventlet without monkey-patching, so every request
+handler and background task is a greenthread on one OS thread. A blocking
+socket read, SQLite wait or subprocess there stalls all of them. ``offload``
+runs such a call on eventlet's pool of real OS threads (tpool) and parks only
+the calling greenthread until it returns.
+
+Offloading is off until ``enable`` is called by the server entry point.
+Calls made outside the hub's thread (worker pools, tests, scripts) always
+run directly. The caller's context variables are copied into the worker
+thread, so Flask's ``request`` and ``g`` still work there. Offloaded code
+must not emit Socket.IO events or spawn greenthreads.
+"""
+import contextvars
+import threading
+from functools import wraps
+
+try:
+    from eventlet import tpool
+    EVENTLET_AVAILABLE = True
+except ImportError:
+    EVENTLET_AVAILABLE = False
+
+_enabled = False
+
+
+def enable(threads=20):
+    """Start offloading blocking calls made on the hub's thread to ``threads`` worker threads (0 keeps it off)."""
+    global _enabled
+    if not EVENTLET_AVAILABLE or threads <= 0:
+        return False
+    tpool.set_num_threads(threads)
+    _enabled = True
+    return True
+
+
+def enabled():
+    return _enabled
+
+
+def offload(fn, *args, **kwargs):
+    """Call fn(*args, **kwargs) without blocking the event loop and return its result (or raise its error)."""
+    if not _enabled or threading.current_thread() is not threading.main_thread():
+        return fn(*args, **kwargs)
+    return tpool.execute(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def offloaded(fn):
+    """Decorator: every call of fn goes through ``offload``."""
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return offload(fn, *args, **kwargs)
+
+    return wrapper
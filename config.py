@@ -11,3 +11,67 @@ DB_PATH = os.getenv("DB_PATH", "doh_history.db")
 SERVICE_FILE = os.getenv("SERVICE_FILE", "/etc/systemd/system/cloudflared.service")
 RETENTION_HOURS = int(os.getenv("RETENTION_HOURS", "6"))
 TEST_INTERVAL = int(os.getenv("TEST_INTERVAL", "5"))
+PROBE_CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", "8"))
+PROBE_DEADLINE = int(os.getenv("PROBE_DEADLINE", "15"))
+DOH_PROBE_METHOD = os.getenv("DOH_PROBE_METHOD", "GET").upper()
+DOH_PROBE_DOMAIN = os.getenv("DOH_PROBE_DOMAIN", "example.com")
+DOH_PROBE_TIMEOUT = float(os.getenv("DOH_PROBE_TIMEOUT", "3"))
+DOH_POOL_IDLE_TIMEOUT = int(os.getenv("DOH_POOL_IDLE_TIMEOUT", "120"))
+DOH_POOL_MAX_CONNECTIONS = int(os.getenv("DOH_POOL_MAX_CONNECTIONS", "4"))
+PING_METHOD = os.getenv("PING_METHOD", "tcp").lower()
+PING_SAMPLES = int(os.getenv("PING_SAMPLES", "3"))
+PING_TIMEOUT = float(os.getenv("PING_TIMEOUT", "2"))
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "200"))
+DB_QUEUE_SIZE = int(os.getenv("DB_QUEUE_SIZE", "10000"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "300"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+ROLLUP_INTERVAL = int(os.getenv("ROLLUP_INTERVAL", "60"))
+ROLLUP_RETENTION_1M_HOURS = int(os.getenv("ROLLUP_RETENTION_1M_HOURS", "48"))
+ROLLUP_RETENTION_1H_DAYS = int(os.getenv("ROLLUP_RETENTION_1H_DAYS", "90"))
+ROLLUP_RETENTION_1D_DAYS = int(os.getenv("ROLLUP_RETENTION_1D_DAYS", "730"))
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "500"))
+LOCAL_RESOLVER = os.getenv("LOCAL_RESOLVER", "127.0.0.1")
+LOCAL_RESOLVER_PORT = int(os.getenv("LOCAL_RESOLVER_PORT", "53"))
+SWITCH_READY_TIMEOUT = int(os.getenv("SWITCH_READY_TIMEOUT", "20"))
+FORWARDER_ENABLED = int(os.getenv("FORWARDER_ENABLED", "0"))
+FORWARDER_HOST = os.getenv("FORWARDER_HOST", "127.0.0.1")
+FORWARDER_PORT = int(os.getenv("FORWARDER_PORT", "53"))
+FORWARDER_CACHE_SIZE = int(os.getenv("FORWARDER_CACHE_SIZE", "10000"))
+FORWARDER_MAX_TTL = int(os.getenv("FORWARDER_MAX_TTL", "86400"))
+FORWARDER_NEGATIVE_TTL = int(os.getenv("FORWARDER_NEGATIVE_TTL", "300"))
+AUTOSELECT_ENABLED = int(os.getenv("AUTOSELECT_ENABLED", "0"))
+AUTOSELECT_INTERVAL = int(os.getenv("AUTOSELECT_INTERVAL", "60"))
+AUTOSELECT_ALPHA = float(os.getenv("AUTOSELECT_ALPHA", "0.3"))
+AUTOSELECT_MARGIN = float(os.getenv("AUTOSELECT_MARGIN", "0.2"))
+AUTOSELECT_SUSTAIN = int(os.getenv("AUTOSELECT_SUSTAIN", "180"))
+AUTOSELECT_DWELL = int(os.getenv("AUTOSELECT_DWELL", "900"))
+AUTOSELECT_FAILURE_PENALTY = float(os.getenv("AUTOSELECT_FAILURE_PENALTY", "1000"))
+AUTOSELECT_RETENTION_DAYS = int(os.getenv("AUTOSELECT_RETENTION_DAYS", "30"))
+HEDGE_ENABLED = int(os.getenv("HEDGE_ENABLED", "0"))
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+HEDGE_DEFAULT_DELAY_MS = float(os.getenv("HEDGE_DEFAULT_DELAY_MS", "100"))
+LOOKUP_CONCURRENCY = int(os.getenv("LOOKUP_CONCURRENCY", "16"))
+LOOKUP_MAX_QUERIES = int(os.getenv("LOOKUP_MAX_QUERIES", "500"))
+BENCHMARK_RATE = float(os.getenv("BENCHMARK_RATE", "20"))
+BENCHMARK_CONCURRENCY = int(os.getenv("BENCHMARK_CONCURRENCY", "8"))
+BENCHMARK_MAX_DOMAINS = int(os.getenv("BENCHMARK_MAX_DOMAINS", "200"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+STREAM_HISTORY_SIZE = int(os.getenv("STREAM_HISTORY_SIZE", "100"))
+STREAM_MAX_LAG = int(os.getenv("STREAM_MAX_LAG", "2"))
+STREAM_COMPRESS_THRESHOLD = int(os.getenv("STREAM_COMPRESS_THRESHOLD", "1024"))
+HISTORY_BUFFER_SIZE = int(os.getenv("HISTORY_BUFFER_SIZE", "4096"))
+SYSTEM_ROOT = os.getenv("SYSTEM_ROOT", "/")
+PROBE_SCHEDULER_ENABLED = int(os.getenv("PROBE_SCHEDULER_ENABLED", "1"))
+PROBE_SCHEDULER_INTERVAL = float(os.getenv("PROBE_SCHEDULER_INTERVAL", "60"))
+PROBE_SCHEDULER_JITTER = float(os.getenv("PROBE_SCHEDULER_JITTER", "0.2"))
+PROBE_SCHEDULER_RATE = float(os.getenv("PROBE_SCHEDULER_RATE", "2"))
+PROBE_SCHEDULER_CONCURRENCY = int(os.getenv("PROBE_SCHEDULER_CONCURRENCY", "4"))
+PROBE_SCHEDULER_MAX_BACKOFF = int(os.getenv("PROBE_SCHEDULER_MAX_BACKOFF", "16"))
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "3"))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))
+BREAKER_MAX_RESET = float(os.getenv("BREAKER_MAX_RESET", "600"))
+ADAPTIVE_TIMEOUT_MULTIPLIER = float(os.getenv("ADAPTIVE_TIMEOUT_MULTIPLIER", "3"))
+ADAPTIVE_TIMEOUT_MIN = float(os.getenv("ADAPTIVE_TIMEOUT_MIN", "0.25"))
+PORT = int(os.getenv("PORT", "5003"))
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "20"))
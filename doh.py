@@ -0,0 +1,246 @@
+"""DNS-over-HTTPS (RFC 8484) probing using the binary dns-message format."""
+import base64
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+import httpcore
+from dnslib import DNSRecord, QTYPE, RCODE
+
+try:
+    import h2  # noqa: F401  (HTTP/2 support for httpcore)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DNS_MESSAGE = "application/dns-message"
+
+
+def build_query(name="example.com", qtype="A"):
+    """Build a wire-format DNS query; RFC 8484 recommends an ID of 0 for caching."""
+    query = DNSRecord.question(name, qtype)
+    query.header.id = 0
+    return bytes(query.pack())
+
+
+def encode_query(wire):
+    """Encode a wire-format query for the ?dns= GET parameter (base64url, no padding)."""
+    return base64.urlsafe_b64encode(wire).rstrip(b"=").decode("ascii")
+
+
+def validate_response(wire, name, qtype):
+    """Parse a DoH answer and check it answers name/qtype.
+
+    Returns the list of answer records of the requested type and raises
+    ValueError when the message is malformed, an error or has no answers.
+    """
+    try:
+        reply = DNSRecord.parse(wire)
+    except Exception as e:
+        raise ValueError(f"malformed DNS message: {e}")
+    if not reply.header.qr:
+        raise ValueError("message is not a response")
+    if reply.header.rcode != RCODE.NOERROR:
+        raise ValueError(f"rcode {RCODE.get(reply.header.rcode)}")
+    qtype_num = getattr(QTYPE, qtype)
+    question = reply.q
+    if str(question.qname).rstrip(".").lower() != name.rstrip(".").lower() or question.qtype != qtype_num:
+        raise ValueError("question section does not match query")
+    answers = [rr for rr in reply.rr if rr.rtype == qtype_num]
+    if not answers:
+        raise ValueError("no answer records")
+    return answers
+
+
+def split_url(url):
+    """Split a DoH URL into its origin (scheme://host:port) and request path."""
+    parsed = urlparse(url)
+    origin = f"{parsed.scheme or 'https'}://{parsed.hostname}:{parsed.port or 443}"
+    return origin, parsed.path or "/dns-query"
+
+
+def _ms(start, end):
+    return round((end - start) * 1000, 2)
+
+
+class _TimedBackend(httpcore.SyncBackend):
+    """Network backend that resolves hostnames itself so DNS time is measured on its own."""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        start = time.perf_counter()
+        addresses = [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+        self.local.dns_ms = _ms(start, time.perf_counter())
+        # like socket.create_connection: try each address in turn until one connects
+        error = None
+        for address in dict.fromkeys(addresses):
+            try:
+                return super().connect_tcp(address, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        raise error
+
+
+class LatencyStat:
+    """Running count/min/max/mean of a latency series."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def as_dict(self):
+        avg = round(self.total / self.count, 2) if self.count else None
+        return {"count": self.count, "min": self.min, "max": self.max, "avg": avg}
+
+
+class DohPool:
+    """Shared keep-alive connection pools for all DoH traffic, one per provider origin.
+
+    Connections negotiate HTTP/2 when the h2 package is installed so concurrent
+    queries to a provider are multiplexed over one connection. Pools left idle
+    for longer than ``idle_timeout`` seconds are closed by ``evict_idle``.
+    Latency is tracked separately for requests that had to open a connection
+    (cold) and requests that reused one (warm).
+    """
+
+    def __init__(self, idle_timeout=120, max_connections=4, http2=HTTP2_AVAILABLE):
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._backend = _TimedBackend()
+        self._pools = {}  # origin -> [httpcore.ConnectionPool, last used monotonic time]
+        self._stats = {}  # url -> {"cold": LatencyStat, "warm": LatencyStat}
+        self._lock = threading.Lock()
+
+    def _pool(self, origin):
+        with self._lock:
+            entry = self._pools.get(origin)
+            if entry is None:
+                pool = httpcore.ConnectionPool(
+                    max_connections=self.max_connections,
+                    keepalive_expiry=self.idle_timeout,
+                    http2=self.http2,
+                    network_backend=self._backend,
+                )
+                entry = self._pools[origin] = [pool, time.monotonic()]
+            entry[1] = time.monotonic()
+            return entry[0]
+
+    def query(self, url, wire, method="GET", timeout=3):
+        """Send a wire-format DNS query to url and time the exchange.
+
+        Returns a dict with the HTTP ``status``, ``content_type`` and ``body``,
+        whether a new connection was opened (``cold``) and the phase timings
+        ``dns_ms``, ``connect_ms``, ``tls_ms`` (cold requests only),
+        ``ttfb_ms`` and ``total_ms``. Network errors propagate as httpcore
+        exceptions.
+        """
+        origin, path = split_url(url)
+        if method == "GET":
+            target = f"{origin}{path}?dns={encode_query(wire)}"
+            headers = [("Accept", DNS_MESSAGE)]
+            content = None
+        else:
+            target = f"{origin}{path}"
+            headers = [("Accept", DNS_MESSAGE), ("Content-Type", DNS_MESSAGE)]
+            content = wire
+        marks = {}
+
+        def trace(event, info):
+            marks[event] = time.perf_counter()
+
+        self._backend.local.dns_ms = None
+        pool = self._pool(origin)
+        start = time.perf_counter()
+        response = pool.request(
+            method, target, headers=headers, content=content,
+            extensions={"trace": trace, "timeout": {"connect": timeout, "read": timeout, "write": timeout, "pool": timeout}},
+        )
+        end = time.perf_counter()
+        result = {
+            "status": response.status,
+            "content_type": dict((k.decode().lower(), v.decode()) for k, v in response.headers).get("content-type", ""),
+            "body": response.content,
+            "cold": "connection.connect_tcp.complete" in marks,
+            "dns_ms": None, "connect_ms": None, "tls_ms": None, "ttfb_ms": None,
+            "total_ms": _ms(start, end),
+        }
+        if result["cold"]:
+            dns_ms = self._backend.local.dns_ms or 0.0
+            result["dns_ms"] = dns_ms
+            result["connect_ms"] = round(_ms(marks["connection.connect_tcp.started"], marks["connection.connect_tcp.complete"]) - dns_ms, 2)
+            if "connection.start_tls.complete" in marks:
+                result["tls_ms"] = _ms(marks["connection.start_tls.started"], marks["connection.start_tls.complete"])
+        sent = next((t for e, t in marks.items() if e.endswith("send_request_headers.started")), None)
+        received = next((t for e, t in marks.items() if e.endswith("receive_response_headers.complete")), None)
+        if sent is not None and received is not None:
+            result["ttfb_ms"] = _ms(sent, received)
+        with self._lock:
+            stats = self._stats.setdefault(url, {"cold": LatencyStat(), "warm": LatencyStat()})
+            stats["cold" if result["cold"] else "warm"].add(result["total_ms"])
+        return result
+
+    def evict_idle(self):
+        """Close provider pools that have not been used within idle_timeout."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            idle = [origin for origin, (_, last_used) in self._pools.items() if last_used < cutoff]
+            pools = [self._pools.pop(origin)[0] for origin in idle]
+        for pool in pools:
+            pool.close()
+        return idle
+
+    def close(self):
+        """Close every provider pool."""
+        with self._lock:
+            pools = [entry[0] for entry in self._pools.values()]
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def stats(self):
+        """Cold-start and warm-connection latency per provider URL."""
+        with self._lock:
+            per_url = {url: {kind: stat.as_dict() for kind, stat in stats.items()}
+                       for url, stats in self._stats.items()}
+            open_pools = {origin: len(entry[0].connections) for origin, entry in self._pools.items()}
+        return {"http2": self.http2, "providers": per_url, "open_connections": open_pools}
+
+
+def probe(pool, url, method="GET", name="example.com", qtype="A", timeout=3):
+    """Send one RFC 8484 query through the pool and time each phase.
+
+    Returns a dict with ``ok``, ``cold``, the per-phase timings ``dns_ms``,
+    ``connect_ms``, ``tls_ms``, ``ttfb_ms`` and ``total_ms`` (None for phases
+    that did not happen, e.g. connect/TLS on a warm connection), the textual
+    ``answers`` and an ``error`` message.
+    """
+    result = {
+        "ok": False, "method": method, "cold": False, "dns_ms": None, "connect_ms": None,
+        "tls_ms": None, "ttfb_ms": None, "total_ms": None, "answers": [], "error": None,
+    }
+    try:
+        response = pool.query(url, build_query(name, qtype), method=method, timeout=timeout)
+        for key in ("cold", "dns_ms", "connect_ms", "tls_ms", "ttfb_ms", "total_ms"):
+            result[key] = response[key]
+        if response["status"] != 200:
+            raise ValueError(f"HTTP {response['status']}")
+        if not response["content_type"].startswith(DNS_MESSAGE):
+            raise ValueError(f"unexpected content type {response['content_type']!r}")
+        answers = validate_response(response["body"], name, qtype)
+        result["answers"] = [str(rr.rdata) for rr in answers]
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = str(e) or e.__class__.__name__
+    return result
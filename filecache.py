@@ -0,0 +1,167 @@
+"""Small helpers for files that are read often and change rarely."""
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+
+
+class CachedFile:
+    """Parse a file once and re-parse it only when its mtime, size or inode changes.
+
+    ``get`` costs one stat() while the file is unchanged. A missing file is
+    cached as ``parse(None)``. Once a FileWatcher watches it, ``get`` skips
+    the stat and trusts the cached value until the watcher invalidates it.
+    """
+
+    def __init__(self, path, parse):
+        self.path = path
+        self.parse = parse
+        self.watched = False
+        self._signature = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def get(self):
+        if self.watched and self._signature is not None:
+            return self._value
+        signature = self._stat()
+        with self._lock:
+            if signature != self._signature or self._signature is None:
+                if signature is None:
+                    value = self.parse(None)
+                else:
+                    with open(self.path, "r") as file:
+                        value = self.parse(file.read())
+                self._value = value
+                self._signature = signature
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+
+
+# inotify(7) event bits
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+_EVENT = struct.Struct("iIII")
+
+
+class FileWatcher:
+    """Invalidate CachedFiles when inotify reports a change to them.
+
+    The parent directory of each file is watched (and that of its symlink
+    target), so replacing the file by rename is seen too. A daemon thread
+    blocks on the inotify descriptor. Where inotify is unavailable,
+    ``watch`` returns False and the file keeps its stat() check.
+    """
+
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self):
+        self._fd = None
+        self._targets = {}  # (wd, name) -> [CachedFile]
+        self._lock = threading.Lock()
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd >= 0:
+            self._fd = fd
+            threading.Thread(target=self._run, name="file-watcher", daemon=True).start()
+
+    @property
+    def available(self):
+        return self._fd is not None
+
+    def watch(self, cached):
+        """Start invalidating cached on changes; returns False if it cannot be watched."""
+        if self._fd is None:
+            return False
+        paths = {os.path.abspath(cached.path), os.path.realpath(cached.path)}
+        for path in paths:
+            wd = self._libc.inotify_add_watch(self._fd, os.path.dirname(path).encode(), self.MASK)
+            if wd < 0:
+                return False
+            with self._lock:
+                self._targets.setdefault((wd, os.path.basename(path)), []).append(cached)
+        cached.invalidate()
+        cached.watched = True
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except OSError:
+                return
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + length].split(b"\0", 1)[0].decode()
+                offset += _EVENT.size + length
+                with self._lock:
+                    if mask & IN_Q_OVERFLOW:
+                        targets = [c for cached in self._targets.values() for c in cached]
+                    else:
+                        targets = list(self._targets.get((wd, name), ()))
+                for cached in targets:
+                    cached.invalidate()
+
+
+def _create_temp(directory, name, mode):
+    """Create a new, uniquely named file next to name; returns (fd, path).
+
+    Unlike mkstemp (always 0600) it is created with mode, so the kernel
+    applies the process umask as for a plain open() without the umask being
+    changed.
+    """
+    while True:
+        tmp_path = os.path.join(directory, f".{name}.{os.urandom(4).hex()}")
+        try:
+            return os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode), tmp_path
+        except FileExistsError:
+            continue
+
+
+def atomic_write(path, data):
+    """Write data to path via a temp file in the same directory and an atomic rename.
+
+    An existing file keeps its mode; a new one gets the umask default, as
+    with a plain open().
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = None
+    # never more open than the file it replaces, even before the chmod
+    fd, tmp_path = _create_temp(directory, os.path.basename(path), 0o666 if mode is None else mode)
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,236 @@
+"""In-process DNS listener (UDP and TCP) that forwards queries to the selected provider over DoH."""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from dnslib import DNSRecord, QTYPE, RCODE
+from dnslib.server import DNSHandler, DNSServer
+
+from doh import DNS_MESSAGE, LatencyStat
+
+logger = logging.getLogger(__name__)
+
+# classic DNS limit for UDP answers to clients that do not advertise EDNS
+DEFAULT_UDP_SIZE = 512
+
+
+def _ttl_records(reply):
+    """Every record whose TTL counts towards caching (the EDNS OPT pseudo-record excluded)."""
+    return [rr for rr in reply.rr + reply.auth + reply.ar if rr.rtype != QTYPE.OPT]
+
+
+def cache_ttl(reply, min_ttl, max_ttl, negative_ttl):
+    """Seconds a reply may be cached, or 0 if it must not be.
+
+    Positive answers live for their smallest record TTL. NXDOMAIN and NODATA
+    answers are cached per RFC 2308 for the SOA's TTL or minimum (whichever is
+    lower), capped at negative_ttl. Other errors are never cached.
+    """
+    rcode = reply.header.rcode
+    if rcode == RCODE.NOERROR and reply.rr:
+        return max(min_ttl, min(max_ttl, min(rr.ttl for rr in _ttl_records(reply))))
+    if rcode in (RCODE.NOERROR, RCODE.NXDOMAIN):
+        soa = [rr for rr in reply.auth if rr.rtype == QTYPE.SOA]
+        if soa:
+            return min(negative_ttl, soa[0].ttl, soa[0].rdata.times[-1])
+        return negative_ttl
+    return 0
+
+
+class ResponseCache:
+    """LRU cache of wire-format replies keyed by (name, type, class), honoring TTLs."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (wire, stored monotonic time, ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (wire, age in seconds) for a live entry, or None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            wire, stored, ttl = entry
+            if now - stored >= ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return wire, int(now - stored)
+
+    def put(self, key, wire, ttl):
+        with self._lock:
+            self._entries[key] = (wire, time.monotonic(), ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Pending:
+    """An upstream query other identical queries can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.wire = None
+
+
+class _QuietLogger:
+    """dnslib server logger that only reports errors, through the logging module."""
+
+    def log_error(self, handler, e):
+        logger.warning(f"DNS request from {handler.client_address[0]} failed: {e}")
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+class Forwarder:
+    """Answer DNS queries on host:port from a TTL cache or through the DoH pool.
+
+    Identical queries that arrive while one is already in flight wait for its
+    answer instead of going upstream again. The upstream URL can be swapped at
+    any time with ``set_upstream``; the cache survives the swap. With a
+    ``hedger`` (see hedge.py), slow upstream answers are hedged to the next
+    provider. Upstream failures are answered with SERVFAIL.
+    """
+
+    def __init__(self, pool, upstream, host="127.0.0.1", port=53, method="POST", timeout=3,
+                 cache_size=10000, min_ttl=0, max_ttl=86400, negative_ttl=300, hedger=None):
+        self.pool = pool
+        self.hedger = hedger
+        self._upstream = upstream
+        self.host = host
+        self.port = port
+        self.method = method
+        self.timeout = timeout
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.cache = ResponseCache(cache_size)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ("queries", "hits", "negative_hits", "misses", "deduplicated", "upstream_errors"), 0)
+        self._latency = {}  # upstream url -> LatencyStat
+        self._servers = []
+
+    @property
+    def upstream(self):
+        return self._upstream
+
+    def set_upstream(self, url):
+        """Send all further cache misses to url; queries already in flight finish on the old one."""
+        self._upstream = url
+
+    @property
+    def running(self):
+        return bool(self._servers) and all(server.isAlive() for server in self._servers)
+
+    def start(self):
+        """Start the UDP and TCP listeners in background threads."""
+        for tcp in (False, True):
+            server = DNSServer(self, address=self.host, port=self.port, tcp=tcp, logger=_QuietLogger(), handler=DNSHandler)
+            server.start_thread()
+            self._servers.append(server)
+        logger.info(f"DNS forwarder listening on {self.host}:{self.port}")
+
+    def stop(self):
+        for server in self._servers:
+            server.stop()
+            server.server.server_close()
+        self._servers = []
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def resolve(self, request, handler=None):
+        """dnslib resolver entry point: return the reply DNSRecord for request."""
+        if handler is not None:
+            edns = next((rr for rr in request.ar if rr.rtype == QTYPE.OPT), None)
+            handler.udplen = max(edns.rclass, DEFAULT_UDP_SIZE) if edns else DEFAULT_UDP_SIZE
+        self._count("queries")
+        question = request.q
+        key = (str(question.qname).lower(), question.qtype, question.qclass)
+        cached = self.cache.get(key)
+        if cached is not None:
+            wire, age = cached
+            reply = DNSRecord.parse(wire)
+            self._count("hits" if reply.rr else "negative_hits")
+            for rr in _ttl_records(reply):
+                rr.ttl = max(rr.ttl - age, 0)
+        else:
+            reply = DNSRecord.parse(self._forward(key, request))
+        # the cache key is case-insensitive; echo the question as this client spelled it (0x20 randomization)
+        reply.header.id = request.header.id
+        reply.questions = list(request.questions)
+        return reply
+
+    def _forward(self, key, request):
+        with self._lock:
+            pending = self._inflight.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._inflight[key] = _Pending()
+        if not leader:
+            self._count("deduplicated")
+            if pending.done.wait(self.timeout) and pending.wire is not None:
+                return pending.wire
+            return self._servfail(request)
+        self._count("misses")
+        try:
+            pending.wire = self._query_upstream(key, request)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            pending.done.set()
+        return pending.wire if pending.wire is not None else self._servfail(request)
+
+    def _query_upstream(self, key, request):
+        upstream = self._upstream
+        query = DNSRecord.parse(request.pack())
+        query.header.id = 0
+        try:
+            if self.hedger is not None:
+                result = self.hedger.query(upstream, bytes(query.pack()))
+                response, answered_by = result["response"], result["url"]
+            else:
+                response = self.pool.query(upstream, bytes(query.pack()), method=self.method, timeout=self.timeout)
+                answered_by = upstream
+            if response["status"] != 200 or not response["content_type"].startswith(DNS_MESSAGE):
+                raise ValueError(f"HTTP {response['status']} ({response['content_type']})")
+            reply = DNSRecord.parse(response["body"])
+        except Exception as e:
+            self._count("upstream_errors")
+            logger.warning(f"Upstream {upstream} failed for {key[0]}: {e}")
+            return None
+        with self._lock:
+            self._latency.setdefault(answered_by, LatencyStat()).add(response["total_ms"])
+        ttl = cache_ttl(reply, self.min_ttl, self.max_ttl, self.negative_ttl)
+        if ttl > 0:
+            self.cache.put(key, response["body"], ttl)
+        return response["body"]
+
+    def _servfail(self, request):
+        reply = request.reply()
+        reply.header.rcode = RCODE.SERVFAIL
+        return reply.pack()
+
+    def stats(self):
+        """Query counters, cache hit ratio and upstream latency per provider URL."""
+        with self._lock:
+            counters = dict(self._counters)
+            latency = {url: stat.as_dict() for url, stat in self._latency.items()}
+        answered = counters["hits"] + counters["negative_hits"]
+        counters["hit_ratio"] = round(answered / counters["queries"], 4) if counters["queries"] else None
+        return dict(counters, upstream=self._upstream, cache_entries=len(self.cache), upstream_latency=latency,
+                    listen=f"{self.host}:{self.port}", running=bool(self._servers))
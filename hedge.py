@@ -0,0 +1,183 @@
+"""Hedged DoH queries: ask a second provider when the first one is slower than usual."""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dnslib import DNSRecord, RCODE
+
+from doh import DNS_MESSAGE
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def check_response(response):
+    """Raise ValueError unless a DohPool response is a usable DNS answer."""
+    if response["status"] != 200 or not response["content_type"].startswith(DNS_MESSAGE):
+        raise ValueError(f"HTTP {response['status']} ({response['content_type']})")
+    reply = DNSRecord.parse(response["body"])
+    if reply.header.rcode not in (RCODE.NOERROR, RCODE.NXDOMAIN):
+        raise ValueError(f"rcode {RCODE.get(reply.header.rcode)}")
+    return reply
+
+
+class _Budget:
+    """Token bucket: each primary query adds ``ratio`` tokens, each hedge spends one."""
+
+    def __init__(self, ratio, burst):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+    def earn(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self):
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Hedger:
+    """Send a query to the primary provider and hedge to the next one after its p90.
+
+    The hedge delay is the primary's observed p90 latency (``default_delay_ms``
+    until ``min_samples`` latencies are known). Hedges are limited per primary
+    provider to ``budget`` times its query count, so extra upstream load stays
+    at that fraction. A primary that fails outright is retried on the next
+    provider at once, without spending budget. ``rank(primary)`` returns the
+    other provider URLs in preference order.
+    """
+
+    def __init__(self, pool, rank, method="POST", timeout=3, budget=0.1, burst=5, default_delay_ms=100,
+                 min_delay_ms=5, min_samples=20, window=500, workers=16):
+        self.pool = pool
+        self.rank = rank
+        self.method = method
+        self.timeout = timeout
+        self.budget = budget
+        self.burst = burst
+        self.default_delay_ms = default_delay_ms
+        self.min_delay_ms = min_delay_ms
+        self.min_samples = min_samples
+        self._latency = {}  # url -> deque of recent latencies
+        self._budgets = {}
+        self._window = window
+        # what clients would have waited without hedging, and what they did wait
+        self._primary = deque(maxlen=window)
+        self._delivered = deque(maxlen=window)
+        self._counters = dict.fromkeys(("queries", "hedges", "hedge_wins", "failovers", "budget_denied", "failures"), 0)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hedge")
+
+    def delay(self, url):
+        """Seconds to wait for url before hedging."""
+        with self._lock:
+            samples = list(self._latency.get(url, ()))
+        p90 = _percentile(samples, 0.9) if len(samples) >= self.min_samples else self.default_delay_ms
+        return max(p90, self.min_delay_ms) / 1000
+
+    def _observe(self, url, elapsed_ms, primary):
+        with self._lock:
+            self._latency.setdefault(url, deque(maxlen=self._window)).append(elapsed_ms)
+            if primary:
+                self._primary.append(elapsed_ms)
+
+    def _send(self, url, wire, primary):
+        start = time.perf_counter()
+        try:
+            response = self.pool.query(url, wire, method=self.method, timeout=self.timeout)
+            check_response(response)
+        except Exception:
+            if primary:
+                # a failed primary would have cost the client the full timeout
+                with self._lock:
+                    self._primary.append(self.timeout * 1000)
+            raise
+        self._observe(url, (time.perf_counter() - start) * 1000, primary)
+        return response
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def query(self, primary, wire):
+        """Resolve wire via primary, hedging when it is slow.
+
+        Returns a dict with the DohPool ``response``, the ``url`` that
+        answered, whether a hedge was sent (``hedged``) and the ``latency_ms``
+        the caller waited. Raises the last error if no provider answered.
+        """
+        start = time.perf_counter()
+        self._count("queries")
+        with self._lock:
+            budget = self._budgets.setdefault(primary, _Budget(self.budget, self.burst))
+            budget.earn()
+        futures = {self._executor.submit(self._send, primary, wire, True): primary}
+        backups = [url for url in self.rank(primary) if url != primary]
+        hedged = decided = False
+        deadline = start + self.timeout
+        done, _ = wait(futures, timeout=self.delay(primary))
+        error = None
+        while True:
+            for future in done:
+                url = futures.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if url != primary:
+                    self._count("hedge_wins")
+                latency_ms = round((time.perf_counter() - start) * 1000, 2)
+                with self._lock:
+                    self._delivered.append(latency_ms)
+                return {"response": response, "url": url, "hedged": hedged, "latency_ms": latency_ms}
+            if backups and not futures:
+                # everything sent so far failed: fail over without spending budget
+                self._count("failovers")
+                url = backups.pop(0)
+                futures[self._executor.submit(self._send, url, wire, False)] = url
+            elif backups and not decided:
+                # the primary is slower than its p90
+                decided = True
+                with self._lock:
+                    allowed = budget.spend()
+                if allowed:
+                    self._count("hedges")
+                    url = backups.pop(0)
+                    futures[self._executor.submit(self._send, url, wire, False)] = url
+                    hedged = True
+                else:
+                    self._count("budget_denied")
+            remaining = deadline - time.perf_counter()
+            if not futures or remaining <= 0:
+                break
+            done, _ = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+        self._count("failures")
+        raise error or TimeoutError(f"no answer within {self.timeout}s")
+
+    def stats(self):
+        """Hedge counters and the p99 latency with hedging versus the primary alone."""
+        with self._lock:
+            counters = dict(self._counters)
+            p99_primary = _percentile(self._primary, 0.99)
+            p99_delivered = _percentile(self._delivered, 0.99)
+            p90 = {url: _percentile(values, 0.9) for url, values in self._latency.items()}
+            budgets = {url: round(b.tokens, 2) for url, b in self._budgets.items()}
+        reduction = None
+        if p99_primary is not None and p99_delivered is not None:
+            p99_primary = round(p99_primary, 2)
+            reduction = round(p99_primary - p99_delivered, 2)
+        return dict(counters, p99_primary_ms=p99_primary,
+                    p99_delivered_ms=p99_delivered, p99_reduction_ms=reduction,
+                    p90_ms={url: round(v, 2) for url, v in p90.items() if v is not None}, budget_tokens=budgets)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
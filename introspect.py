@@ -0,0 +1,181 @@
+"""Service state and network information without spawning processes.
+
+Unit state comes from systemd over D-Bus when the optional ``jeepney``
+package is installed, otherwise from the unit's cgroup, and only as a last
+resort from ``systemctl is-active``. Routes are read from /proc/net/route
+and local addresses from /proc/net/fib_trie. /etc/resolv.conf is parsed
+only when it changes. Every path is relative to ``root``, so tests and
+benchmarks can point it at a fixture tree.
+"""
+import ipaddress
+import os
+import socket
+import struct
+import subprocess
+import threading
+
+from filecache import CachedFile
+
+try:
+    from jeepney import DBusAddress, new_method_call
+    from jeepney.io.blocking import open_dbus_connection
+    DBUS_AVAILABLE = True
+except ImportError:
+    DBUS_AVAILABLE = False
+
+# cgroup v2, then the v2 and v1 systemd hierarchies of hybrid setups
+CGROUP_ROOTS = ("sys/fs/cgroup", "sys/fs/cgroup/unified", "sys/fs/cgroup/systemd")
+RTF_UP = 0x1
+
+
+class SystemdBus:
+    """ActiveState of systemd units over the system D-Bus, on one reused connection.
+
+    The connection is blocking and matches replies to whoever reads next, so
+    callers from several threads take turns.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.Lock()
+        self._manager = DBusAddress("/org/freedesktop/systemd1", bus_name="org.freedesktop.systemd1",
+                                    interface="org.freedesktop.systemd1.Manager")
+
+    def _call(self, message):
+        with self._lock:
+            if self._conn is None:
+                self._conn = open_dbus_connection(bus="SYSTEM")
+            try:
+                return self._conn.send_and_get_reply(message, timeout=2).body
+            except Exception:
+                self._conn.close()
+                self._conn = None
+                raise
+
+    def active_state(self, unit):
+        path = self._call(new_method_call(self._manager, "LoadUnit", "s", (unit,)))[0]
+        properties = DBusAddress(path, bus_name="org.freedesktop.systemd1", interface="org.freedesktop.DBus.Properties")
+        _, state = self._call(new_method_call(properties, "Get", "ss", ("org.freedesktop.systemd1.Unit", "ActiveState")))[0]
+        return state
+
+
+def parse_nameservers(text):
+    servers = []
+    for line in (text or "").splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[0] == "nameserver":
+            servers.append(parts[1])
+    return servers
+
+
+def parse_routes(text):
+    """IPv4 routes from /proc/net/route as dicts with network, gateway (or None), iface and metric."""
+    routes = []
+    for line in (text or "").splitlines()[1:]:
+        fields = line.split()
+        if len(fields) < 8 or not int(fields[3], 16) & RTF_UP:
+            continue
+        # addresses are 32-bit hex in host (little-endian) byte order
+        addr = lambda h: socket.inet_ntoa(struct.pack("<I", int(h, 16)))
+        gateway = addr(fields[2])
+        routes.append({
+            "network": ipaddress.IPv4Network(f"{addr(fields[1])}/{addr(fields[7])}", strict=False),
+            "gateway": None if gateway == "0.0.0.0" else gateway,
+            "iface": fields[0],
+            "metric": int(fields[6]),
+        })
+    return routes
+
+
+def parse_local_addresses(text):
+    """Addresses marked "/32 host LOCAL" in /proc/net/fib_trie."""
+    addresses, leaf = [], None
+    for line in (text or "").splitlines():
+        stripped = line.strip()
+        if stripped.startswith("|--"):
+            leaf = stripped[3:].strip()
+        elif leaf and stripped.startswith("/32 host LOCAL"):
+            addresses.append(leaf)
+    return list(dict.fromkeys(addresses))
+
+
+class Introspector:
+    """Answer get_service_status and get_network_info from files instead of subprocesses.
+
+    ``bus`` is anything with ``active_state(unit)`` (a SystemdBus by default
+    when jeepney is installed and ``root`` is "/"); ``run`` is the
+    subprocess.run used for the systemctl fallback. ``source`` records which
+    method answered the last service check.
+    """
+
+    def __init__(self, unit="cloudflared", root="/", bus=None, run=subprocess.run, watcher=None):
+        self.unit = unit if unit.endswith(".service") else f"{unit}.service"
+        self.root = root
+        if bus is None and DBUS_AVAILABLE and root == "/":
+            bus = SystemdBus()
+        self.bus = bus
+        self.run = run
+        self.source = None
+        self.resolv_conf = CachedFile(self._path("etc/resolv.conf"), parse_nameservers)
+        if watcher is not None:
+            watcher.watch(self.resolv_conf)
+
+    def _path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def _read(self, *parts):
+        try:
+            with open(self._path(*parts), "r") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def _cgroup_active(self):
+        """True/False if a systemd cgroup hierarchy exists, None if there is none to ask."""
+        for base in CGROUP_ROOTS:
+            if os.path.isdir(self._path(base, "system.slice")):
+                procs = self._read(base, "system.slice", self.unit, "cgroup.procs")
+                return bool(procs and procs.strip())
+        return None
+
+    def service_active(self):
+        if self.bus is not None:
+            try:
+                state = self.bus.active_state(self.unit)
+                self.source = "dbus"
+                return state == "active"
+            except Exception:
+                pass
+        active = self._cgroup_active()
+        if active is not None:
+            self.source = "cgroup"
+            return active
+        self.source = "systemctl"
+        result = self.run(["systemctl", "is-active", "--quiet", self.unit[:-len(".service")]], check=False)
+        return result.returncode == 0
+
+    def _source_address(self, target):
+        # connect() on a UDP socket picks the route and source address without sending anything
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect((target, 53))
+            return sock.getsockname()[0]
+
+    def network_info(self, target="8.8.8.8"):
+        """local_ip and gateway of the route to target, and the resolv.conf nameservers."""
+        info = {"local_ip": None, "gateway": None, "dns_servers": list(self.resolv_conf.get())}
+        routes = parse_routes(self._read("proc/net/route"))
+        address = ipaddress.IPv4Address(target)
+        matches = [r for r in routes if address in r["network"]]
+        if not matches:
+            return info
+        route = max(matches, key=lambda r: (r["network"].prefixlen, -r["metric"]))
+        info["gateway"] = route["gateway"]
+        # the interface's own address: a local address inside one of its directly connected networks
+        links = [r["network"] for r in routes if r["iface"] == route["iface"] and r["gateway"] is None]
+        for local in parse_local_addresses(self._read("proc/net/fib_trie")):
+            if any(ipaddress.IPv4Address(local) in network for network in links):
+                info["local_ip"] = local
+                break
+        if info["local_ip"] is None and self.root == "/":
+            info["local_ip"] = self._source_address(target)
+        return info
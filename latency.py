@@ -0,0 +1,137 @@
+"""In-process latency measurement: TCP-connect RTT and unprivileged ICMP echo."""
+import errno
+import os
+import selectors
+import socket
+import struct
+import time
+
+ICMP_ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ICMP_ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+ICMP_PROTO = {socket.AF_INET: socket.IPPROTO_ICMP, socket.AF_INET6: socket.IPPROTO_ICMPV6}
+
+
+def _resolve(host, port, socktype):
+    family, _, _, _, addr = socket.getaddrinfo(host, port, type=socktype)[0]
+    return family, addr
+
+
+def tcp_rtts(host, port=443, samples=3, timeout=2):
+    """Open ``samples`` non-blocking TCP connections at once and time each handshake.
+
+    Returns the RTTs in milliseconds, in the order the connections were
+    started; connections that fail or do not complete within ``timeout``
+    seconds are left out.
+    """
+    family, addr = _resolve(host, port, socket.SOCK_STREAM)
+    selector = selectors.DefaultSelector()
+    pending = {}  # socket -> (sample index, start time)
+    rtts = {}
+    try:
+        for index in range(samples):
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            start = time.perf_counter()
+            err = sock.connect_ex(addr)
+            if err == 0:
+                rtts[index] = (time.perf_counter() - start) * 1000
+                sock.close()
+            elif err in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                pending[sock] = (index, start)
+                selector.register(sock, selectors.EVENT_WRITE)
+            else:
+                sock.close()
+        deadline = time.perf_counter() + timeout
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                now = time.perf_counter()
+                sock = key.fileobj
+                index, start = pending.pop(sock)
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    rtts[index] = (now - start) * 1000
+                selector.unregister(sock)
+                sock.close()
+    finally:
+        for sock in pending:
+            sock.close()
+        selector.close()
+    return [rtts[index] for index in sorted(rtts)]
+
+
+def icmp_rtts(host, samples=3, timeout=2):
+    """Send ``samples`` ICMP echo requests over an unprivileged datagram socket.
+
+    Needs the process group to be inside net.ipv4.ping_group_range; raises
+    PermissionError otherwise. The kernel fills in the echo identifier and
+    checksum for these sockets.
+    """
+    family, addr = _resolve(host, None, socket.SOCK_DGRAM)
+    sock = socket.socket(family, socket.SOCK_DGRAM, ICMP_PROTO[family])
+    selector = selectors.DefaultSelector()
+    sent = {}
+    rtts = {}
+    try:
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+        payload = os.urandom(16)
+        for seq in range(1, samples + 1):
+            packet = struct.pack("!BBHHH", ICMP_ECHO_REQUEST[family], 0, 0, 0, seq) + payload
+            sent[seq] = time.perf_counter()
+            sock.sendto(packet, addr)
+        deadline = time.perf_counter() + timeout
+        while len(rtts) < len(sent):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not selector.select(remaining):
+                break
+            now = time.perf_counter()
+            try:
+                data = sock.recv(1024)
+            except BlockingIOError:
+                continue
+            if len(data) < 8:
+                continue
+            icmp_type, _, _, _, seq = struct.unpack("!BBHHH", data[:8])
+            if icmp_type == ICMP_ECHO_REPLY[family] and seq in sent and seq not in rtts:
+                rtts[seq] = (now - sent[seq]) * 1000
+    finally:
+        selector.close()
+        sock.close()
+    return [rtts[seq] for seq in sorted(rtts)]
+
+
+def summarize(rtts, sent):
+    """Reduce a list of RTTs to min/avg/max/jitter and loss."""
+    stats = {"sent": sent, "received": len(rtts), "loss": None,
+             "min": None, "avg": None, "max": None, "jitter": None}
+    if sent:
+        stats["loss"] = round(1 - len(rtts) / sent, 2)
+    if rtts:
+        stats["min"] = round(min(rtts), 2)
+        stats["avg"] = round(sum(rtts) / len(rtts), 2)
+        stats["max"] = round(max(rtts), 2)
+        # mean absolute difference between consecutive samples
+        diffs = [abs(b - a) for a, b in zip(rtts, rtts[1:])]
+        stats["jitter"] = round(sum(diffs) / len(diffs), 2) if diffs else 0.0
+    return stats
+
+
+def measure(host, port=443, samples=3, timeout=2, method="tcp"):
+    """Measure latency to host without spawning a process.
+
+    ``method`` is "tcp" (connect RTT to ``port``) or "icmp" (echo over an
+    unprivileged ICMP socket, falling back to TCP where the kernel does not
+    allow it). Returns the summary from ``summarize`` plus the method used.
+    """
+    if method == "icmp":
+        try:
+            stats = summarize(icmp_rtts(host, samples, timeout), samples)
+            stats["method"] = "icmp"
+            return stats
+        except PermissionError:
+            pass
+    stats = summarize(tcp_rtts(host, port, samples, timeout), samples)
+    stats["method"] = "tcp"
+    return stats
@@ -0,0 +1,69 @@
+"""In-process DNS lookups over plain DNS (UDP with TCP fallback) or DoH, run concurrently in batches."""
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+
+from dnslib import DNSRecord, QTYPE, RCODE
+
+import doh
+
+RECORD_TYPES = ("A", "AAAA", "CNAME", "MX", "TXT", "HTTPS")
+
+
+def query_dns(host, port, name, qtype="A", timeout=2):
+    """Resolve name/qtype at a plain DNS server; retries over TCP if the UDP answer is truncated."""
+    question = DNSRecord.question(name, qtype)
+    reply = DNSRecord.parse(question.send(host, port, timeout=timeout))
+    if reply.header.tc:
+        reply = DNSRecord.parse(question.send(host, port, tcp=True, timeout=timeout))
+    return reply
+
+
+def query_doh(pool, url, name, qtype="A", method="GET", timeout=3):
+    """Resolve name/qtype through a DoH provider using the shared pool."""
+    response = pool.query(url, doh.build_query(name, qtype), method=method, timeout=timeout)
+    if response["status"] != 200 or not response["content_type"].startswith(doh.DNS_MESSAGE):
+        raise ValueError(f"HTTP {response['status']} ({response['content_type']})")
+    return DNSRecord.parse(response["body"])
+
+
+def lookup(resolve, name, qtype):
+    """Run one lookup with resolve(name, qtype) and time it.
+
+    Returns a dict with the ``domain``, ``type``, ``rcode``, the textual
+    ``answers`` (every answer record, like ``dig +short``), ``ms`` and
+    ``error``.
+    """
+    result = {"domain": name, "type": qtype, "rcode": None, "answers": [], "ms": None, "error": None}
+    start = time.perf_counter()
+    try:
+        reply = resolve(name, qtype)
+        result["rcode"] = RCODE.get(reply.header.rcode)
+        result["answers"] = [str(rr.rdata) for rr in reply.rr if rr.rtype != QTYPE.OPT]
+    except Exception as e:
+        result["error"] = str(e) or e.__class__.__name__
+    result["ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def batch(resolve, queries, concurrency=16, deadline=30):
+    """Resolve (name, qtype) pairs concurrently; results come back in query order.
+
+    Lookups still running after ``deadline`` seconds are reported with a
+    "deadline exceeded" error.
+    """
+    results = [None] * len(queries)
+    if not queries:
+        return results
+    executor = ThreadPoolExecutor(max_workers=min(concurrency, len(queries)))
+    futures = {executor.submit(lookup, resolve, name, qtype): i for i, (name, qtype) in enumerate(queries)}
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            results[futures[future]] = future.result()
+    except FuturesTimeout:
+        for i, (name, qtype) in enumerate(queries):
+            if results[i] is None:
+                results[i] = {"domain": name, "type": qtype, "rcode": None, "answers": [],
+                              "ms": None, "error": "deadline exceeded"}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
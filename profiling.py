@@ -0,0 +1,118 @@
+"""Request-scoped Server-Timing instrumentation and an on-demand statistical profiler.
+
+``timed(name)`` wraps a helper so the time spent in it during a request is
+added up and reported by ``server_timing()`` as a Server-Timing header.
+Outside a request (background jobs, worker threads) it costs one check.
+
+``Sampler`` snapshots the stacks of every OS thread at a fixed interval from
+a real thread, so it keeps sampling while eventlet's hub runs greenthreads,
+and aggregates them in the collapsed-stack format read by flamegraph.pl and
+speedscope.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from flask import g, has_request_context
+
+try:
+    # a real OS thread and sleep, even if eventlet has monkey-patched the stdlib
+    from eventlet.patcher import original
+    _threading = original("threading")
+    _sleep = original("time").sleep
+except ImportError:
+    import threading as _threading
+    _sleep = time.sleep
+
+
+def record(name, seconds):
+    """Add seconds spent in name to the current request's timings."""
+    if not has_request_context():
+        return
+    timings = g.setdefault("server_timing", {})
+    entry = timings.setdefault(name, [0.0, 0])
+    entry[0] += seconds
+    entry[1] += 1
+
+
+def timed(name):
+    """Decorator recording the wrapped function's duration under name."""
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not has_request_context():
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def server_timing(total_seconds=None):
+    """Server-Timing header value for the current request, e.g. ``sqlite;dur=1.2;desc="3 calls"``."""
+    parts = []
+    for name, (seconds, count) in g.get("server_timing", {}).items():
+        parts.append(f'{name};dur={seconds * 1000:.2f};desc="{count} call{"s" if count != 1 else ""}"')
+    if total_seconds is not None:
+        parts.append(f"total;dur={total_seconds * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Statistical profiler sampling every thread's stack each ``interval`` seconds."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self.started = None
+        self.stopped = None
+        self._stop = _threading.Event()
+        self._thread = _threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self.started = time.time()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.stopped = time.time()
+        return self
+
+    def _run(self):
+        own = _threading.get_ident()
+        names = {}
+        while not self._stop.is_set():
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            _sleep(self.interval)
+
+    def collapsed(self):
+        """One ``root;...;leaf count`` line per distinct stack, most frequent first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
@@ -0,0 +1,59 @@
+"""Registry of DoH providers backed by doh_providers.json."""
+import json
+from urllib.parse import urlparse
+
+from filecache import CachedFile, atomic_write
+
+
+def normalize_url(url):
+    """Normalize URL by removing trailing slashes and ensuring scheme."""
+    parsed = urlparse(url)
+    if not parsed.scheme:
+        url = f"https://{url}"
+        parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}{parsed.path.rstrip('/')}"
+
+
+def _parse(text):
+    if text is None:
+        raise FileNotFoundError("providers file does not exist")
+    providers = json.loads(text)
+    # Ensure all providers have required fields
+    for provider in providers:
+        if not all(key in provider for key in ["name", "url"]):
+            raise ValueError("Invalid provider format")
+    index = {normalize_url(provider["url"]): i for i, provider in enumerate(providers)}
+    return providers, index
+
+
+class ProviderRegistry:
+    """In-memory provider list with a normalized-URL index.
+
+    The providers file is only re-parsed when its mtime, size or inode
+    changes, so reads cost a single stat(). Saves replace the file atomically
+    (temp file + rename). Callers get copies and may mutate them freely before
+    passing the list back to ``save``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = CachedFile(path, _parse)
+
+    def all(self):
+        providers, _ = self._file.get()
+        return [dict(provider) for provider in providers]
+
+    def index_of(self, url):
+        """Position of the provider whose URL normalizes to the same value, or None."""
+        _, index = self._file.get()
+        return index.get(normalize_url(url))
+
+    def find(self, url):
+        """The provider with this (normalized) URL, or None."""
+        providers, index = self._file.get()
+        position = index.get(normalize_url(url))
+        return None if position is None else dict(providers[position])
+
+    def save(self, providers):
+        atomic_write(self.path, json.dumps(providers, indent=4))
+        self._file.invalidate()
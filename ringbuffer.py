@@ -0,0 +1,157 @@
+"""Fixed-capacity per-provider latency history in typed arrays.
+
+Each buffer keeps three parallel arrays: epoch timestamps and latencies as
+doubles (NaN for a failed ping) and a status bitfield byte. Appending
+overwrites the oldest slot, so it is O(1) with no allocation, and a few
+thousand samples cost 17 bytes each. Readers get memoryview slices of the
+arrays (at most two, when the window wraps around the end) instead of copies.
+"""
+import math
+import threading
+from array import array
+
+DOH_OK = 1
+PING_OK = 2
+
+
+class RingBuffer:
+    """The last ``capacity`` samples of one provider, oldest first."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.ts = array("d", bytes(8 * capacity))
+        self.latency = array("d", bytes(8 * capacity))
+        self.status = array("B", bytes(capacity))
+        self._start = 0
+        self._size = 0
+        # appends and reads of the views must not interleave
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def append(self, ts, latency, doh_ok):
+        with self.lock:
+            index = (self._start + self._size) % self.capacity
+            self.ts[index] = ts
+            self.latency[index] = math.nan if latency is None else latency
+            self.status[index] = (DOH_OK if doh_ok else 0) | (PING_OK if latency is not None else 0)
+            if self._size < self.capacity:
+                self._size += 1
+            else:
+                self._start = (self._start + 1) % self.capacity
+
+    def clear(self):
+        with self.lock:
+            self._start = self._size = 0
+
+    def covers(self, since):
+        """True if no sample recorded at or after ``since`` has been overwritten yet."""
+        with self.lock:
+            return self._size < self.capacity or self.ts[self._start] <= since
+
+    def _first_at_or_after(self, since):
+        """Logical index of the oldest sample with ts >= since (timestamps are appended in order)."""
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts[(self._start + mid) % self.capacity] < since:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _spans(self, lo, hi):
+        """Physical index ranges holding logical positions [lo, hi)."""
+        first, last = self._start + lo, self._start + hi
+        if first >= last:
+            return []
+        if last <= self.capacity:
+            return [(first, last)]
+        if first >= self.capacity:
+            return [(first - self.capacity, last - self.capacity)]
+        return [(first, self.capacity), (0, last - self.capacity)]
+
+    def segments(self, since=None, count=None):
+        """(ts, latency, status) memoryview triples for the window, oldest first; hold ``lock`` while using them.
+
+        The window is the newest ``count`` samples and/or those at or after
+        ``since``.
+        """
+        skip = self._size - count if count is not None and count < self._size else 0
+        if since is not None:
+            skip = max(skip, self._first_at_or_after(since))
+        ts, latency, status = memoryview(self.ts), memoryview(self.latency), memoryview(self.status)
+        return [(ts[lo:hi], latency[lo:hi], status[lo:hi]) for lo, hi in self._spans(skip, self._size)]
+
+    def samples(self, since=None, count=None):
+        """The window as a list of {"ts", "ping", "doh_ok"} dicts, e.g. for JSON."""
+        with self.lock:
+            return [
+                {"ts": t, "ping": None if s & PING_OK == 0 else l, "doh_ok": bool(s & DOH_OK)}
+                for ts, latency, status in self.segments(since, count)
+                for t, l, s in zip(ts, latency, status)
+            ]
+
+
+class RingBuffers:
+    """A RingBuffer per provider, created on first use.
+
+    ``floor`` is the earliest time from which the buffers hold every sample:
+    what was recorded before it was never loaded (see ``warm_up``) or has
+    since been pruned from the database (see ``raise_floor``).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.floor = 0.0
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider):
+        buffer = self._buffers.get(provider)
+        if buffer is None:
+            with self._lock:
+                buffer = self._buffers.setdefault(provider, RingBuffer(self.capacity))
+        return buffer
+
+    def find(self, provider):
+        """The provider's buffer, or None if nothing was recorded for it."""
+        return self._buffers.get(provider)
+
+    def append(self, provider, ts, latency, doh_ok):
+        self.get(provider).append(ts, latency, doh_ok)
+
+    def raise_floor(self, ts):
+        with self._lock:
+            self.floor = max(self.floor, ts)
+
+    def covers(self, provider, since):
+        """True if provider's buffer holds every sample recorded at or after ``since``."""
+        buffer = self._buffers.get(provider)
+        return buffer is not None and since >= self.floor and buffer.covers(since)
+
+    def clear(self, provider=None):
+        for name, buffer in list(self._buffers.items()):
+            if provider is None or name == provider:
+                buffer.clear()
+
+    def warm_up(self, conn, since):
+        """Load each provider's newest samples at or after ``since`` from ping_history; returns the number loaded.
+
+        ``since`` becomes the floor: older rows may already have been pruned.
+        """
+        self.raise_floor(since)
+        rows = conn.execute(
+            "SELECT provider, ts, ping, doh_ok FROM ("
+            " SELECT provider, ts, ping, doh_ok, ROW_NUMBER() OVER (PARTITION BY provider ORDER BY ts DESC) AS n"
+            " FROM ping_history WHERE ts >= ?) WHERE n <= ? ORDER BY provider, ts",
+            (since, self.capacity),
+        ).fetchall()
+        for provider, ts, ping, doh_ok in rows:
+            self.append(provider, ts, ping, doh_ok)
+        return len(rows)
+
+    def stats(self):
+        return {"capacity": self.capacity, "providers": {name: len(b) for name, b in self._buffers.items()},
+                "bytes": len(self._buffers) * self.capacity * 17}
@@ -0,0 +1,203 @@
+"""Incremental 1-minute, 1-hour and 1-day rollups of the raw ping_history samples.
+
+Each resolution has an aggregate table (count, min, max, sum, sum of squares,
+DoH successes) and a sketch table holding per-bucket quantile sketch counts
+(see sketch.py) keyed by (provider, bucket, key).
+"""
+
+# (name, bucket width in seconds, source table); each level is built from the one before it
+RESOLUTIONS = [
+    ("1m", 60, "ping_history"),
+    ("1h", 3600, "ping_rollup_1m"),
+    ("1d", 86400, "ping_rollup_1h"),
+]
+
+_RAW_AGGREGATES = (
+    "COUNT(*), COUNT(ping), MIN(ping), MAX(ping), TOTAL(ping), TOTAL(ping * ping), TOTAL(doh_ok)"
+)
+_ROLLUP_AGGREGATES = (
+    "SUM(count), SUM(ping_count), MIN(ping_min), MAX(ping_max), SUM(ping_sum), SUM(ping_sumsq), SUM(doh_ok)"
+)
+
+
+def table_name(resolution):
+    return f"ping_rollup_{resolution}"
+
+
+def sketch_table_name(resolution):
+    return f"ping_sketch_{resolution}"
+
+
+def all_tables():
+    """Every aggregate and sketch table, finest resolution first."""
+    tables = []
+    for name, _, _ in RESOLUTIONS:
+        tables += [table_name(name), sketch_table_name(name)]
+    return tables
+
+
+def create_schema(conn):
+    """Create the rollup tables and the per-resolution watermark table."""
+    for name, _, _ in RESOLUTIONS:
+        table = table_name(name)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, provider TEXT, bucket INTEGER,"
+            " count INTEGER, ping_count INTEGER, ping_min REAL, ping_max REAL, ping_sum REAL,"
+            " ping_sumsq REAL, doh_ok INTEGER)"
+        )
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_provider_bucket ON {table}(provider, bucket)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table}(bucket)")
+        sketch = sketch_table_name(name)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {sketch} (id INTEGER PRIMARY KEY, provider TEXT, bucket INTEGER,"
+            " key INTEGER, count INTEGER)"
+        )
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{sketch}_provider_bucket_key ON {sketch}(provider, bucket, key)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{sketch}_bucket ON {sketch}(bucket)")
+    # buckets strictly below the watermark have been fully rolled up
+    conn.execute("CREATE TABLE IF NOT EXISTS rollup_state (resolution TEXT PRIMARY KEY, watermark INTEGER)")
+
+
+def _watermark(conn, resolution, source, time_column, width):
+    row = conn.execute("SELECT watermark FROM rollup_state WHERE resolution = ?", (resolution,)).fetchone()
+    if row:
+        return row[0]
+    first = conn.execute(f"SELECT MIN({time_column}) FROM {source}").fetchone()[0]
+    return None if first is None else first // width * width
+
+
+def roll_up(conn, now):
+    """Fold every completed bucket since the last run into the rollup tables.
+
+    Runs inside one writer transaction. A bucket is only rolled up once it is
+    complete, both in wall-clock time and in the resolution below it, so each
+    source row is counted exactly once. Returns the number of buckets written
+    per resolution.
+    """
+    written = {}
+    limit = now
+    previous = None
+    for name, width, source in RESOLUTIONS:
+        time_column = "ts" if source == "ping_history" else "bucket"
+        aggregates = _RAW_AGGREGATES if source == "ping_history" else _ROLLUP_AGGREGATES
+        end = limit // width * width
+        start = _watermark(conn, name, source, time_column, width)
+        written[name] = 0
+        if start is not None and end > start:
+            table = table_name(name)
+            cursor = conn.execute(
+                f"INSERT INTO {table}(provider, bucket, count, ping_count, ping_min, ping_max, ping_sum, ping_sumsq, doh_ok)"
+                f" SELECT provider, {time_column} / {width} * {width}, {aggregates} FROM {source}"
+                f" WHERE {time_column} >= ? AND {time_column} < ? GROUP BY provider, {time_column} / {width}"
+                " ON CONFLICT(provider, bucket) DO UPDATE SET"
+                " count = count + excluded.count,"
+                " ping_count = ping_count + excluded.ping_count,"
+                " ping_min = MIN(COALESCE(ping_min, excluded.ping_min), COALESCE(excluded.ping_min, ping_min)),"
+                " ping_max = MAX(COALESCE(ping_max, excluded.ping_max), COALESCE(excluded.ping_max, ping_max)),"
+                " ping_sum = ping_sum + excluded.ping_sum,"
+                " ping_sumsq = ping_sumsq + excluded.ping_sumsq,"
+                " doh_ok = doh_ok + excluded.doh_ok",
+                (start, end),
+            )
+            written[name] = cursor.rowcount
+            if source == "ping_history":
+                sketch_select = (
+                    f"SELECT provider, ts / {width} * {width}, ping_key, COUNT(*) FROM ping_history"
+                    " WHERE ts >= ? AND ts < ? AND ping_key IS NOT NULL"
+                    f" GROUP BY provider, ts / {width}, ping_key"
+                )
+            else:
+                sketch_select = (
+                    f"SELECT provider, bucket / {width} * {width}, key, SUM(count)"
+                    f" FROM {sketch_table_name(previous)} WHERE bucket >= ? AND bucket < ?"
+                    f" GROUP BY provider, bucket / {width}, key"
+                )
+            conn.execute(
+                f"INSERT INTO {sketch_table_name(name)}(provider, bucket, key, count) {sketch_select}"
+                " ON CONFLICT(provider, bucket, key) DO UPDATE SET count = count + excluded.count",
+                (start, end),
+            )
+            conn.execute(
+                "INSERT INTO rollup_state(resolution, watermark) VALUES (?, ?)"
+                " ON CONFLICT(resolution) DO UPDATE SET watermark = excluded.watermark",
+                (name, end),
+            )
+        # the next resolution may only consume buckets this one has completed
+        limit = end if start is None else max(start, end)
+        previous = name
+    return written
+
+
+def watermarks(conn):
+    """Watermark per resolution (None before the first rollup)."""
+    rows = dict(conn.execute("SELECT resolution, watermark FROM rollup_state").fetchall())
+    return {name: rows.get(name) for name, _, _ in RESOLUTIONS}
+
+
+def pick_resolution(range_seconds, raw_step, raw_retention, retention, max_points):
+    """Choose the finest resolution that covers range_seconds in at most max_points points.
+
+    ``retention`` maps resolution names to their retention in seconds; a
+    resolution is skipped when the requested range reaches past it. Returns
+    "raw" or a resolution name, falling back to the coarsest one.
+    """
+    if range_seconds <= raw_retention and range_seconds / max(raw_step, 1) <= max_points:
+        return "raw"
+    for name, width, _ in RESOLUTIONS:
+        if range_seconds <= retention[name] and range_seconds / width <= max_points:
+            return name
+    return RESOLUTIONS[-1][0]
+
+
+def fetch(conn, provider, resolution, since):
+    """Return points for provider at ``resolution`` from ``since`` onwards, oldest first.
+
+    Completed buckets come from the resolution's own table. Everything past
+    its watermark is folded into buckets of the same width from the finer
+    rollups and the raw samples, so the newest, still open buckets are
+    included too.
+    """
+    index = [name for name, _, _ in RESOLUTIONS].index(resolution)
+    width = RESOLUTIONS[index][1]
+    marks = watermarks(conn)
+    columns = "AS b, {} AS c, {} AS pc, {} AS mn, {} AS mx, {} AS s, {} AS ok"
+    rollup_columns = columns.format("count", "ping_count", "ping_min", "ping_max", "ping_sum", "doh_ok")
+    parts, params = [], []
+    lower = since
+    if marks[resolution] is not None:
+        parts.append(
+            f"SELECT bucket {rollup_columns} FROM {table_name(resolution)}"
+            " WHERE provider = ? AND bucket >= ? AND bucket < ?"
+        )
+        params += [provider, since, marks[resolution]]
+        lower = max(since, marks[resolution])
+    for name, _, _ in reversed(RESOLUTIONS[:index]):
+        if marks[name] is None or marks[name] <= lower:
+            continue
+        parts.append(
+            f"SELECT bucket / {width} * {width} {rollup_columns} FROM {table_name(name)}"
+            " WHERE provider = ? AND bucket >= ? AND bucket < ?"
+        )
+        params += [provider, lower, marks[name]]
+        lower = marks[name]
+    parts.append(
+        f"SELECT ts / {width} * {width} {columns.format('COUNT(*)', 'COUNT(ping)', 'MIN(ping)', 'MAX(ping)', 'TOTAL(ping)', 'TOTAL(doh_ok)')}"
+        f" FROM ping_history WHERE provider = ? AND ts >= ? GROUP BY ts / {width}"
+    )
+    params += [provider, lower]
+    rows = conn.execute(
+        "SELECT b, SUM(c), SUM(pc), MIN(mn), MAX(mx), TOTAL(s), TOTAL(ok)"
+        f" FROM ({' UNION ALL '.join(parts)}) GROUP BY b ORDER BY b",
+        params,
+    ).fetchall()
+    return [
+        {
+            "bucket": bucket,
+            "count": count,
+            "ping": round(ping_sum / ping_count, 2) if ping_count else None,
+            "min": ping_min,
+            "max": ping_max,
+            "doh_ok": round(doh_ok / count, 3) if count else None,
+        }
+        for bucket, count, ping_count, ping_min, ping_max, ping_sum, doh_ok in rows
+    ]
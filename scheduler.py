@@ -0,0 +1,123 @@
+"""Continuous probing of every provider at a bounded, predictable cost.
+
+Each provider has its own interval (the provider's ``interval`` field, else
+the default). Its first probe is placed at a random offset within that
+interval, and every later one is jittered by +/- ``jitter``, so probes never
+line up into bursts. Launches are spaced to at most ``rate`` per second,
+at most ``concurrency`` run at once, and a provider that keeps failing is
+probed at exponentially longer intervals, up to ``max_backoff`` times its own.
+"""
+import heapq
+import random
+import threading
+import time
+
+
+class _Entry:
+    def __init__(self, url, name, interval):
+        self.url = url
+        self.name = name
+        self.interval = interval
+        self.due = 0.0
+        self.failures = 0
+        self.running = False
+        self.runs = 0
+        self.last_run = None
+        self.last_ok = None
+
+
+class ProbeScheduler:
+    """Decides which providers to probe when; the caller runs the probes and reports back with ``done``."""
+
+    def __init__(self, interval=60, jitter=0.2, rate=2.0, concurrency=4, max_backoff=16,
+                 clock=time.monotonic, rng=None):
+        self.interval = interval
+        self.jitter = jitter
+        self.rate = rate
+        self.concurrency = concurrency
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self._entries = {}
+        self._heap = []  # (due, url); stale pairs are skipped when popped
+        self._running = 0
+        self._next_launch = 0.0
+        self._lock = threading.Lock()
+
+    def _schedule(self, entry, delay):
+        entry.due = self.clock() + delay
+        heapq.heappush(self._heap, (entry.due, entry.url))
+
+    def sync(self, providers):
+        """Track exactly these providers ({"url", "name", optional "interval"}), keeping existing state."""
+        with self._lock:
+            wanted = {p["url"]: p for p in providers}
+            for url in list(self._entries):
+                if url not in wanted:
+                    del self._entries[url]
+            for url, provider in wanted.items():
+                interval = float(provider.get("interval") or self.interval)
+                entry = self._entries.get(url)
+                if entry is None:
+                    entry = self._entries[url] = _Entry(url, provider.get("name", url), interval)
+                    self._schedule(entry, self.rng.uniform(0, interval))
+                else:
+                    entry.name, entry.interval = provider.get("name", url), interval
+
+    def take(self):
+        """Mark and return the providers to launch now, within the rate and concurrency limits."""
+        launch = []
+        with self._lock:
+            now = self.clock()
+            while self._heap and self._heap[0][0] <= now and self._running < self.concurrency:
+                if self.rate > 0 and self._next_launch > now:
+                    break
+                due, url = heapq.heappop(self._heap)
+                entry = self._entries.get(url)
+                if entry is None or entry.running or entry.due != due:
+                    continue
+                entry.running = True
+                self._running += 1
+                self._next_launch = max(self._next_launch, now) + (1.0 / self.rate if self.rate > 0 else 0)
+                launch.append({"url": url, "name": entry.name})
+        return launch
+
+    def done(self, url, ok):
+        """Record a finished probe and schedule the provider's next one."""
+        with self._lock:
+            self._running -= 1
+            entry = self._entries.get(url)
+            if entry is None:
+                return
+            entry.running = False
+            entry.runs += 1
+            entry.last_run = time.time()
+            entry.last_ok = ok
+            entry.failures = 0 if ok else entry.failures + 1
+            backoff = min(2 ** entry.failures, self.max_backoff) if entry.failures else 1
+            factor = self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+            self._schedule(entry, entry.interval * backoff * factor)
+
+    def wait_time(self, limit=1.0):
+        """Seconds until the next launch could happen, at most limit."""
+        with self._lock:
+            now = self.clock()
+            if not self._heap or self._running >= self.concurrency:
+                return limit
+            ready = max(self._heap[0][0], self._next_launch if self.rate > 0 else 0)
+            return min(max(ready - now, 0.0), limit)
+
+    def state(self):
+        with self._lock:
+            now = self.clock()
+            return {
+                "running": self._running,
+                "rate": self.rate,
+                "concurrency": self.concurrency,
+                "providers": [
+                    {"url": e.url, "name": e.name, "interval": e.interval, "next_in": round(max(e.due - now, 0), 1),
+                     "failures": e.failures, "running": e.running, "runs": e.runs,
+                     "last_run": e.last_run, "last_ok": e.last_ok}
+                    for e in sorted(self._entries.values(), key=lambda e: e.due)
+                ],
+            }
@@ -0,0 +1,54 @@
+"""Mergeable log-bucket quantile sketch (DDSketch-style) for latency values in ms.
+
+A value maps to the integer key ceil(log(value) / log(gamma)); every value in a
+bucket is within RELATIVE_ACCURACY of the bucket's representative value. Two
+sketches merge by adding their per-key counts, which is what lets the
+database combine them with a plain SUM ... GROUP BY key.
+"""
+import math
+
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+# values below this share the lowest key
+MIN_VALUE = 0.01
+
+
+def key(value):
+    """Bucket key for a latency value."""
+    return math.ceil(math.log(max(value, MIN_VALUE)) / _LOG_GAMMA)
+
+
+def value(bucket_key):
+    """Representative value of a bucket, within RELATIVE_ACCURACY of any value in it."""
+    return 2 * GAMMA ** bucket_key / (GAMMA + 1)
+
+
+def rank(q, total):
+    """Zero-based nearest rank of quantile q among total sorted values.
+
+    Shared by the sketch and analytics.buffer_stats, so a window reports the
+    same sample's percentile whether it is served from memory or from SQL.
+    """
+    return max(math.ceil(q * total) - 1, 0)
+
+
+def quantiles(counts, qs):
+    """Estimate quantiles from (key, count) pairs, using nearest ``rank``.
+
+    Returns one value per q in qs (None when the sketch is empty).
+    """
+    items = sorted((k, c) for k, c in counts if c)
+    total = sum(c for _, c in items)
+    if not total:
+        return [None for _ in qs]
+    results = []
+    for q in qs:
+        index = rank(q, total)
+        seen = 0
+        for bucket_key, count in items:
+            seen += count
+            if seen > index:
+                results.append(round(value(bucket_key), 2))
+                break
+    return results
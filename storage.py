@@ -0,0 +1,193 @@
+"""SQLite storage with a single WAL-mode writer thread and pooled read-only connections."""
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _Call:
+    """A function to run on the writer connection, with its result handed back."""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Storage:
+    """Funnel all writes through one long-lived connection and group-commit them.
+
+    Writes are queued by ``execute``/``executemany`` and applied by a writer
+    thread, which drains up to ``batch_size`` queued statements into a single
+    transaction. The queue is bounded; when it stays full for
+    ``enqueue_timeout`` seconds the write is dropped and logged rather than
+    blocking the caller indefinitely. Reads use a small pool of read-only
+    connections so history and analytics queries never wait on the writer.
+    ``on_commit(statements, seconds)``, if given, is called after each group
+    commit with its size and duration, and ``on_read(seconds)`` after each
+    borrowed read connection is returned. ``offload(fn, *args)``, if given,
+    runs the calls that wait on SQLite (``call``, ``flush``, ``query`` and
+    ``read``) so an event loop is not blocked while they do.
+    """
+
+    def __init__(self, path, batch_size=200, queue_size=10000, read_pool_size=4, enqueue_timeout=1.0,
+                 on_commit=None, on_read=None, offload=None):
+        self.path = path
+        self.offload = offload
+        self.on_commit = on_commit
+        self.on_read = on_read
+        self.batch_size = batch_size
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = sqlite3.connect(path, check_same_thread=False)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        # WAL with synchronous=NORMAL only fsyncs at checkpoints
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._readers = queue.LifoQueue()
+        self._read_pool_size = read_pool_size
+        self._read_uri = f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    # -- writes -----------------------------------------------------------
+
+    def _put(self, item):
+        if self._closed:
+            raise RuntimeError("storage is closed")
+        try:
+            self._queue.put(item, timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            logger.error("SQLite write queue full, dropping write")
+            return False
+
+    def execute(self, sql, params=()):
+        """Queue a single write statement."""
+        return self._put(("one", sql, params))
+
+    def executemany(self, sql, rows):
+        """Queue a write statement applied to many parameter rows."""
+        return self._put(("many", sql, list(rows)))
+
+    def _blocking(self, fn, *args):
+        return self.offload(fn, *args) if self.offload else fn(*args)
+
+    def call(self, fn):
+        """Run fn(connection) on the writer thread inside its own transaction and return its result."""
+        return self._blocking(self._call, fn)
+
+    def _call(self, fn):
+        item = _Call(fn)
+        self._queue.put(item)
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def pending(self):
+        """Number of queued writes not yet picked up by the writer."""
+        return self._queue.qsize()
+
+    def flush(self):
+        """Block until every write queued so far has been committed."""
+        return self.call(lambda conn: None)
+
+    def _apply(self, item):
+        kind, sql, params = item
+        if kind == "one":
+            self._writer.execute(sql, params)
+        else:
+            self._writer.executemany(sql, params)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while len(batch) < self.batch_size and not isinstance(item, _Call) and item is not _STOP:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            writes = [i for i in batch if isinstance(i, tuple)]
+            if writes:
+                start = time.perf_counter()
+                for write in writes:
+                    try:
+                        self._apply(write)
+                    except sqlite3.Error as e:
+                        logger.error(f"SQLite write failed ({write[1]}): {e}")
+                try:
+                    self._writer.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"SQLite commit failed: {e}")
+                    self._writer.rollback()
+                if self.on_commit:
+                    self.on_commit(len(writes), time.perf_counter() - start)
+            last = batch[-1]
+            if isinstance(last, _Call):
+                try:
+                    last.result = last.fn(self._writer)
+                    self._writer.commit()
+                except Exception as e:
+                    self._writer.rollback()
+                    last.error = e
+                last.done.set()
+            elif last is _STOP:
+                return
+
+    def close(self):
+        """Flush queued writes, stop the writer and close all connections."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # -- reads ------------------------------------------------------------
+
+    @contextmanager
+    def reader(self):
+        """Borrow a read-only connection from the pool."""
+        start = time.perf_counter()
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self._read_uri, uri=True, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            if self._readers.qsize() < self._read_pool_size:
+                self._readers.put(conn)
+            else:
+                conn.close()
+            if self.on_read:
+                self.on_read(time.perf_counter() - start)
+
+    def read(self, fn):
+        """Run fn(connection) on a pooled read-only connection and return its result."""
+        return self._blocking(self._read, fn)
+
+    def _read(self, fn):
+        with self.reader() as conn:
+            return fn(conn)
+
+    def query(self, sql, params=()):
+        """Run a read query on a pooled connection and return all rows."""
+        return self.read(lambda conn: conn.execute(sql, params).fetchall())
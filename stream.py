@@ -0,0 +1,163 @@
+"""Snapshot-then-delta status streaming state for Socket.IO subscribers.
+
+Status is split into channels: ``system`` (service state, network info, the
+current provider) and one channel per provider URL (latest probe fields and
+recent samples). A subscriber gets a snapshot of each channel it joins and
+then only deltas: new samples and the fields that changed. Every channel
+update has a sequence number and each delta carries ``since``, the sequence
+it applies on top of, so a client can detect a gap and resubscribe.
+
+Clients acknowledge deltas. One that falls ``max_lag`` deltas behind is left
+out of the room broadcast. Once it has acknowledged everything it was sent,
+it gets a single coalesced delta covering all it missed.
+"""
+import json
+import threading
+import zlib
+from collections import deque
+
+SYSTEM = "system"
+
+
+def room(channel):
+    return f"status:{channel}"
+
+
+class _Channel:
+    def __init__(self, history_size):
+        self.seq = 0
+        self.fields = {}
+        self.samples = deque(maxlen=history_size)  # (seq, sample)
+
+
+class StatusStream:
+    """Per-channel sequence numbers, fields, sample history and per-client progress."""
+
+    def __init__(self, history_size=100, max_lag=2, compress_threshold=1024):
+        self.history_size = history_size
+        self.max_lag = max_lag
+        self.compress_threshold = compress_threshold
+        self._channels = {}
+        # sid -> {"compress": bool, "channels": {channel: {"sent": seq, "acked": seq}}}
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _channel(self, name):
+        channel = self._channels.get(name)
+        if channel is None:
+            channel = self._channels[name] = _Channel(self.history_size)
+        return channel
+
+    def _snapshot(self, name):
+        channel = self._channel(name)
+        return {"channel": name, "seq": channel.seq, "fields": dict(channel.fields),
+                "samples": [sample for _, sample in channel.samples], "history_size": self.history_size}
+
+    def _catch_up(self, name, progress):
+        """Coalesced delta from what the client was last sent to now, or a snapshot if history ran out."""
+        channel = self._channel(name)
+        since = progress["sent"]
+        progress["sent"] = channel.seq
+        if len(channel.samples) == channel.samples.maxlen and channel.samples[0][0] > since + 1:
+            # samples the client never got may have been evicted
+            return "snapshot", self._snapshot(name)
+        samples = [sample for seq, sample in channel.samples if seq > since]
+        return "delta", {"channel": name, "seq": channel.seq, "since": since, "samples": samples,
+                         "changed": dict(channel.fields), "coalesced": True}
+
+    def seed(self, name, samples, fields):
+        """Fill a channel nobody has updated yet, e.g. from the database before its first probe."""
+        with self._lock:
+            if name in self._channels:
+                return
+            channel = self._channel(name)
+            channel.fields.update(fields)
+            for sample in samples[-self.history_size:]:
+                channel.seq += 1
+                channel.samples.append((channel.seq, sample))
+
+    def known(self, name):
+        return name in self._channels
+
+    def subscribe(self, sid, channels, compress=False):
+        """Replace the client's channels; returns (left, joined, snapshots)."""
+        with self._lock:
+            client = self._clients.setdefault(sid, {"compress": False, "channels": {}})
+            client["compress"] = compress
+            left = [name for name in client["channels"] if name not in channels]
+            snapshots = []
+            for name in left:
+                del client["channels"][name]
+            for name in channels:
+                snapshot = self._snapshot(name)
+                client["channels"][name] = {"sent": snapshot["seq"], "acked": snapshot["seq"]}
+                snapshots.append(snapshot)
+            return left, list(channels), snapshots
+
+    def drop(self, sid):
+        with self._lock:
+            self._clients.pop(sid, None)
+
+    def update(self, name, sample, fields):
+        """Apply a new sample and/or fields to a channel.
+
+        Returns (delta, skip, catch_ups): the delta to broadcast to the
+        channel's room (None if nothing changed), the sids to leave out of
+        that broadcast, and (sid, event, payload) messages for lagging clients
+        that can be caught up now.
+        """
+        with self._lock:
+            channel = self._channel(name)
+            changed = {k: v for k, v in fields.items() if channel.fields.get(k, object()) != v}
+            if sample is None and not changed:
+                return None, [], []
+            channel.seq += 1
+            channel.fields.update(changed)
+            if sample is not None:
+                channel.samples.append((channel.seq, sample))
+            delta = {"channel": name, "seq": channel.seq, "since": channel.seq - 1,
+                     "samples": [sample] if sample is not None else [], "changed": changed}
+            skip, catch_ups = [], []
+            for sid, client in self._clients.items():
+                progress = client["channels"].get(name)
+                if progress is None:
+                    continue
+                if progress["sent"] == channel.seq - 1 and progress["sent"] - progress["acked"] < self.max_lag:
+                    progress["sent"] = channel.seq
+                    continue
+                skip.append(sid)
+                if progress["acked"] >= progress["sent"]:
+                    catch_ups.append((sid, *self._catch_up(name, progress)))
+            return delta, skip, catch_ups
+
+    def ack(self, sid, name, seq):
+        """Record an acknowledgement; returns an (event, payload) catch-up if the client is now due one."""
+        with self._lock:
+            client = self._clients.get(sid)
+            progress = client["channels"].get(name) if client else None
+            if progress is None:
+                return None
+            progress["acked"] = max(progress["acked"], min(seq, progress["sent"]))
+            if progress["acked"] >= progress["sent"] and progress["sent"] < self._channel(name).seq:
+                return self._catch_up(name, progress)
+            return None
+
+    def encode(self, sid, payload):
+        """The payload as sent to one client: deflated JSON bytes if it asked for compression and it is large."""
+        client = self._clients.get(sid)
+        if not client or not client["compress"]:
+            return payload
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        if len(body) < self.compress_threshold:
+            return payload
+        return {"encoding": "deflate", "data": zlib.compress(body)}
+
+    def stats(self):
+        with self._lock:
+            lagging = sum(1 for client in self._clients.values()
+                          for p in client["channels"].values() if p["sent"] > p["acked"])
+            return {"clients": len(self._clients), "lagging": lagging,
+                    "channels": {name: {"seq": c.seq, "samples": len(c.samples),
+                                        "subscribers": sum(1 for cl in self._clients.values()
+                                                           if name in cl["channels"])}
+                                 for name, c in self._channels.items()}}
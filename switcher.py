@@ -0,0 +1,197 @@
+"""Background jobs that switch the cloudflared upstream and verify the resolver comes back."""
+import itertools
+import subprocess
+import threading
+import time
+import uuid
+
+from dnslib import DNSRecord, RCODE
+
+from filecache import atomic_write
+
+EXEC_START = "ExecStart=/usr/bin/cloudflared proxy-dns --port 53 --upstream {url}\n"
+
+
+class SwitchInProgress(Exception):
+    """Raised when a switch is requested while another one is still running."""
+
+
+def read_exec_start(service_file):
+    """Return the current ExecStart line of the unit file (or None)."""
+    with open(service_file, "r") as file:
+        for line in file:
+            if line.strip().startswith("ExecStart="):
+                return line if line.endswith("\n") else line + "\n"
+    return None
+
+
+def write_exec_start(service_file, exec_start):
+    """Replace the ExecStart line of the unit file atomically."""
+    with open(service_file, "r") as file:
+        lines = file.readlines()
+    lines = [exec_start if line.strip().startswith("ExecStart=") else line for line in lines]
+    atomic_write(service_file, "".join(lines))
+
+
+def resolver_answers(host, port, name, timeout=1.0):
+    """True if the DNS server at host:port answers name with NOERROR and at least one record."""
+    try:
+        reply = DNSRecord.parse(DNSRecord.question(name).send(host, port, timeout=timeout))
+    except Exception:
+        return False
+    return reply.header.rcode == RCODE.NOERROR and bool(reply.rr)
+
+
+class SwitchJob:
+    """State of one provider switch, as reported by the progress API and events."""
+
+    def __init__(self, url, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.url = url
+        self.name = name
+        self.state = "pending"
+        self.steps = []
+        self.error = None
+        self.previous = None
+        self.started = time.time()
+        self.finished = None
+        self.ready_ms = None
+
+    @property
+    def done(self):
+        return self.state in ("ready", "rolled_back", "failed")
+
+    def as_dict(self):
+        return {
+            "id": self.id, "url": self.url, "name": self.name, "state": self.state,
+            "steps": list(self.steps), "error": self.error, "started": self.started,
+            "finished": self.finished, "ready_ms": self.ready_ms,
+        }
+
+
+class SwitchManager:
+    """Run provider switches one at a time in the background.
+
+    A job rewrites ExecStart, reloads systemd and restarts cloudflared. Then it
+    polls the local resolver until a query is answered. The restart empties
+    cloudflared's cache, so that answer has come through the new upstream. If
+    any step fails or the resolver is not ready within ``ready_timeout``
+    seconds, the previous ExecStart is restored and cloudflared restarted
+    again. ``spawn`` and ``sleep`` let the app run jobs as Socket.IO background
+    tasks; ``on_update`` is called with the job on every state change.
+    ``run`` (subprocess.run) and ``check`` (resolver_answers) can be wrapped
+    to keep the blocking steps off the event loop.
+    """
+
+    def __init__(self, service_file, resolver=("127.0.0.1", 53), probe_name="example.com",
+                 ready_timeout=20, poll_interval=0.25, spawn=None, sleep=time.sleep,
+                 on_update=None, run=subprocess.run, check=resolver_answers, history=50):
+        self.service_file = service_file
+        self.resolver = resolver
+        self.probe_name = probe_name
+        self.ready_timeout = ready_timeout
+        self.poll_interval = poll_interval
+        self.spawn = spawn or (lambda fn, *args: threading.Thread(target=fn, args=args, daemon=True).start())
+        self.sleep = sleep
+        self.on_update = on_update
+        self.run = run
+        self.check = check
+        self.history = history
+        self._jobs = {}
+        self._order = itertools.count()
+        self._active = None
+        self._lock = threading.Lock()
+
+    def submit(self, url, name=None):
+        """Start switching to url; raises SwitchInProgress if a switch is already running."""
+        with self._lock:
+            if self._active is not None and not self._active.done:
+                raise SwitchInProgress(f"switch to {self._active.name or self._active.url} is still running")
+            job = self._remember(SwitchJob(url, name))
+            self._active = job
+        self.spawn(self._execute, job)
+        return job
+
+    def swap(self, url, name, apply):
+        """Record a switch done in-process by apply(url), e.g. by the DNS forwarder, as a finished job."""
+        with self._lock:
+            job = self._remember(SwitchJob(url, name))
+        start = time.monotonic()
+        try:
+            apply(url)
+        except Exception as e:
+            job.error = str(e) or e.__class__.__name__
+            job.finished = time.time()
+            self._update(job, "failed", "Upstream swap failed")
+            raise
+        job.ready_ms = round((time.monotonic() - start) * 1000, 1)
+        job.finished = time.time()
+        self._update(job, "ready", "Forwarder upstream swapped")
+        return job
+
+    def _remember(self, job):
+        self._jobs[job.id] = (next(self._order), job)
+        if len(self._jobs) > self.history:
+            oldest = min(self._jobs, key=lambda job_id: self._jobs[job_id][0])
+            del self._jobs[oldest]
+        return job
+
+    def get(self, job_id):
+        entry = self._jobs.get(job_id)
+        return entry[1] if entry else None
+
+    def jobs(self):
+        return [job for _, job in sorted(self._jobs.values(), key=lambda entry: entry[0])]
+
+    def _update(self, job, state, step=None):
+        job.state = state
+        if step:
+            job.steps.append({"time": time.time(), "step": step})
+        if self.on_update:
+            self.on_update(job)
+
+    def _restart(self):
+        self.run(["sudo", "systemctl", "daemon-reload"], check=True)
+        self.run(["sudo", "systemctl", "restart", "cloudflared"], check=True)
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + self.ready_timeout
+        while time.monotonic() < deadline:
+            if self.check(self.resolver[0], self.resolver[1], self.probe_name):
+                return True
+            self.sleep(self.poll_interval)
+        return False
+
+    def _execute(self, job):
+        start = time.monotonic()
+        try:
+            job.previous = read_exec_start(self.service_file)
+            self._update(job, "writing", "Updating service file")
+            write_exec_start(self.service_file, EXEC_START.format(url=job.url))
+            self._update(job, "restarting", "Restarting cloudflared")
+            self._restart()
+            self._update(job, "verifying", "Waiting for the local resolver to answer")
+            if not self._wait_ready():
+                raise TimeoutError(f"resolver did not answer within {self.ready_timeout}s")
+            job.ready_ms = round((time.monotonic() - start) * 1000, 1)
+            job.finished = time.time()
+            self._update(job, "ready", f"Resolver ready after {job.ready_ms} ms")
+        except Exception as e:
+            job.error = str(e) or e.__class__.__name__
+            self._rollback(job)
+
+    def _rollback(self, job):
+        if job.previous is None:
+            job.finished = time.time()
+            self._update(job, "failed", "No previous ExecStart to restore")
+            return
+        try:
+            self._update(job, "rolling_back", "Restoring previous ExecStart")
+            write_exec_start(self.service_file, job.previous)
+            self._restart()
+            job.finished = time.time()
+            self._update(job, "rolled_back", "Previous upstream restored")
+        except Exception as e:
+            job.error = f"{job.error}; rollback failed: {e}"
+            job.finished = time.time()
+            self._update(job, "failed", "Rollback failed")
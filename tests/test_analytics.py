@@ -0,0 +1,46 @@
+import random
+import sqlite3
+
+import pytest
+
+import analytics
+import rollups
+import sketch
+from ringbuffer import RingBuffer
+
+NOW = 1_000_000
+RETENTION = {"raw": 86400, "1m": 172800, "1h": 90 * 86400, "1d": 730 * 86400}
+
+
+def window(samples):
+    """The same samples in a ring buffer and in an SQLite ping_history table."""
+    buffer = RingBuffer(len(samples))
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE ping_history (id INTEGER PRIMARY KEY, provider TEXT, ts INTEGER, ping REAL,"
+                 " doh_ok INTEGER, ping_key INTEGER)")
+    rollups.create_schema(conn)
+    for ts, ping in samples:
+        buffer.append(ts, ping, True)
+        conn.execute("INSERT INTO ping_history(provider, ts, ping, doh_ok, ping_key) VALUES ('p', ?, ?, 1, ?)",
+                     (ts, ping, sketch.key(ping)))
+    return buffer, conn
+
+
+@pytest.mark.parametrize("n", [1, 2, 5, 10, 37, 200])
+def test_memory_and_sql_report_the_same_rank(n):
+    rng = random.Random(n)
+    samples = [(NOW - 10 * (n - i), round(rng.uniform(5, 500), 2)) for i in range(n)]
+    buffer, conn = window(samples)
+    since = NOW - 10 * n
+    memory = analytics.buffer_stats(buffer, since, NOW)
+    sql = analytics.window_stats(conn, "p", since, NOW, RETENTION)
+    assert memory["count"] == sql["count"] == n
+    for q in ("p50", "p90", "p99"):
+        # the sketch reports the bucket of the very sample the memory path picks
+        expected = min(max(round(sketch.value(sketch.key(memory[q])), 2), memory["min"]), memory["max"])
+        assert sql[q] == expected
+
+
+def test_rank_is_nearest_rank():
+    assert [sketch.rank(q, 10) for q in (0.5, 0.9, 0.99)] == [4, 8, 9]
+    assert sketch.rank(0.5, 1) == 0
@@ -0,0 +1,59 @@
+from autoselect import AutoSelector
+
+CURRENT, FAST, OTHER = "https://current.test/dns-query", "https://fast.test/dns-query", "https://other.test/dns-query"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def scored_selector(clock, latencies):
+    selector = AutoSelector(sustain=0, dwell=600, min_samples=1, clock=clock)
+    for url, latency in latencies.items():
+        selector.observe(url, latency, True)
+    return selector
+
+
+def test_switches_to_clearly_better_provider():
+    selector = scored_selector(Clock(), {CURRENT: 100, FAST: 10})
+    decision = selector.evaluate(CURRENT, [CURRENT, FAST])
+    assert decision["action"] == "switch"
+    assert decision["best"] == FAST
+
+
+def test_failed_switch_is_not_retried_until_the_cooldown_ends():
+    clock = Clock()
+    selector = scored_selector(clock, {CURRENT: 100, FAST: 10})
+    assert selector.evaluate(CURRENT, [CURRENT, FAST])["action"] == "switch"
+    selector.failed(FAST)
+    assert selector.state()["cooling"] == [FAST]
+    for _ in range(5):
+        clock.now += 60
+        decision = selector.evaluate(CURRENT, [CURRENT, FAST])
+        assert decision["action"] == "stay"
+        assert decision["best"] == CURRENT
+    clock.now += 600
+    assert selector.evaluate(CURRENT, [CURRENT, FAST])["action"] == "switch"
+    assert selector.state()["cooling"] == []
+
+
+def test_failed_switch_leaves_other_providers_eligible():
+    selector = scored_selector(Clock(), {CURRENT: 100, FAST: 10, OTHER: 20})
+    selector.failed(FAST)
+    decision = selector.evaluate(CURRENT, [CURRENT, FAST, OTHER])
+    assert decision["action"] == "switch"
+    assert decision["best"] == OTHER
+
+
+def test_dwell_holds_after_a_switch():
+    clock = Clock()
+    selector = scored_selector(clock, {CURRENT: 100, FAST: 10})
+    selector.switched()
+    clock.now += 60
+    assert selector.evaluate(CURRENT, [CURRENT, FAST])["action"] == "wait"
+    clock.now += 600
+    assert selector.evaluate(CURRENT, [CURRENT, FAST])["action"] == "switch"
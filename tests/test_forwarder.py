@@ -0,0 +1,32 @@
+from dnslib import A, DNSRecord, QTYPE, RR
+
+from doh import DNS_MESSAGE
+from forwarder import Forwarder
+
+UPSTREAM = "https://upstream.test/dns-query"
+
+
+class FakePool:
+    def __init__(self):
+        self.queries = []
+
+    def query(self, url, wire, method="POST", timeout=None):
+        query = DNSRecord.parse(wire)
+        self.queries.append(str(query.q.qname))
+        reply = query.reply()
+        reply.add_answer(RR(query.q.qname, QTYPE.A, rdata=A("192.0.2.1"), ttl=300))
+        return {"status": 200, "content_type": DNS_MESSAGE, "body": reply.pack(), "total_ms": 1.0}
+
+
+def test_cached_reply_echoes_each_clients_question():
+    pool = FakePool()
+    forwarder = Forwarder(pool, UPSTREAM)
+    first = forwarder.resolve(DNSRecord.question("Example.COM", "A"))
+    second_query = DNSRecord.question("eXaMpLe.com", "A")
+    second = forwarder.resolve(second_query)
+    assert pool.queries == ["Example.COM."]
+    assert str(first.q.qname) == "Example.COM."
+    assert str(second.q.qname) == "eXaMpLe.com."
+    assert second.header.id == second_query.header.id
+    assert [str(rr.rdata) for rr in second.rr] == ["192.0.2.1"]
+    assert forwarder.stats()["hits"] == 1
@@ -0,0 +1,223 @@
+import os
+import subprocess
+import threading
+import time
+
+import pytest
+
+import introspect
+from bench.fixtures import SYSTEM_FILES
+from filecache import CachedFile, FileWatcher, atomic_write
+from introspect import Introspector, parse_local_addresses, parse_nameservers, parse_routes
+
+UNIT_PROCS = "sys/fs/cgroup/system.slice/cloudflared.service/cgroup.procs"
+
+
+def write_tree(root, files):
+    for relative, content in files.items():
+        path = os.path.join(root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write(content)
+
+
+@pytest.fixture
+def system_root(tmp_path):
+    write_tree(tmp_path, SYSTEM_FILES)
+    return str(tmp_path)
+
+
+class StubBus:
+    def __init__(self, state=None, error=None):
+        self.state = state
+        self.error = error
+        self.calls = []
+
+    def active_state(self, unit):
+        self.calls.append(unit)
+        if self.error:
+            raise self.error
+        return self.state
+
+
+class StubRun:
+    def __init__(self, returncode):
+        self.returncode = returncode
+        self.commands = []
+
+    def __call__(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        return subprocess.CompletedProcess(cmd, self.returncode)
+
+
+def no_systemctl(cmd, **kwargs):
+    raise AssertionError(f"unexpected command {cmd}")
+
+
+# -- service state ----------------------------------------------------------
+
+@pytest.mark.parametrize("state, active", [("active", True), ("inactive", False), ("activating", False)])
+def test_service_active_from_bus(system_root, state, active):
+    bus = StubBus(state)
+    introspector = Introspector(root=system_root, bus=bus, run=no_systemctl)
+    assert introspector.service_active() is active
+    assert introspector.source == "dbus"
+    assert bus.calls == ["cloudflared.service"]
+
+
+def test_bus_error_falls_back_to_cgroup(system_root):
+    introspector = Introspector(root=system_root, bus=StubBus(error=ConnectionError("no bus")), run=no_systemctl)
+    assert introspector.service_active() is True
+    assert introspector.source == "cgroup"
+
+
+def test_empty_cgroup_means_inactive(system_root):
+    write_tree(system_root, {UNIT_PROCS: ""})
+    introspector = Introspector(root=system_root, bus=StubBus(error=TimeoutError()), run=no_systemctl)
+    assert introspector.service_active() is False
+    assert introspector.source == "cgroup"
+
+
+def test_missing_unit_cgroup_means_inactive(system_root):
+    os.remove(os.path.join(system_root, UNIT_PROCS))
+    introspector = Introspector(root=system_root, bus=None, run=no_systemctl)
+    assert introspector.service_active() is False
+    assert introspector.source == "cgroup"
+
+
+@pytest.mark.parametrize("returncode, active", [(0, True), (3, False)])
+def test_no_bus_or_cgroup_falls_back_to_systemctl(tmp_path, returncode, active):
+    run = StubRun(returncode)
+    introspector = Introspector(root=str(tmp_path), bus=StubBus(error=ConnectionError()), run=run)
+    assert introspector.service_active() is active
+    assert introspector.source == "systemctl"
+    assert run.commands == [["systemctl", "is-active", "--quiet", "cloudflared"]]
+
+
+# -- network info -----------------------------------------------------------
+
+def test_network_info_from_fixture_tree(system_root):
+    info = Introspector(root=system_root, bus=None, run=no_systemctl).network_info()
+    assert info == {"local_ip": "192.0.2.10", "gateway": "192.0.2.1", "dns_servers": ["127.0.0.53"]}
+
+
+def test_network_info_prefers_longest_prefix(system_root):
+    routes = SYSTEM_FILES["proc/net/route"] + (
+        # 8.8.8.0/24 via 198.51.100.1 on eth1, which has 198.51.100.7
+        "eth1\t00080808\t016433C6\t0003\t0\t0\t200\t00FFFFFF\t0\t0\t0\n"
+        "eth1\t006433C6\t00000000\t0001\t0\t0\t200\t00FFFFFF\t0\t0\t0\n"
+    )
+    fib_trie = SYSTEM_FILES["proc/net/fib_trie"] + "        |-- 198.51.100.7\n           /32 host LOCAL\n"
+    write_tree(system_root, {"proc/net/route": routes, "proc/net/fib_trie": fib_trie})
+    introspector = Introspector(root=system_root, bus=None, run=no_systemctl)
+    assert introspector.network_info("8.8.8.8")["gateway"] == "198.51.100.1"
+    assert introspector.network_info("8.8.8.8")["local_ip"] == "198.51.100.7"
+    assert introspector.network_info("1.1.1.1")["gateway"] == "192.0.2.1"
+
+
+def test_network_info_without_route(tmp_path):
+    info = Introspector(root=str(tmp_path), bus=None, run=no_systemctl).network_info()
+    assert info == {"local_ip": None, "gateway": None, "dns_servers": []}
+
+
+def test_parsers_skip_down_routes_and_non_local_addresses():
+    routes = parse_routes(SYSTEM_FILES["proc/net/route"] + "eth2\t00000000\t01010101\t0000\t0\t0\t0\t00000000\t0\t0\t0\n")
+    assert [(str(r["network"]), r["gateway"], r["iface"]) for r in routes] == [
+        ("0.0.0.0/0", "192.0.2.1", "eth0"), ("192.0.2.0/24", None, "eth0")]
+    assert parse_local_addresses(SYSTEM_FILES["proc/net/fib_trie"]) == ["192.0.2.10"]
+    assert parse_nameservers("# comment\nnameserver 1.1.1.1\nsearch lan\nnameserver ::1\n") == ["1.1.1.1", "::1"]
+
+
+# -- cached files -----------------------------------------------------------
+
+def test_cached_file_reparses_on_change(tmp_path):
+    path = tmp_path / "resolv.conf"
+    parses = []
+    cached = CachedFile(str(path), lambda text: parses.append(text) or parse_nameservers(text))
+    assert cached.get() == []
+    path.write_text("nameserver 1.1.1.1\n")
+    assert cached.get() == ["1.1.1.1"]
+    assert cached.get() == ["1.1.1.1"]
+    assert len(parses) == 2
+    atomic_write(str(path), "nameserver 9.9.9.9\nnameserver 8.8.8.8\n")
+    assert cached.get() == ["9.9.9.9", "8.8.8.8"]
+
+
+def test_watched_cached_file_trusts_value_until_invalidated(tmp_path):
+    path = tmp_path / "resolv.conf"
+    path.write_text("nameserver 1.1.1.1\n")
+    cached = CachedFile(str(path), parse_nameservers)
+    cached.watched = True
+    assert cached.get() == ["1.1.1.1"]
+    path.write_text("nameserver 9.9.9.9\n")
+    assert cached.get() == ["1.1.1.1"]
+    cached.invalidate()
+    assert cached.get() == ["9.9.9.9"]
+
+
+def test_atomic_write_modes(tmp_path):
+    previous = os.umask(0o027)
+    try:
+        atomic_write(str(tmp_path / "new.conf"), "a\n")
+        existing = tmp_path / "existing.conf"
+        existing.write_text("old\n")
+        existing.chmod(0o604)
+        atomic_write(str(existing), "new\n")
+    finally:
+        os.umask(previous)
+    assert (tmp_path / "new.conf").stat().st_mode & 0o777 == 0o640
+    assert existing.stat().st_mode & 0o777 == 0o604
+    assert existing.read_text() == "new\n"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["existing.conf", "new.conf"]
+
+def test_file_watcher_invalidates_on_replace(tmp_path):
+    watcher = FileWatcher()
+    if not watcher.available:
+        pytest.skip("inotify is not available")
+    path = tmp_path / "resolv.conf"
+    path.write_text("nameserver 1.1.1.1\n")
+    cached = CachedFile(str(path), parse_nameservers)
+    assert watcher.watch(cached)
+    assert cached.get() == ["1.1.1.1"]
+    atomic_write(str(path), "nameserver 9.9.9.9\n")
+    deadline = time.monotonic() + 2
+    while cached.get() != ["9.9.9.9"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cached.get() == ["9.9.9.9"]
+
+
+# -- systemd bus ------------------------------------------------------------
+
+def test_systemd_bus_serializes_calls(monkeypatch):
+    pytest.importorskip("jeepney")
+    from jeepney.low_level import HeaderFields
+
+    class FakeConnection:
+        def __init__(self):
+            self.active = 0
+            self.overlapped = False
+
+        def send_and_get_reply(self, message, timeout=None):
+            self.active += 1
+            self.overlapped |= self.active > 1
+            time.sleep(0.01)
+            self.active -= 1
+            member = message.header.fields[HeaderFields.member]
+            body = ("/org/freedesktop/systemd1/unit/x",) if member == "LoadUnit" else (("s", "active"),)
+            return type("Reply", (), {"body": body})()
+
+        def close(self):
+            pass
+
+    conn = FakeConnection()
+    monkeypatch.setattr(introspect, "open_dbus_connection", lambda bus: conn)
+    bus = introspect.SystemdBus()
+    states = []
+    threads = [threading.Thread(target=lambda: states.append(bus.active_state("cloudflared.service")))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert states == ["active"] * 4
+    assert not conn.overlapped
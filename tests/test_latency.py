@@ -0,0 +1,66 @@
+import socket
+import time
+
+import pytest
+
+import latency
+
+
+@pytest.fixture
+def listener():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(16)
+    yield sock.getsockname()[1]
+    sock.close()
+
+
+@pytest.fixture
+def closed_port():
+    # bound but never listening: connects are refused with a RST
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    yield sock.getsockname()[1]
+    sock.close()
+
+
+def test_tcp_rtts_local_listener(listener):
+    rtts = latency.tcp_rtts("127.0.0.1", listener, samples=3, timeout=2)
+    assert len(rtts) == 3
+    assert all(rtt >= 0 for rtt in rtts)
+
+
+def test_measure_tcp_summary(listener):
+    stats = latency.measure("127.0.0.1", port=listener, samples=4, timeout=2, method="tcp")
+    assert stats["method"] == "tcp"
+    assert stats["sent"] == 4 and stats["received"] == 4 and stats["loss"] == 0
+    assert stats["min"] <= stats["avg"] <= stats["max"]
+    assert stats["jitter"] is not None
+
+
+def test_tcp_rtts_closed_port_fails_fast(closed_port):
+    start = time.perf_counter()
+    rtts = latency.tcp_rtts("127.0.0.1", closed_port, samples=3, timeout=2)
+    assert rtts == []
+    assert time.perf_counter() - start < 1
+
+
+def test_measure_closed_port_reports_failure(closed_port):
+    stats = latency.measure("127.0.0.1", port=closed_port, samples=3, timeout=2, method="tcp")
+    assert stats["received"] == 0 and stats["loss"] == 1.0
+    assert stats["avg"] is None
+
+
+def test_measure_falls_back_to_tcp_without_icmp_permission(listener, monkeypatch):
+    def denied(*args, **kwargs):
+        raise PermissionError("ping_group_range")
+
+    monkeypatch.setattr(latency, "icmp_rtts", denied)
+    stats = latency.measure("127.0.0.1", port=listener, samples=2, timeout=2, method="icmp")
+    assert stats["method"] == "tcp"
+    assert stats["received"] == 2
+
+
+def test_summarize_empty():
+    assert latency.summarize([], 0) == {"sent": 0, "received": 0, "loss": None, "min": None, "avg": None,
+                                        "max": None, "jitter": None}
@@ -0,0 +1,47 @@
+import sqlite3
+
+import pytest
+
+import rollups
+import sketch
+
+DAY = 86400
+NOW = 100 * DAY + 5 * 3600 + 1234  # 05:20:34 on day 100, so the newest day and hour are still open
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE ping_history (id INTEGER PRIMARY KEY, provider TEXT, ts INTEGER, ping REAL,"
+                 " doh_ok INTEGER, ping_key INTEGER)")
+    rollups.create_schema(conn)
+    # one sample a minute for three days, every tenth one failed
+    rows = [("p", ts, None if i % 10 == 0 else 10.0 + i % 7, int(i % 10 != 0))
+            for i, ts in enumerate(range(NOW - 3 * DAY, NOW, 60))]
+    conn.executemany("INSERT INTO ping_history(provider, ts, ping, doh_ok, ping_key) VALUES (?, ?, ?, ?, ?)",
+                     [row + (None if row[2] is None else sketch.key(row[2]),) for row in rows])
+    rollups.roll_up(conn, NOW)
+    return conn
+
+
+def raw_count(conn, since):
+    return conn.execute("SELECT COUNT(*) FROM ping_history WHERE ts >= ?", (since,)).fetchone()[0]
+
+
+@pytest.mark.parametrize("resolution, width", [("1m", 60), ("1h", 3600), ("1d", DAY)])
+def test_fetch_includes_buckets_past_the_watermark(conn, resolution, width):
+    since = (NOW - 2 * DAY) // width * width
+    points = rollups.fetch(conn, "p", resolution, since)
+    assert rollups.watermarks(conn)[resolution] <= NOW // width * width
+    assert points[-1]["bucket"] == (NOW - 60) // width * width  # the newest sample
+    buckets = [p["bucket"] for p in points]
+    assert buckets == sorted(set(buckets))
+    assert sum(p["count"] for p in points) == raw_count(conn, since)
+
+
+def test_fetch_before_any_rollup_reads_raw_samples(conn):
+    for table in rollups.all_tables() + ["rollup_state"]:
+        conn.execute(f"DELETE FROM {table}")
+    points = rollups.fetch(conn, "p", "1d", NOW - DAY)
+    assert [p["bucket"] for p in points] == [99 * DAY, 100 * DAY]
+    assert sum(p["count"] for p in points) == raw_count(conn, NOW - DAY)